@@ -0,0 +1,129 @@
+"""
+Measure check-in latency against a large borrow state history.
+
+Every round checks out and checks in a single item through the API, timing
+the check-in request only. The benchmark runs once without and once with the
+borrow state indexes. With --open, other users keep that many units of the
+item borrowed meanwhile.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_checkin [--history 200000] [--open 0] [--rounds 50]
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+from inventorymgr import create_app
+from inventorymgr.db import create_indexes, db
+from inventorymgr.db.aggregates import rebuild_aggregates
+from inventorymgr.db.models import BorrowableItem, BorrowState, User
+
+
+def populate(history, open_count, item_count, user_count):
+    db.session.add_all(
+        User(username=f"user_{i}", password="unused", manage_checkouts=True)
+        for i in range(user_count)
+    )
+    db.session.add_all(
+        BorrowableItem(name=f"item_{i}", quantity_total=1000, quantity_in_stock=1000)
+        for i in range(item_count)
+    )
+    db.session.commit()
+    received_at = datetime.datetime(2020, 1, 1)
+    returned_at = datetime.datetime(2020, 1, 2)
+    for start in range(0, history, 10000):
+        db.session.execute(
+            BorrowState.__table__.insert(),
+            [
+                {
+                    "borrowing_user_id": i % user_count + 1,
+                    "borrowed_item_id": i % item_count + 1,
+                    "quantity": 1,
+                    "received_at": received_at,
+                    "returned_at": returned_at,
+                }
+                for i in range(start, min(start + 10000, history))
+            ],
+        )
+    if open_count:
+        db.session.execute(
+            BorrowState.__table__.insert(),
+            [
+                {
+                    "borrowing_user_id": i % (user_count - 1) + 2,
+                    "borrowed_item_id": 1,
+                    "quantity": 1,
+                    "received_at": received_at,
+                }
+                for i in range(open_count)
+            ],
+        )
+    rebuild_aggregates()
+    db.session.commit()
+
+
+def drop_borrow_state_indexes():
+    for table in (BorrowState.__table__, db.Model.metadata.tables["transfer_request"]):
+        for index in table.indexes:
+            index.drop(bind=db.engine)
+
+
+def time_checkins(app, rounds):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+    items = [{"id": 1, "count": 1}]
+    timings = []
+    for _ in range(rounds):
+        response = client.post(
+            "/api/v1/borrowstates/checkout",
+            json={"borrowing_user_id": 1, "borrowed_item_ids": items},
+        )
+        assert response.status_code == 200, response.json
+        start = time.perf_counter()
+        response = client.post(
+            "/api/v1/borrowstates/checkin", json={"user_id": 1, "item_ids": items}
+        )
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.json
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history", type=int, default=200000)
+    parser.add_argument("--open", type=int, default=0)
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp()
+    try:
+        app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}"})
+        with app.app_context():
+            db.create_all()
+            populate(args.history, args.open, args.items, args.users)
+            drop_borrow_state_indexes()
+
+        print(f"{'indexes':<10}{'median':>10}{'p95':>10}")
+        for label in ("without", "with"):
+            if label == "with":
+                with app.app_context():
+                    create_indexes()
+            timings = sorted(time_checkins(app, args.rounds))
+            median = statistics.median(timings) * 1000
+            p95 = timings[int(len(timings) * 0.95) - 1] * 1000
+            print(f"{label:<10}{median:>8.2f}ms{p95:>8.2f}ms")
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measure checkout throughput of concurrent desks competing for stock.
+
+Each desk is a thread with its own client checking out single units of
+random items until all attempts are done. At the end, the stock and the
+open borrow states are compared to make sure nothing was oversold.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_checkout [--desks 8] [--items 20] [--stock 50]
+"""
+
+import argparse
+import concurrent.futures
+import os
+import random
+import tempfile
+import time
+
+from werkzeug.security import generate_password_hash
+
+from inventorymgr import create_app
+from inventorymgr.db import db
+from inventorymgr.db.models import BorrowableItem, BorrowState, User
+
+
+def populate(item_count, stock):
+    db.session.add(
+        User(
+            username="desk",
+            password=generate_password_hash("desk"),
+            manage_checkouts=True,
+        )
+    )
+    db.session.add_all(
+        BorrowableItem(name=f"item_{i}", quantity_total=stock, quantity_in_stock=stock)
+        for i in range(item_count)
+    )
+    db.session.commit()
+
+
+def desk(app, item_count, attempts, seed):
+    rng = random.Random(seed)
+    client = app.test_client()
+    client.post("/api/v1/auth/login", json={"username": "desk", "password": "desk"})
+    statuses = []
+    for _ in range(attempts):
+        response = client.post(
+            "/api/v1/borrowstates/checkout",
+            json={
+                "borrowing_user_id": 1,
+                "borrowed_item_ids": [{"id": rng.randint(1, item_count), "count": 1}],
+            },
+        )
+        statuses.append(response.status_code)
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--desks", type=int, default=8)
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--stock", type=int, default=50)
+    parser.add_argument("--attempts", type=int, default=200)
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp()
+    try:
+        app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}"})
+        with app.app_context():
+            db.create_all()
+            populate(args.items, args.stock)
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.desks) as pool:
+            results = pool.map(
+                desk,
+                [app] * args.desks,
+                [args.items] * args.desks,
+                [args.attempts] * args.desks,
+                range(args.desks),
+            )
+            statuses = [status for result in results for status in result]
+        elapsed = time.perf_counter() - start
+
+        with app.app_context():
+            stock = [item.quantity_in_stock for item in BorrowableItem.query]
+            borrowed = sum(bs.quantity for bs in BorrowState.query)
+        succeeded = statuses.count(200)
+        print(f"attempts    {len(statuses)}")
+        print(f"succeeded   {succeeded}")
+        print(f"sold out    {statuses.count(400)}")
+        print(f"other       {len(statuses) - succeeded - statuses.count(400)}")
+        print(f"throughput  {len(statuses) / elapsed:.0f} checkouts/s")
+        assert min(stock) >= 0, "stock was oversold"
+        assert borrowed == succeeded
+        assert sum(stock) + borrowed == args.items * args.stock, "updates were lost"
+        print("no overselling")
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
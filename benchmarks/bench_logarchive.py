@@ -0,0 +1,139 @@
+"""
+Measure the size of archived logs and the latency of reading them.
+
+The database is filled with a log history, all but the last day of which is
+moved to segment files by compaction. Then the size of the segments is
+compared to the size of the log tables before, and pages of GET /api/v1/logs
+are timed in the database, at the newest archived entries and deep in the
+archive.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_logarchive [--logs 200000]
+"""
+
+import argparse
+import datetime
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from inventorymgr import create_app
+from inventorymgr.db import db
+from inventorymgr.db.models import BorrowableItem, LogEntry, User
+from inventorymgr.db.retention import compact
+
+
+def populate(start, logs, items, users):
+    db.session.add_all(
+        User(username=f"user_{i}", password="unused") for i in range(users)
+    )
+    db.session.add_all(BorrowableItem(name=f"item_{i}") for i in range(items))
+    db.session.commit()
+    items_table = LogEntry.items.property.secondary
+    for offset in range(0, logs, 10000):
+        ids = range(offset + 1, min(offset + 10000, logs) + 1)
+        db.session.execute(
+            LogEntry.__table__.insert(),
+            [
+                {
+                    "id": i,
+                    "timestamp": start + datetime.timedelta(minutes=i),
+                    "action": "checkout" if i % 2 else "checkin",
+                    "subject_id": i % users + 1,
+                    "secondary_id": None,
+                }
+                for i in ids
+            ],
+        )
+        db.session.execute(
+            items_table.insert(),
+            [
+                {"logentry_id": i, "item_id": (i + k) % items + 1}
+                for i in ids
+                for k in range(i % 3 + 1)
+            ],
+        )
+    db.session.commit()
+
+
+def log_tables_size():
+    return sum(
+        size
+        for size, in db.session.execute(
+            "SELECT SUM(pgsize) FROM dbstat "
+            "WHERE name IN ('log_entry', 'logentry_items') "
+            "OR name LIKE 'ix_log_entry%' OR name LIKE 'ix_logentry_items%'"
+        )
+        if size
+    )
+
+
+def time_pages(client, url, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.json
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logs", type=int, default=200000)
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp()
+    archive_path = tempfile.mkdtemp()
+    try:
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+                "LOGS_ARCHIVE_DIR": archive_path,
+                "RETENTION_LOGS_DAYS": 1,
+            }
+        )
+        end = datetime.datetime.utcnow()
+        start = end - datetime.timedelta(minutes=args.logs)
+        with app.app_context():
+            db.create_all()
+            populate(start, args.logs, args.items, args.users)
+            before = log_tables_size()
+            started = time.perf_counter()
+            moved = compact()["logs"]
+            seconds = time.perf_counter() - started
+        segments = sum(
+            os.path.getsize(os.path.join(archive_path, name))
+            for name in os.listdir(archive_path)
+        )
+        print(f"archived {moved} of {args.logs} logs in {seconds:.1f}s")
+        print(f"log tables {before / 1e6:.1f}MB, segments {segments / 1e6:.1f}MB")
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = 1
+        archived = end - datetime.timedelta(days=1, hours=1)
+        deep = start + datetime.timedelta(minutes=args.logs // 10)
+        for name, until in (
+            ("live", None),
+            ("newest archived", archived),
+            ("deep in archive", deep),
+        ):
+            url = "/api/v1/logs"
+            if until is not None:
+                url += f"?until={until:%Y-%m-%dT%H:%M:%S}"
+            print(f"{name}: median {time_pages(client, url, args.rounds):.2f}ms")
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+        shutil.rmtree(archive_path)
+
+
+if __name__ == "__main__":
+    main()
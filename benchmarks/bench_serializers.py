@@ -0,0 +1,110 @@
+"""
+Compare marshmallow's Schema.dump() with the precompiled serializers.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_serializers [--items 5000] [--users 2000]
+"""
+
+import argparse
+import datetime
+import json
+import timeit
+
+from inventorymgr import create_app
+from inventorymgr.api.models import (
+    BorrowableItemSchema,
+    BorrowStateSchema,
+    LogEntrySchema,
+    UserSchema,
+)
+from inventorymgr.api.serializers import dump_many
+from inventorymgr.db import db
+from inventorymgr.db.loaders import loader_options
+from inventorymgr.db.models import (
+    BorrowableItem,
+    BorrowState,
+    LogEntry,
+    Qualification,
+    User,
+)
+
+
+def populate(item_count, user_count):
+    qualifications = [Qualification(name=f"qualification_{i}") for i in range(5)]
+    items = [
+        BorrowableItem(
+            name=f"item_{i}",
+            description="x" * 200,
+            required_qualifications=qualifications[: i % 3],
+        )
+        for i in range(item_count)
+    ]
+    users = [
+        User(username=f"user_{i}", password="unused", qualifications=qualifications)
+        for i in range(user_count)
+    ]
+    now = datetime.datetime(2020, 1, 1)
+    db.session.add_all(qualifications + items + users)
+    db.session.add_all(
+        BorrowState(
+            borrowing_user=users[i % user_count],
+            borrowed_item=item,
+            quantity=1,
+            received_at=now,
+        )
+        for i, item in enumerate(items)
+    )
+    db.session.add_all(
+        LogEntry(
+            timestamp=now,
+            action="checkout",
+            subject=users[i % user_count],
+            items=[item],
+        )
+        for i, item in enumerate(items)
+    )
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    with app.app_context():
+        db.create_all()
+        populate(args.items, args.users)
+        cases = [
+            (BorrowableItem, BorrowableItemSchema(many=True)),
+            (User, UserSchema(many=True)),
+            (BorrowState, BorrowStateSchema(many=True)),
+            (LogEntry, LogEntrySchema(many=True)),
+        ]
+        header = ("schema", "rows", "marshmallow", "compiled", "speedup")
+        print("{:<22}{:>6}{:>14}{:>12}{:>9}".format(*header))
+        for model, schema in cases:
+            objs = model.query.options(*loader_options(model, schema)).all()
+            assert json.dumps(schema.dump(objs), sort_keys=True) == json.dumps(
+                dump_many(schema, objs), sort_keys=True
+            )
+            marshmallow_time = min(
+                timeit.repeat(lambda: schema.dump(objs), number=1, repeat=args.repeat)
+            )
+            compiled_time = min(
+                timeit.repeat(
+                    lambda: dump_many(schema, objs), number=1, repeat=args.repeat
+                )
+            )
+            print(
+                f"{type(schema).__name__:<22}{len(objs):>6}"
+                f"{marshmallow_time * 1000:>12.1f}ms{compiled_time * 1000:>10.1f}ms"
+                f"{marshmallow_time / compiled_time:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Measure the latency of the inventory statistics endpoint.
+
+The database is filled with a borrow state history of which a fraction is
+still open, spread over items and users, and the open borrow aggregates are
+rebuilt. Then GET /api/v1/stats/inventory is timed.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_stats [--history 100000] [--open 10000]
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+from inventorymgr import create_app
+from inventorymgr.db import db
+from inventorymgr.db.aggregates import rebuild_aggregates
+from inventorymgr.db.models import BorrowableItem, BorrowState, User
+
+
+def populate(history, open_count, item_count, user_count):
+    db.session.add_all(
+        User(username=f"user_{i}", password="unused", manage_checkouts=True)
+        for i in range(user_count)
+    )
+    db.session.add_all(
+        BorrowableItem(name=f"item_{i}", quantity_total=1000, quantity_in_stock=1000)
+        for i in range(item_count)
+    )
+    db.session.commit()
+    start_date = datetime.datetime(2020, 1, 1)
+    for start in range(0, history, 10000):
+        db.session.execute(
+            BorrowState.__table__.insert(),
+            [
+                {
+                    "borrowing_user_id": i % user_count + 1,
+                    "borrowed_item_id": i % item_count + 1,
+                    "quantity": 1,
+                    "received_at": start_date + datetime.timedelta(minutes=i),
+                    "returned_at": None
+                    if i >= history - open_count
+                    else start_date + datetime.timedelta(minutes=i + 60),
+                }
+                for i in range(start, min(start + 10000, history))
+            ],
+        )
+    rebuild_aggregates()
+    db.session.commit()
+
+
+def time_requests(app, rounds):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = client.get("/api/v1/stats/inventory")
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.json
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history", type=int, default=100000)
+    parser.add_argument("--open", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    db_fd, db_path = tempfile.mkstemp()
+    try:
+        app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}"})
+        with app.app_context():
+            db.create_all()
+            populate(args.history, args.open, args.items, args.users)
+
+        timings = sorted(time_requests(app, args.rounds))
+        median = statistics.median(timings) * 1000
+        p95 = timings[int(len(timings) * 0.95) - 1] * 1000
+        print(f"borrow states {args.history}, open {args.open}")
+        print(f"median {median:.2f}ms, p95 {p95:.2f}ms")
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    main()
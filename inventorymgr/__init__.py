@@ -5,13 +5,12 @@ create_app()
     The flask application factory.
 """
 
-
 import os
 from typing import Any, Dict, Optional
 
 from flask import Flask
 from marshmallow import ValidationError
-from sqlalchemy import event  # type: ignore
+from sqlalchemy.orm.exc import StaleDataError  # type: ignore
 
 
 def create_app(test_config: Optional[Dict[str, Any]] = None) -> Flask:
@@ -28,6 +27,44 @@ def create_app(test_config: Optional[Dict[str, Any]] = None) -> Flask:
         SQLALCHEMY_DATABASE_URI="sqlite:///{}".format(db_path),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
         SERVER_NAME="localhost:5000",
+        LOGS_PAGE_SIZE=100,
+        LOGS_MAX_PAGE_SIZE=1000,
+        LOGS_EXPORT_BATCH_SIZE=1000,
+        ITEMS_IMPORT_BATCH_SIZE=1000,
+        USERS_IMPORT_BATCH_SIZE=500,
+        LOAN_PERIOD_DAYS=14,
+        SQLITE_BUSY_TIMEOUT=5000,
+        SQLITE_JOURNAL_MODE="WAL",
+        SQLITE_SYNCHRONOUS="NORMAL",
+        SQLITE_CACHE_SIZE=-20000,
+        SQLITE_MMAP_SIZE=268435456,
+        SQLITE_TEMP_STORE="MEMORY",
+        SQLALCHEMY_REPLICA_URI=None,
+        REPLICA_STICKY_SECONDS=5,
+        PRINCIPAL_CACHE=None,
+        PRINCIPAL_CACHE_SIZE=1024,
+        PRINCIPAL_CACHE_TTL=0,
+        CHANGES_HUB=None,
+        CHANGES_BUFFER_SIZE=1000,
+        CHANGES_MAX_WAIT=25,
+        ERROR_REPORTS_WINDOW=10,
+        ERROR_REPORTS_RATE_LIMIT=30,
+        ERROR_REPORTS_MAX_PENDING=1000,
+        RETENTION_BORROWSTATES_DAYS=365,
+        RETENTION_LOGS_DAYS=None,
+        RETENTION_JS_ERRORS_DAYS=90,
+        COMPACT_BATCH_SIZE=500,
+        COMPACT_INTERVAL=None,
+        LOGS_ARCHIVE_DIR=None,
+        LOGS_SEGMENT_ROWS=20000,
+        PASSWORD_HASHER=None,
+        PASSWORD_HASH_METHOD="pbkdf2:sha256",
+        PASSWORD_HASH_ITERATIONS=150000,
+        PASSWORD_HASH_SCRYPT_N=16384,
+        PASSWORD_HASH_SCRYPT_R=8,
+        PASSWORD_HASH_SCRYPT_P=1,
+        PASSWORD_HASH_WORKERS=None,
+        PASSWORD_HASH_MAX_PENDING=64,
     )
 
     if test_config is None:
@@ -44,20 +81,26 @@ def create_app(test_config: Optional[Dict[str, Any]] = None) -> Flask:
 
     app.errorhandler(api.APIError)(api.handle_api_error)
     app.errorhandler(ValidationError)(api.handle_validation_error)
+    app.errorhandler(StaleDataError)(api.handle_stale_data_error)
     app.register_blueprint(api.bp)
 
-    from .db import db, init_db_command
+    _init_db(app)
 
-    db.init_app(app)
-    app.cli.add_command(init_db_command)
+    from . import principals
 
-    if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite:"):
+    principals.init_app(app)
+
+    from . import changes
+
+    changes.init_app(app)
 
-        def _sqlite_enforce_foreign_keys(dbapi_con: Any, _con_record: Any) -> None:
-            dbapi_con.execute("PRAGMA foreign_keys=ON;")
+    from . import error_reports
+
+    error_reports.init_app(app)
+
+    from . import passwords
 
-        with app.app_context():  # type: ignore
-            event.listen(db.engine, "connect", _sqlite_enforce_foreign_keys)
+    passwords.init_app(app)
 
     from .app import bp
 
@@ -69,6 +112,36 @@ def create_app(test_config: Optional[Dict[str, Any]] = None) -> Flask:
     return app
 
 
+def _init_db(app: Flask) -> None:
+
+    # Lazy-loading of modules is intentional here.
+    # pylint: disable=import-outside-toplevel
+    from .db import db
+    from .db.aggregates import rebuild_aggregates_command
+    from .db.migrations import (
+        create_indexes_command,
+        db_upgrade_command,
+        init_db_command,
+    )
+    from .db.retention import compact_command
+    from .db import logarchive, retention, routing
+
+    routing.init_app(app)
+    db.init_app(app)
+    logarchive.init_app(app)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(create_indexes_command)
+    app.cli.add_command(db_upgrade_command)
+    app.cli.add_command(rebuild_aggregates_command)
+    app.cli.add_command(compact_command)
+    retention.init_app(app)
+
+    if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite:"):
+        from .db import sqlite
+
+        sqlite.init_app(app)
+
+
 def _register_api_endpoints(app: Flask) -> None:
 
     # Lazy-loading of modules is intentional here.
@@ -77,10 +150,12 @@ def _register_api_endpoints(app: Flask) -> None:
     from . import auth
     from . import items
     from . import borrowstates
+    from . import changes
     from . import error_reports
     from . import logs
     from . import users
     from . import registration
+    from . import stats
     from . import transfer_requests
 
     app.register_blueprint(registration.bp)
@@ -89,17 +164,26 @@ def _register_api_endpoints(app: Flask) -> None:
     app.register_blueprint(auth.bp)
     app.register_blueprint(items.bp)
     app.register_blueprint(borrowstates.bp)
+    app.register_blueprint(changes.bp)
     app.register_blueprint(error_reports.bp)
     app.register_blueprint(logs.bp)
     app.register_blueprint(transfer_requests.bp)
+    app.register_blueprint(stats.bp)
 
 
 def _register_cli_commands(app: Flask) -> None:
 
     # Lazy-loading of modules is intentional here.
     # pylint: disable=import-outside-toplevel
+    from . import items
+    from . import logs
+    from . import passwords
     from . import users
     from . import registration
 
     app.cli.add_command(registration.generate_registration_token_command)
+    app.cli.add_command(passwords.benchmark_hash_command)
     app.cli.add_command(users.create_user_command)
+    app.cli.add_command(logs.export_logs_command)
+    app.cli.add_command(items.import_items_command)
+    app.cli.add_command(users.import_users_command)
@@ -1,14 +1,21 @@
 """
 Utility functions for access control.
+
+The session user is loaded at most once per request, together with their
+qualifications, and kept on flask.g for all helpers and views to share.
+Authentication and permission checks only need the session principal, which
+can be served from the principal cache without touching the database.
 """
 
 import functools
-from typing import Any, Callable, Dict, cast
+from typing import Any, Callable, Dict, Optional, cast
 
-from flask import session
+from flask import g, session
+from sqlalchemy.orm import joinedload  # type: ignore
 
 from .api import APIError
 from .db.models import User
+from .principals import Principal, get_principal_cache
 
 
 PERMISSIONS = (
@@ -27,13 +34,13 @@ def can_set_permissions(user_dict: Dict[str, Any]) -> bool:
 
     A user can set permissions if they are a subset of their own permissions.
     """
-    user = get_session_user()
-    return all(getattr(user, k) or not user_dict[k] for k in PERMISSIONS)
+    principal = get_session_principal()
+    return all(getattr(principal, k) or not user_dict[k] for k in PERMISSIONS)
 
 
 def can_set_qualifications() -> bool:
     """Check if the current session's user can set qualifications."""
-    return cast(bool, get_session_user().edit_qualifications)
+    return get_session_principal().edit_qualifications
 
 
 def requires_permissions(
@@ -44,8 +51,8 @@ def requires_permissions(
     def outer(to_be_wrapped: Callable[..., Any]) -> Callable[..., Any]:
         @functools.wraps(to_be_wrapped)
         def inner(*args: Any, **kwargs: Any) -> Any:
-            user = get_session_user()
-            if not all(getattr(user, p, False) for p in permissions):
+            principal = get_session_principal()
+            if not all(getattr(principal, p, False) for p in permissions):
                 raise APIError(reason="insufficient_permissions", status_code=403)
             return to_be_wrapped(*args, **kwargs)
 
@@ -56,4 +63,51 @@ def requires_permissions(
 
 def get_session_user() -> User:
     """Get the current session user."""
-    return cast(User, User.query.get(session["user_id"]))
+    return cast(User, load_session_user())
+
+
+def load_session_user() -> Optional[User]:
+    """Get the current session user, or None if there is none."""
+    user_id = session.get("user_id")
+    if g.get("session_user_id", False) != user_id:
+        g.session_user = (
+            None
+            if user_id is None
+            else User.query.options(joinedload(User.qualifications))
+            .filter_by(id=user_id)
+            .first()
+        )
+        g.session_user_id = user_id
+    return cast(Optional[User], g.session_user)
+
+
+def get_session_principal() -> Principal:
+    """Get the access control data of the current session user."""
+    return cast(Principal, load_session_principal())
+
+
+def load_session_principal() -> Optional[Principal]:
+    """
+    Get the access control data of the current session user, or None.
+
+    The principal cache is consulted first, the user is only loaded from the
+    database on a miss.
+    """
+    user_id = session.get("user_id")
+    if g.get("session_principal_id", False) == user_id:
+        return cast(Optional[Principal], g.session_principal)
+
+    cache = get_principal_cache()
+    principal = None
+    if user_id is not None:
+        principal = None if cache is None else cache.get(user_id)
+        if principal is None:
+            user = load_session_user()
+            if user is not None:
+                principal = Principal.from_user(user)
+                if cache is not None:
+                    cache.set(user_id, principal)
+
+    g.session_principal = principal
+    g.session_principal_id = user_id
+    return principal
@@ -4,14 +4,22 @@ from typing import Dict, Tuple
 
 from flask import Blueprint
 
-from .error import APIError, handle_api_error, handle_validation_error
+from .error import (
+    APIError,
+    handle_api_error,
+    handle_stale_data_error,
+    handle_validation_error,
+    version_conflict,
+)
 from .models import QualificationSchema, UserSchema
 
 
 __all__ = [
     "APIError",
     "handle_api_error",
+    "handle_stale_data_error",
     "handle_validation_error",
+    "version_conflict",
     "QualificationSchema",
     "UserSchema",
     "bp",
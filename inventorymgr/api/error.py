@@ -9,12 +9,16 @@ handle_api_error()
 
 handle_validation_error()
     Converts ValidationError instances during schema validation to responses.
+
+handle_stale_data_error()
+    Converts conflicting concurrent updates to responses.
 """
 
 from typing import cast, Dict
 
 from flask import jsonify, Response
 from marshmallow import ValidationError
+from sqlalchemy.orm.exc import StaleDataError  # type: ignore
 
 
 class APIError(Exception):
@@ -45,3 +49,13 @@ def handle_validation_error(error: ValidationError) -> Response:
     response = jsonify({"reason": "validation_failed", "errors": error.messages})
     response.status_code = 400
     return cast(Response, response)
+
+
+def handle_stale_data_error(_error: StaleDataError) -> Response:
+    """Convert an update of a row changed by another request to a 409 response."""
+    return handle_api_error(version_conflict())
+
+
+def version_conflict() -> APIError:
+    """Return an API error for rows changed by another request."""
+    return APIError(reason="version_conflict", status_code=409)
@@ -3,7 +3,7 @@
 
 from typing import Any, Callable, TypeVar, cast
 
-from marshmallow import Schema, fields, post_dump, pre_load
+from marshmallow import EXCLUDE, Schema, fields, post_dump, pre_load, validate
 
 
 class QualificationSchema(Schema):
@@ -85,6 +85,90 @@ class BorrowableItemSchema(Schema):
         return data
 
 
+def _is_qualification_reference(value: Any) -> bool:
+    if isinstance(value, str):
+        return bool(value)
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class ItemImportSchema(Schema):
+    """
+    Marshmallow schema for rows of item imports.
+
+    Qualifications are referenced by id or name. In CSV, they are separated
+    by semicolons and references consisting of digits are ids.
+    """
+
+    name = fields.Str(required=True, validate=bool)
+    description = fields.Str(missing="")
+    quantity_total = fields.Integer(missing=1, validate=validate.Range(min=0))
+    quantity_in_stock = fields.Integer(validate=validate.Range(min=0))
+    required_qualifications = fields.List(
+        fields.Raw(validate=_is_qualification_reference)
+    )
+
+    @_pre_load
+    def split_qualifications(self, data: Any, **kwargs: Any) -> Any:
+        """Split semicolon separated qualifications of CSV rows."""
+        # pylint: disable=no-self-use,unused-argument
+        return _split_references(data, "required_qualifications")
+
+
+class UserImportSchema(Schema):
+    """
+    Marshmallow schema for rows of user imports.
+
+    Permissions default to false. Qualifications are referenced like in
+    ItemImportSchema.
+    """
+
+    username = fields.Str(required=True, validate=bool)
+    password = fields.Str(required=True, validate=bool)
+    create_users = fields.Bool(missing=False)
+    view_users = fields.Bool(missing=False)
+    update_users = fields.Bool(missing=False)
+    edit_qualifications = fields.Bool(missing=False)
+    create_items = fields.Bool(missing=False)
+    manage_checkouts = fields.Bool(missing=False)
+    qualifications = fields.List(
+        fields.Raw(validate=_is_qualification_reference), missing=list
+    )
+
+    @_pre_load
+    def split_qualifications(self, data: Any, **kwargs: Any) -> Any:
+        """Split semicolon separated qualifications of CSV rows."""
+        # pylint: disable=no-self-use,unused-argument
+        return _split_references(data, "qualifications")
+
+
+def _split_references(data: Any, key: str) -> Any:
+    references = data.get(key)
+    if not isinstance(references, str):
+        return data
+    data = dict(data)
+    data[key] = [
+        int(ref) if ref.isdigit() else ref
+        for ref in (ref.strip() for ref in references.split(";"))
+        if ref
+    ]
+    return data
+
+
+class ImportQuerySchema(Schema):
+    """Marshmallow schema for the query string of bulk imports."""
+
+    format = fields.Str(validate=validate.OneOf(("ndjson", "csv")))
+    batch_size = fields.Integer(validate=validate.Range(min=1))
+
+
+class ChangesQuerySchema(Schema):
+    """Marshmallow schema for the query string of change feed requests."""
+
+    since = fields.Integer(validate=validate.Range(min=0))
+    epoch = fields.String()
+    timeout = fields.Float(validate=validate.Range(min=0))
+
+
 class BorrowStateSchema(Schema):
     """Marshmallow schema for borrow state objects."""
 
@@ -119,6 +203,23 @@ class CheckinRequestSchema(Schema):
     item_ids = fields.List(fields.Nested(ItemCountSchema), required=True)
 
 
+class JavascriptErrorSchema(Schema):
+    """Marshmallow schema for JS error reports sent from window.onerror."""
+
+    class Meta:
+        """Ignore fields that newer frontends may send."""
+
+        # pylint: disable=too-few-public-methods
+        unknown = EXCLUDE
+
+    location = fields.Str(required=True)
+    message = fields.Str(allow_none=True)
+    source = fields.Str(allow_none=True)
+    lineno = fields.Integer(allow_none=True)
+    colno = fields.Integer(allow_none=True)
+    stack = fields.Str(allow_none=True)
+
+
 class LogEntrySchema(Schema):
     """Marshmallow schema for checkout / checkin logs."""
 
@@ -130,6 +231,30 @@ class LogEntrySchema(Schema):
     items = fields.Nested(BorrowableItemSchema, required=True, many=True, only=("id",))
 
 
+class LogFilterSchema(Schema):
+    """Marshmallow schema for filters in the query string of log requests."""
+
+    action = fields.Str()
+    subject_id = fields.Integer()
+    secondary_id = fields.Integer()
+    item_id = fields.Integer()
+    since = fields.DateTime()
+    until = fields.DateTime()
+
+
+class LogQuerySchema(LogFilterSchema):
+    """Marshmallow schema for the query string of paginated log requests."""
+
+    limit = fields.Integer(validate=validate.Range(min=1))
+    cursor = fields.Str()
+
+
+class LogExportQuerySchema(LogFilterSchema):
+    """Marshmallow schema for the query string of log exports."""
+
+    format = fields.Str(missing="ndjson", validate=validate.OneOf(("ndjson", "csv")))
+
+
 class TransferRequestSchema(Schema):
     """Marshmallow schema for transfer requests."""
 
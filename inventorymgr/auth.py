@@ -9,21 +9,16 @@ import functools
 from typing import Any, Callable, cast, Dict
 
 from flask import Blueprint, make_response, request, session
-from werkzeug.security import check_password_hash as _check_password_hash
 
-from .accesscontrol import PERMISSIONS
+from .accesscontrol import PERMISSIONS, load_session_principal, requires_permissions
 from .api import APIError, UserSchema
 from .db.models import User
+from .passwords import get_password_hashing
+from .principals import get_principal_cache
 
 
 bp = Blueprint("auth", __name__, url_prefix="/api/v1/auth")
 
-_CHECK_HASH_ANYWAY = "pbkdf2:sha256:150000$tRQtwnYW$80442246fe5dbd649c8a90cd0209f7a3751e8a0ec1327f88f6b331f929642050"  # pylint: disable=line-too-long
-
-check_password_hash: Callable[[str, str], bool] = cast(
-    Callable[[str, str], bool], _check_password_hash
-)
-
 
 @bp.route("/login", methods=("POST",))
 def login() -> Any:
@@ -56,15 +51,16 @@ def logout() -> Any:
 
 def is_password_correct(username: str, password: str) -> bool:
     """Checks whether password is valid for user, tries to avoid timing attacks."""
+    hashing = get_password_hashing()
     user = User.query.filter_by(username=username).first()
     if user is None:
         # We need to prevent timing-based side-channel attacks
         # that could be exploited for user enumeration
-        password_hash = _CHECK_HASH_ANYWAY
+        password_hash = hashing.dummy_hash
     else:
         password_hash = user.password
 
-    return check_password_hash(password_hash, password) and user is not None
+    return hashing.verify(password_hash, password) and user is not None
 
 
 def fetch_user(username: str) -> Dict[str, Any]:
@@ -78,8 +74,7 @@ def authentication_required(to_be_wrapped: Callable[..., Any]) -> Callable[...,
 
     @functools.wraps(to_be_wrapped)
     def wrapper(*args: Any, **kwargs: Any) -> Any:
-        user_id = session.get("user_id")
-        if user_id is None or User.query.get(user_id) is None:
+        if load_session_principal() is None:
             if "user_id" in session:
                 del session["user_id"]
             response = make_response({"reason": "authentication_required"}, 403)
@@ -88,3 +83,14 @@ def authentication_required(to_be_wrapped: Callable[..., Any]) -> Callable[...,
         return to_be_wrapped(*args, **kwargs)
 
     return wrapper
+
+
+@bp.route("/principal-cache", methods=("GET",))
+@authentication_required
+@requires_permissions("update_users")
+def principal_cache_stats() -> Dict[str, Any]:
+    """Flask view returning the hit and miss counters of the principal cache."""
+    cache = get_principal_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
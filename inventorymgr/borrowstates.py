@@ -1,22 +1,45 @@
 """API endpoints for handling borrow states."""
 
+import collections
 import datetime
-import itertools
-from typing import Any, Dict, Iterable, Sequence, Tuple, cast
+from typing import (
+    AbstractSet,
+    Any,
+    Counter,
+    DefaultDict,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
 from flask import Blueprint, request
-from sqlalchemy import func
-from sqlalchemy import distinct
+from sqlalchemy import case, or_  # type: ignore
+from sqlalchemy.orm import joinedload, selectinload  # type: ignore
+from sqlalchemy.orm.attributes import set_committed_value  # type: ignore
 
 from inventorymgr.accesscontrol import requires_permissions
+from inventorymgr.api import APIError, version_conflict
 from inventorymgr.api.models import (
     BorrowStateSchema,
     CheckinRequestSchema,
     CheckoutRequestSchema,
     ItemCountSchema,
 )
+from inventorymgr.api.serializers import dump_many
 from inventorymgr.auth import authentication_required
+from inventorymgr.changes import queue_stock_changes
 from inventorymgr.db import db
+from inventorymgr.db.aggregates import (
+    OpenTotals,
+    open_borrow_totals,
+    record_open_borrow_changes,
+)
+from inventorymgr.db.loaders import loader_options
 from inventorymgr.db.models import (
     BorrowableItem,
     BorrowState,
@@ -24,6 +47,8 @@ from inventorymgr.db.models import (
     TransferRequest,
     User,
 )
+from inventorymgr.db.routing import replica_reads
+from inventorymgr.versions import bump_versions
 
 
 bp = Blueprint("borrowstates", __name__, url_prefix="/api/v1/borrowstates")
@@ -31,14 +56,19 @@ bp = Blueprint("borrowstates", __name__, url_prefix="/api/v1/borrowstates")
 
 _utcnow = datetime.datetime.utcnow  # pylint: disable=invalid-name
 
+#: Times a checkout tries to reserve stock that other requests keep changing.
+RESERVE_ATTEMPTS = 3
+
 
 @bp.route("", methods=("GET",))
+@replica_reads
 @authentication_required
 @requires_permissions("manage_checkouts")
 def fetch_borrowstates() -> Dict[str, Any]:
     """Fetch all borrowstates."""
-    borrowstates = BorrowStateSchema(many=True).dump(BorrowState.query.all())
-    return {"borrowstates": borrowstates}
+    schema = BorrowStateSchema(many=True)
+    borrowstates = BorrowState.query.options(*loader_options(BorrowState, schema))
+    return {"borrowstates": dump_many(schema, borrowstates)}
 
 
 @bp.route("/checkout", methods=("POST",))
@@ -57,18 +87,13 @@ def checkout() -> Tuple[Dict[str, Any], int]:
         elem for elem in checkout_request["borrowed_item_ids"] if elem["count"] > 0
     ]
 
-    borrowed_items = [
-        BorrowableItem.query.get(elem["id"])
-        for elem in borrowed_item_ids
-    ]
-
-    if any(item is None for item in borrowed_items):
-        return {"reason": "nonexistent_item"}, 400
+    borrowed_items = fetch_items(elem["id"] for elem in borrowed_item_ids)
 
+    qualification_ids = {q.id for q in borrowing_user.qualifications}
     unqualified_for = [
         item
         for item in borrowed_items
-        if not has_required_qualifications(borrowing_user, item)
+        if not has_required_qualifications(qualification_ids, item)
     ]
 
     if unqualified_for:
@@ -76,19 +101,40 @@ def checkout() -> Tuple[Dict[str, Any], int]:
 
     quantities = [elem["count"] for elem in borrowed_item_ids]
 
-    already_borrowed = any_item_already_borrowed(borrowed_items, quantities)
+    for _ in range(RESERVE_ATTEMPTS):
+        already_borrowed = any_item_already_borrowed(borrowed_items, quantities)
+        if already_borrowed or reserve_stock(borrowed_items, quantities):
+            break
+        # Another checkout took the stock since the items were loaded.
+        db.session.rollback()
+        borrowed_items = fetch_items(item.id for item in borrowed_items)
+    else:
+        raise version_conflict()
     if already_borrowed:
-        items = ItemCountSchema(many=True).dump([{"id": item.id, "count": item.quantity_in_stock} for item, count in already_borrowed])
+        items = ItemCountSchema(many=True).dump(
+            [
+                {"id": item.id, "count": item.quantity_in_stock}
+                for item, count in already_borrowed
+            ]
+        )
         return {"reason": "already_borrowed", "items": items}, 400
 
     borrowstates = [
-        BorrowState(borrowing_user=borrowing_user, borrowed_item=item, quantity=qty, received_at=now)
+        BorrowState(
+            borrowing_user=borrowing_user,
+            borrowed_item=item,
+            quantity=qty,
+            received_at=now,
+        )
         for item, qty in zip(borrowed_items, quantities)
     ]
-
-    for borrow_state in borrowstates:
-        db.session.add(borrow_state)
-        borrow_state.borrowed_item.quantity_in_stock -= borrow_state.quantity
+    db.session.add_all(borrowstates)
+    queue_stock_changes(
+        {
+            item_id: -count
+            for item_id, count in _total_per_item(borrowed_items, quantities).items()
+        }
+    )
 
     db.session.add(
         LogEntry(
@@ -98,79 +144,315 @@ def checkout() -> Tuple[Dict[str, Any], int]:
             items=borrowed_items,
         )
     )
+    # Serialize before committing, otherwise every borrow state and item
+    # would be expired and reloaded one by one.
+    bump_versions("items_stock")
+    db.session.flush()
+    response = {"borrowstates": BorrowStateSchema(many=True).dump(borrowstates)}
     db.session.commit()
 
-    return {"borrowstates": BorrowStateSchema(many=True).dump(borrowstates)}, 200
-
-
-def try_identify_borrowstates(returning_user, item, quantity):
-    open_borrowstate_count = BorrowState.query.with_entities(func.sum(BorrowState.quantity)).filter_by(borrowed_item=item, returned_at=None).scalar()
-    distinct_user_count = BorrowState.query.with_entities(func.count(distinct(BorrowState.borrowing_user_id))).filter_by(borrowed_item=item, returned_at=None).scalar()
-    if open_borrowstate_count == quantity or distinct_user_count == 1:
-        # successfully identified
-        return open_borrowstates_for_item(item)#, 0
-    #open_borrowstate_count_of_user = BorrowState.query.with_entities(func.sum(BorrowState.quantity)).filter_by(borrowed_item=item, returned_at=None, borrowing_user=returning_user)
-    # Otherwise, prefer returning user
-    return BorrowState.query.filter_by(borrowed_item=item, returned_at=None, borrowing_user=returning_user).all()#, max(quantity - open_borrowstate_count_of_user, 0)
+    return response, 200
 
 
 @bp.route("/checkin", methods=("POST",))
 @authentication_required
 @requires_permissions("manage_checkouts")
-def checkin() -> Dict[str, Any]:
+def checkin() -> Any:
     """API endpoint for checkin of borrowed items."""
     checkin_request = CheckinRequestSchema().load(request.json)
     now = _utcnow()
-    returning_user = User.query.get(checkin_request["user_id"])
-    returned_items = [
-        BorrowableItem.query.get(elem["id"]) for elem in checkin_request["item_ids"]
-    ]
-    borrowstates = []
-    for item, elem in zip(returned_items, checkin_request["item_ids"]):
-        qty = qty_before = elem["count"]
-        for borrow_state in try_identify_borrowstates(returning_user, item, qty_before):
-            #if borrow_state.borrowing_user == returning_user:
+    returning_user_id = checkin_request["user_id"]
+    returning_user = User.query.get(returning_user_id)
+    returned_items = fetch_items(elem["id"] for elem in checkin_request["item_ids"])
+    returned_quantities = [elem["count"] for elem in checkin_request["item_ids"]]
+
+    open_totals = open_borrow_totals(returned_items)
+    open_borrowstates = open_borrowstates_for_items(
+        (item.id for item in returned_items),
+        returning_user_id,
+        _fully_matched_items(returned_items, returned_quantities, open_totals),
+    )
+    borrowstates, unmatched_returns = match_returns(
+        returned_items,
+        returned_quantities,
+        returning_user_id,
+        open_borrowstates,
+        open_totals,
+    )
+    db.session.add(
+        LogEntry(
+            action="checkin",
+            timestamp=now,
+            subject=returning_user,
+            items=returned_items,
+        )
+    )
+    close_borrowstates(
+        borrowstates,
+        now,
+        collections.Counter(
+            (bs.borrowed_item_id, bs.borrowing_user_id)
+            for remaining in open_borrowstates.values()
+            for bs in remaining
+        ),
+    )
+    restock(returned_items, returned_quantities, unmatched_returns)
+    queue_stock_changes(_total_per_item(returned_items, returned_quantities))
+    if borrowstates:
+        TransferRequest.query.filter(
+            TransferRequest.borrowstate_id.in_([bs.id for bs in borrowstates])
+        ).delete(synchronize_session=False)
+    bump_versions("items_stock")
+    db.session.flush()
+    response = {"borrowstates": BorrowStateSchema(many=True).dump(borrowstates)}
+    db.session.commit()
+    return response
+
+
+def _fully_matched_items(
+    items: Sequence[BorrowableItem],
+    quantities: Sequence[int],
+    open_totals: Mapping[int, OpenTotals],
+) -> Set[int]:
+    # Returns of these items may match the open borrow states of any user, see
+    # identify_borrowstates(). Totals of items returned more than once are
+    # recounted from the borrow states left, so all of them are needed, too.
+    repeated = collections.Counter(item.id for item in items)
+    return {
+        item.id
+        for item, quantity in zip(items, quantities)
+        if repeated[item.id] > 1
+        or open_totals[item.id].quantity == quantity
+        or open_totals[item.id].borrowers == 1
+    }
+
+
+def open_borrowstates_for_items(
+    item_ids: Iterable[int],
+    user_id: Optional[int] = None,
+    all_users_item_ids: AbstractSet[int] = frozenset(),
+) -> DefaultDict[int, List[BorrowState]]:
+    """
+    Return borrow states without a return date, grouped by item id.
+
+    If user_id is given, only that user's borrow states are returned, except
+    for the items in all_users_item_ids.
+    """
+    query = BorrowState.query.options(selectinload(BorrowState.borrowing_user)).filter(
+        BorrowState.borrowed_item_id.in_(set(item_ids)),
+        BorrowState.returned_at.is_(None),
+    )
+    if user_id is not None:
+        query = query.filter(
+            or_(
+                BorrowState.borrowing_user_id == user_id,
+                BorrowState.borrowed_item_id.in_(all_users_item_ids),
+            )
+        )
+    borrowstates = query.order_by(BorrowState.id).all()
+    grouped: DefaultDict[int, List[BorrowState]] = collections.defaultdict(list)
+    for borrow_state in borrowstates:
+        grouped[borrow_state.borrowed_item_id].append(borrow_state)
+    return grouped
+
+
+def match_returns(
+    items: Sequence[BorrowableItem],
+    quantities: Sequence[int],
+    returning_user_id: int,
+    open_borrowstates: Dict[int, List[BorrowState]],
+    open_totals: Dict[int, OpenTotals],
+) -> Tuple[List[BorrowState], Counter[int]]:
+    """
+    Match returned quantities of items against their open borrow states.
+
+    Borrow states returned in full are returned to be closed, partly returned
+    ones have their quantity reduced, quantities matching no borrow state are
+    counted per item id as unmatched returns. Matched borrow states are
+    removed from open_borrowstates, and the totals of the items from
+    open_totals.
+    """
+    borrowstates: List[BorrowState] = []
+    returned_ids: Set[int] = set()
+    unmatched_returns: Counter[int] = collections.Counter()
+    for item, qty in zip(items, quantities):
+        candidates = identify_borrowstates(
+            open_borrowstates[item.id],
+            returning_user_id,
+            qty,
+            open_totals.pop(item.id, None),
+        )
+        for borrow_state in candidates:
             if qty >= borrow_state.quantity:
                 qty -= borrow_state.quantity
-                borrow_state.returned_at = now
                 borrowstates.append(borrow_state)
+                returned_ids.add(borrow_state.id)
             else:
                 borrow_state.quantity -= qty
                 qty = 0
             if qty == 0:
                 break
         else:
-            item.unmatched_returns += qty
-        item.quantity_in_stock += qty_before# - qty
-    db.session.add(
-        LogEntry(
-            action="checkin",
-            timestamp=now,
-            subject=returning_user,
-            items=returned_items,
+            unmatched_returns[item.id] += qty
+        open_borrowstates[item.id] = [
+            bs for bs in open_borrowstates[item.id] if bs.id not in returned_ids
+        ]
+    return borrowstates, unmatched_returns
+
+
+def identify_borrowstates(
+    open_borrowstates: Sequence[BorrowState],
+    returning_user_id: int,
+    quantity: int,
+    totals: Optional[OpenTotals] = None,
+) -> Sequence[BorrowState]:
+    """
+    Pick the open borrow states of an item that a return is matched against.
+
+    If the returned quantity equals the total open quantity, or there is only
+    a single borrower, all open borrow states match. Otherwise only those of
+    the returning user do. The totals are taken from the item's aggregate if
+    given, else counted from the open borrow states.
+    """
+    if totals is None:
+        totals = OpenTotals.of(open_borrowstates)
+    if totals.quantity == quantity or totals.borrowers == 1:
+        return open_borrowstates
+    return [bs for bs in open_borrowstates if bs.borrowing_user_id == returning_user_id]
+
+
+def fetch_items(item_ids: Iterable[int]) -> List[BorrowableItem]:
+    """
+    Load items with their required qualifications and open borrow aggregates
+    in a single query.
+
+    The result has one entry per id, in order. Raises a 400 API error if any
+    id is unknown.
+    """
+    item_ids = list(item_ids)
+    items = (
+        BorrowableItem.query.options(
+            selectinload(BorrowableItem.required_qualifications),
+            joinedload(BorrowableItem.open_borrows),
         )
+        .filter(BorrowableItem.id.in_(set(item_ids)))
+        .all()
+        if item_ids
+        else []
     )
-    for transfer_request in TransferRequest.query.filter(
-        TransferRequest.borrowstate_id.in_(bs.id for bs in borrowstates)
-    ).all():
-        db.session.delete(transfer_request)
-    db.session.commit()
-    return {"borrowstates": BorrowStateSchema(many=True).dump(borrowstates)}
+    items_by_id = {item.id: item for item in items}
+    if len(items_by_id) < len(set(item_ids)):
+        raise APIError(reason="nonexistent_item", status_code=400)
+    return [items_by_id[item_id] for item_id in item_ids]
+
+
+def has_required_qualifications(
+    qualification_ids: AbstractSet[int], item: BorrowableItem
+) -> bool:
+    """Check if a user's qualification ids cover those required by item."""
+    return {q.id for q in item.required_qualifications} <= qualification_ids
+
+
+def any_item_already_borrowed(
+    items: Iterable[BorrowableItem], quantities: Iterable[int]
+) -> Sequence[Tuple[BorrowableItem, int]]:
+    """Check if any item has less in stock than the total requested of it."""
+    items = list(items)
+    counts = _total_per_item(items, quantities)
+    unique_items = {item.id: item for item in items}.values()
+    return [
+        (item, counts[item.id])
+        for item in unique_items
+        if item.quantity_in_stock < counts[item.id]
+    ]
 
 
-def open_borrowstates_for_item(item: BorrowableItem) -> Iterable[BorrowState]:
-    """Return all borrow states for an item without a return date."""
-    return cast(
-        Iterable[BorrowState],
-        BorrowState.query.filter_by(borrowed_item=item, returned_at=None).all(),
+def reserve_stock(items: Iterable[BorrowableItem], quantities: Iterable[int]) -> bool:
+    """
+    Take the quantities of items out of stock in a single conditional UPDATE.
+
+    Returns False if any item has less in stock than requested. Some rows may
+    have been updated then, so the caller must roll back.
+    """
+    counts = _total_per_item(items, quantities)
+    if not counts:
+        return True
+    requested = case(counts, value=BorrowableItem.id)
+    result = db.session.execute(
+        BorrowableItem.__table__.update()
+        .where(BorrowableItem.id.in_(counts))
+        .where(BorrowableItem.quantity_in_stock >= requested)
+        .values(
+            quantity_in_stock=BorrowableItem.quantity_in_stock - requested,
+            version=BorrowableItem.version + 1,
+        )
+    )
+    return bool(result.rowcount == len(counts))
+
+
+def close_borrowstates(
+    borrowstates: Sequence[BorrowState],
+    now: datetime.datetime,
+    open_counts: Optional[Mapping[Tuple[int, int], int]] = None,
+) -> None:
+    """
+    Mark borrow states as returned in a single UPDATE.
+
+    Raises a 409 API error if another request returned any of them first.
+    open_counts are the numbers of borrow states per item and user id left
+    open afterwards, if known, see record_open_borrow_changes().
+    """
+    if not borrowstates:
+        return
+    result = db.session.execute(
+        BorrowState.__table__.update()
+        .where(BorrowState.id.in_([bs.id for bs in borrowstates]))
+        .where(BorrowState.returned_at.is_(None))
+        .values(returned_at=now, version=BorrowState.version + 1)
+    )
+    if result.rowcount != len(borrowstates):
+        raise version_conflict()
+    record_open_borrow_changes(
+        (
+            (bs.borrowed_item_id, bs.borrowing_user_id, -bs.quantity, -1)
+            for bs in borrowstates
+        ),
+        open_counts,
+    )
+    for borrow_state in borrowstates:
+        set_committed_value(borrow_state, "returned_at", now)
+        set_committed_value(borrow_state, "version", borrow_state.version + 1)
+
+
+def restock(
+    items: Iterable[BorrowableItem],
+    quantities: Iterable[int],
+    unmatched_returns: Mapping[int, int],
+) -> None:
+    """Put returned quantities back into stock in a single UPDATE."""
+    counts = _total_per_item(items, quantities)
+    if not counts:
+        return
+    values = {
+        "quantity_in_stock": BorrowableItem.quantity_in_stock
+        + case(counts, value=BorrowableItem.id),
+        "version": BorrowableItem.version + 1,
+    }
+    if unmatched_returns:
+        values["unmatched_returns"] = BorrowableItem.unmatched_returns + case(
+            dict(unmatched_returns), value=BorrowableItem.id, else_=0
+        )
+    db.session.execute(
+        BorrowableItem.__table__.update()
+        .where(BorrowableItem.id.in_(counts))
+        .values(**values)
     )
 
 
-def has_required_qualifications(user: User, item: BorrowableItem) -> bool:
-    """Check if user has all required qualifications to borrow item."""
-    return all(q in user.qualifications for q in item.required_qualifications)
-
-
-def any_item_already_borrowed(items: Iterable[BorrowableItem], quantities: Iterable[int]) -> Sequence[Tuple[BorrowableItem, int]]:
-    """Check if any item in item_ids already has an open borrowstate."""
-    return [(item, count) for item, count in zip(items, quantities) if item.quantity_in_stock < count]
+def _total_per_item(
+    items: Iterable[BorrowableItem], quantities: Iterable[int]
+) -> Dict[int, int]:
+    counts: Counter[int] = collections.Counter()
+    for item, quantity in zip(items, quantities):
+        counts[item.id] += quantity
+    return dict(counts)
@@ -0,0 +1,229 @@
+"""
+Change feed for stock levels, transfer requests and logs.
+
+Clients long-poll GET /api/v1/changes with the sequence number of the last
+change they have seen and get all changes after it, waiting up to a timeout
+if there are none yet. Waiting clients hold neither a database connection
+nor do they run any queries, they are woken up when changes are published.
+They do hold a worker thread for up to CHANGES_MAX_WAIT seconds, so the app
+should be served by threaded or gevent workers, not by sync workers.
+
+Changes are queued on the database session while a request runs and only
+published once it commits, rolled back changes are discarded:
+
+- Checkout and check-in queue the change of the stock of each item.
+- Creating, accepting and declining transfer requests queue the request.
+- Log entries are picked up when they are flushed.
+
+Published changes are kept in a hub. By default it is an in-process ring
+buffer of CHANGES_BUFFER_SIZE changes, so with several worker processes each
+one numbers its changes separately and only sees its own changes.
+CHANGES_HUB can be set to any object implementing the ChangeHub interface
+instead, e.g. a client for a broker shared between worker processes.
+
+Sequence numbers are only meaningful within the epoch of the hub that issued
+them, which is sent along and passed back by clients. Clients passing another
+epoch, e.g. of a restarted or different worker process, or a sequence number
+the hub no longer has, get a reset flag and should reload.
+
+ChangeHub
+    Interface for storing and waiting for published changes.
+
+InProcessHub
+    Ring buffer of changes with blocking waits.
+
+init_app()
+    Configure the change hub of an app.
+
+get_change_hub()
+    Return the change hub of the current app.
+
+queue_change(), queue_stock_changes()
+    Queue changes to be published after the session commits.
+
+get_changes()
+    Flask view to long-poll for changes.
+"""
+
+import abc
+import collections
+import itertools
+import secrets
+import threading
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from flask import Blueprint, Flask, current_app, request, session
+from sqlalchemy import event  # type: ignore
+
+from .api.models import ChangesQuerySchema
+from .auth import authentication_required
+from .db import db
+from .db.models import LogEntry
+
+bp = Blueprint("changes", __name__, url_prefix="/api/v1/changes")
+
+# Changes of these types are only sent to the users listed in "user_ids".
+_PRIVATE_TYPES = {"transfer_request"}
+
+
+class ChangeHub(abc.ABC):
+    """Interface for storing and waiting for published changes."""
+
+    @property
+    @abc.abstractmethod
+    def epoch(self) -> str:
+        """An id that changes whenever the numbering of changes starts over."""
+
+    @abc.abstractmethod
+    def last_seq(self) -> int:
+        """Return the sequence number of the last change, 0 if there is none."""
+
+    @abc.abstractmethod
+    def publish(self, changes: List[Dict[str, Any]]) -> int:
+        """
+        Number and store changes, waking up waiting clients.
+
+        Returns the sequence number of the last change.
+        """
+
+    @abc.abstractmethod
+    def wait(
+        self, since: int, timeout: float
+    ) -> Tuple[Optional[List[Dict[str, Any]]], int]:
+        """
+        Return the changes after sequence number since and the last sequence
+        number, waiting up to timeout seconds if there are none yet.
+
+        Returns None instead of the changes if changes after since are no
+        longer stored or since is unknown.
+        """
+
+
+class InProcessHub(ChangeHub):
+    """Ring buffer of the last max_size changes with blocking waits."""
+
+    def __init__(self, max_size: int):
+        self._changes: Deque[Dict[str, Any]] = collections.deque(maxlen=max_size)
+        self._last = 0
+        self._condition = threading.Condition()
+        self._epoch = secrets.token_hex(8)
+
+    @property
+    def epoch(self) -> str:
+        return self._epoch
+
+    def last_seq(self) -> int:
+        return self._last
+
+    def publish(self, changes: List[Dict[str, Any]]) -> int:
+        with self._condition:
+            for change in changes:
+                self._last += 1
+                self._changes.append({"seq": self._last, **change})
+            self._condition.notify_all()
+            return self._last
+
+    def wait(
+        self, since: int, timeout: float
+    ) -> Tuple[Optional[List[Dict[str, Any]]], int]:
+        with self._condition:
+            if not self._last - len(self._changes) <= since <= self._last:
+                return None, self._last
+            self._condition.wait_for(lambda: self._last > since, timeout)
+            start = len(self._changes) - (self._last - since)
+            return list(itertools.islice(self._changes, start, None)), self._last
+
+
+def init_app(app: Flask) -> None:
+    """Configure the change hub of an app from its config."""
+    hub: Optional[ChangeHub] = app.config["CHANGES_HUB"]
+    if hub is None:
+        hub = InProcessHub(app.config["CHANGES_BUFFER_SIZE"])
+    app.extensions["change_hub"] = hub
+
+
+def get_change_hub() -> ChangeHub:
+    """Return the change hub of the current app."""
+    return current_app.extensions["change_hub"]  # type: ignore
+
+
+def queue_change(change_type: str, **data: Any) -> None:
+    """Queue a change to be published after the session commits."""
+    db.session.info.setdefault("queued_changes", []).append(
+        {"type": change_type, **data}
+    )
+
+
+def queue_stock_changes(deltas: Dict[int, int]) -> None:
+    """Queue the changes of the stock of items, given by item id."""
+    if deltas:
+        items = [{"id": item_id, "delta": delta} for item_id, delta in deltas.items()]
+        queue_change("stock", items=items)
+
+
+@bp.route("", methods=("GET",))
+@authentication_required
+def get_changes() -> Dict[str, Any]:
+    """
+    API endpoint to long-poll for changes after a sequence number.
+
+    Without a sequence number, only the last one is returned, to start from.
+    """
+    changes_query = ChangesQuerySchema().load(request.args)
+    hub = get_change_hub()
+    user_id = session["user_id"]
+    # Release the database connection while waiting.
+    db.session.remove()
+    # Sequence numbers of another epoch are unknown, like those never issued.
+    unknown_epoch = changes_query.get("epoch", hub.epoch) != hub.epoch
+    if "since" not in changes_query or unknown_epoch:
+        return {
+            "changes": [],
+            "last_seq": hub.last_seq(),
+            "epoch": hub.epoch,
+            "reset": "since" in changes_query,
+        }
+    timeout = min(
+        changes_query.get("timeout", current_app.config["CHANGES_MAX_WAIT"]),
+        current_app.config["CHANGES_MAX_WAIT"],
+    )
+    changes, last_seq = hub.wait(changes_query["since"], timeout)
+    return {
+        "changes": [
+            change
+            for change in changes or []
+            if change["type"] not in _PRIVATE_TYPES or user_id in change["user_ids"]
+        ],
+        "last_seq": last_seq,
+        "epoch": hub.epoch,
+        "reset": changes is None,
+    }
+
+
+@event.listens_for(db.session, "after_flush")
+def _queue_log_entries(db_session: Any, _context: Any) -> None:
+    for obj in db_session.new:
+        if isinstance(obj, LogEntry):
+            db_session.info.setdefault("queued_changes", []).append(
+                {
+                    "type": "log",
+                    "id": obj.id,
+                    "timestamp": obj.timestamp.isoformat(),
+                    "action": obj.action,
+                    "subject_id": obj.subject_id,
+                    "secondary_id": obj.secondary_id,
+                    "items": [item.id for item in obj.items],
+                }
+            )
+
+
+@event.listens_for(db.session, "after_commit")
+def _publish_queued_changes(db_session: Any) -> None:
+    changes = db_session.info.pop("queued_changes", None)
+    if changes:
+        get_change_hub().publish(changes)
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _discard_queued_changes(db_session: Any, _previous_transaction: Any) -> None:
+    db_session.info.pop("queued_changes", None)
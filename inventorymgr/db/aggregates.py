@@ -0,0 +1,270 @@
+"""
+Aggregates of open borrow states.
+
+The item_open_borrows table holds the total open quantity and the number of
+distinct borrowers of each item, user_open_borrows the total open quantity
+and the number of distinct items borrowed by each user. Check-in and
+dashboards read them instead of scanning the open borrow states. The
+aggregates change in the same transaction as the borrow states:
+
+- Inserts, updates and deletes of BorrowState objects, including those of
+  checkout, partial check-in and transfer acceptance, are picked up when the
+  session is flushed.
+- Bulk UPDATE statements bypassing the ORM report their changes with
+  record_open_borrow_changes().
+
+If borrow states are changed behind the application's back, the rebuild-
+aggregates command recomputes the table from scratch.
+
+OpenTotals
+    Open quantity and borrower count of an item.
+
+open_borrow_totals()
+    Return the aggregated open borrows of items.
+
+record_open_borrow_changes()
+    Apply changes of open borrow states to the aggregates.
+
+rebuild_aggregates()
+    Recompute the aggregates from the borrow states.
+
+rebuild_aggregates_command()
+    Command line interface for rebuilding the aggregates.
+"""
+
+import collections
+from typing import (
+    AbstractSet,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, inspect, select, text  # type: ignore
+
+from . import db
+from .models import (
+    BorrowableItem,
+    BorrowState,
+    ItemOpenBorrows,
+    User,
+    UserOpenBorrows,
+)
+
+# item id, user id, open quantity delta, open borrow state count delta
+OpenBorrowChange = Tuple[int, int, int, int]
+
+_ADD_OPEN_BORROWS = text(
+    "INSERT INTO item_open_borrows (item_id, open_quantity, borrower_count) "
+    "VALUES (:item_id, :open_quantity, :borrower_count) "
+    "ON CONFLICT (item_id) DO UPDATE SET "
+    "open_quantity = item_open_borrows.open_quantity + excluded.open_quantity, "
+    "borrower_count = item_open_borrows.borrower_count + excluded.borrower_count"
+)
+
+_ADD_USER_OPEN_BORROWS = text(
+    "INSERT INTO user_open_borrows (user_id, open_quantity, item_count) "
+    "VALUES (:user_id, :open_quantity, :item_count) "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    "open_quantity = user_open_borrows.open_quantity + excluded.open_quantity, "
+    "item_count = user_open_borrows.item_count + excluded.item_count"
+)
+
+
+# Borrow state column grouped by and column counted distinctly, per aggregate.
+_AGGREGATED_BY = {
+    ItemOpenBorrows: (BorrowState.borrowed_item_id, BorrowState.borrowing_user_id),
+    UserOpenBorrows: (BorrowState.borrowing_user_id, BorrowState.borrowed_item_id),
+}
+
+
+class OpenTotals(NamedTuple):
+    """Open quantity and number of distinct borrowers of an item."""
+
+    quantity: int
+    borrowers: int
+
+    @classmethod
+    def of(cls, open_borrowstates: Iterable[BorrowState]) -> "OpenTotals":
+        """Count the totals of a list of open borrow states."""
+        open_borrowstates = list(open_borrowstates)
+        return cls(
+            sum(bs.quantity for bs in open_borrowstates),
+            len({bs.borrowing_user_id for bs in open_borrowstates}),
+        )
+
+
+def open_borrow_totals(items: Iterable[BorrowableItem]) -> Dict[int, OpenTotals]:
+    """Return the open totals of items, by item id."""
+    totals = {}
+    for item in items:
+        aggregate = item.open_borrows
+        totals[item.id] = (
+            OpenTotals(0, 0)
+            if aggregate is None
+            else OpenTotals(aggregate.open_quantity, aggregate.borrower_count)
+        )
+    return totals
+
+
+def record_open_borrow_changes(
+    changes: Iterable[OpenBorrowChange],
+    open_counts: Optional[Mapping[Tuple[int, int], int]] = None,
+    deleted_items: AbstractSet[int] = frozenset(),
+    deleted_users: AbstractSet[int] = frozenset(),
+) -> None:
+    """
+    Apply changes of open borrow states to the aggregates.
+
+    Each change is a tuple of item id, user id and the changes of the open
+    quantity and the number of open borrow states of that user and item.
+
+    Whether users stopped or started borrowing an item is told from the number
+    of open borrow states per item and user id after the changes. Unless the
+    caller knows them as open_counts, they are queried from the database.
+
+    Aggregates of deleted_items and deleted_users are not touched, their rows
+    are deleted along with them.
+    """
+    summed: Dict[Tuple[int, int], List[int]] = collections.defaultdict(lambda: [0, 0])
+    for item_id, user_id, quantity, count in changes:
+        summed[item_id, user_id][0] += quantity
+        summed[item_id, user_id][1] += count
+    pairs = {pair: delta for pair, delta in summed.items() if delta != [0, 0]}
+    if not pairs:
+        return
+    if open_counts is None:
+        open_counts = _query_open_counts(pairs)
+
+    item_deltas, user_deltas = _aggregate_deltas(pairs, open_counts)
+    item_rows = [
+        {"item_id": item_id, "open_quantity": quantity, "borrower_count": count}
+        for item_id, (quantity, count) in item_deltas.items()
+        if item_id not in deleted_items
+    ]
+    if item_rows:
+        db.session.execute(_ADD_OPEN_BORROWS, item_rows)
+    user_rows = [
+        {"user_id": user_id, "open_quantity": quantity, "item_count": count}
+        for user_id, (quantity, count) in user_deltas.items()
+        if user_id not in deleted_users
+    ]
+    if user_rows:
+        db.session.execute(_ADD_USER_OPEN_BORROWS, user_rows)
+
+
+def _aggregate_deltas(
+    pairs: Mapping[Tuple[int, int], List[int]],
+    open_counts: Mapping[Tuple[int, int], int],
+) -> Tuple[Dict[int, List[int]], Dict[int, List[int]]]:
+    # Sum the changes per item and per user. A user starts or stops counting as
+    # a borrower of an item when they go from none to some open borrow states
+    # of it, or back.
+    item_deltas: Dict[int, List[int]] = collections.defaultdict(lambda: [0, 0])
+    user_deltas: Dict[int, List[int]] = collections.defaultdict(lambda: [0, 0])
+    for (item_id, user_id), (quantity, count) in pairs.items():
+        after = open_counts.get((item_id, user_id), 0)
+        started = (after > 0) - (after - count > 0)
+        for deltas, key in ((item_deltas, item_id), (user_deltas, user_id)):
+            deltas[key][0] += quantity
+            deltas[key][1] += started
+    return item_deltas, user_deltas
+
+
+def _query_open_counts(pairs: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], int]:
+    pairs = set(pairs)
+    counts = {}
+    for item_id, user_id, count in db.session.execute(
+        select(
+            [BorrowState.borrowed_item_id, BorrowState.borrowing_user_id, func.count()]
+        )
+        .where(BorrowState.borrowed_item_id.in_({item for item, _ in pairs}))
+        .where(BorrowState.borrowing_user_id.in_({user for _, user in pairs}))
+        .where(BorrowState.returned_at.is_(None))
+        .group_by(BorrowState.borrowed_item_id, BorrowState.borrowing_user_id)
+    ):
+        if (item_id, user_id) in pairs:
+            counts[item_id, user_id] = count
+    return counts
+
+
+def rebuild_aggregates(*models: Any) -> List[int]:
+    """
+    Recompute aggregates in the current transaction.
+
+    Rebuilds the tables of the given aggregate models, by default all of them.
+    Returns the number of rows of each, i.e. of items or users with open
+    borrow states.
+    """
+    return [_rebuild_aggregate(model) for model in models or tuple(_AGGREGATED_BY)]
+
+
+def _rebuild_aggregate(model: Any) -> int:
+    key, other = _AGGREGATED_BY[model]
+    table = model.__table__
+    db.session.execute(table.delete())
+    db.session.execute(
+        table.insert().from_select(
+            [column.name for column in table.columns],
+            select([key, func.sum(BorrowState.quantity), func.count(other.distinct())])
+            .where(BorrowState.returned_at.is_(None))
+            .group_by(key),
+        )
+    )
+    return int(db.session.query(model).count())
+
+
+@click.command("rebuild-aggregates")
+@with_appcontext
+def rebuild_aggregates_command() -> None:
+    """CLI command to recompute the open borrow aggregates."""
+    items, users = rebuild_aggregates()
+    db.session.commit()
+    click.echo(f"Rebuilt open borrows of {items} items and {users} users.")
+
+
+@event.listens_for(db.session, "after_flush")
+def _track_borrowstate_changes(session: Any, _context: Any) -> None:
+    deleted = session.deleted
+    deleted_items = {obj.id for obj in deleted if isinstance(obj, BorrowableItem)}
+    deleted_users = {obj.id for obj in deleted if isinstance(obj, User)}
+    changes = []
+    for obj in [*session.new, *session.dirty, *deleted]:
+        if not isinstance(obj, BorrowState):
+            continue
+        before = None if obj in session.new else _open_borrow(obj, committed=True)
+        after = None if obj in deleted else _open_borrow(obj, committed=False)
+        if before == after:
+            continue
+        for open_borrow, sign in ((before, -1), (after, 1)):
+            if open_borrow is not None:
+                item_id, user_id, quantity = open_borrow
+                changes.append((item_id, user_id, sign * quantity, sign))
+    record_open_borrow_changes(
+        changes, deleted_items=deleted_items, deleted_users=deleted_users
+    )
+
+
+def _open_borrow(
+    borrow_state: BorrowState, committed: bool
+) -> Optional[Tuple[int, int, int]]:
+    attrs = inspect(borrow_state).attrs
+
+    def value(key: str) -> Any:
+        history = attrs[key].history
+        if committed and history.deleted:
+            return history.deleted[0]
+        if not committed and history.added:
+            return history.added[0]
+        return attrs[key].value
+
+    if value("returned_at") is not None:
+        return None
+    return value("borrowed_item_id"), value("borrowing_user_id"), value("quantity")
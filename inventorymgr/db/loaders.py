@@ -0,0 +1,114 @@
+"""
+Derive SQLAlchemy loader strategies from marshmallow schemas.
+
+Dumping a list of ORM objects through a schema with nested fields lazy-loads
+every nested relationship once per row. Queries feeding such schemas declare
+their loader options with loader_options() instead, so the relationships are
+loaded up front with a constant number of queries.
+
+Read-only endpoints that do not need ORM objects at all can use select_rows()
+to fetch just the columns a schema dumps as lightweight named tuples.
+
+loader_options()
+    Return eager loading options for all nested fields of a schema.
+
+select_rows()
+    Select the columns dumped by a schema as named tuples.
+"""
+
+import collections
+import functools
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+from marshmallow import Schema, fields
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload  # type: ignore
+from sqlalchemy.orm.properties import ColumnProperty  # type: ignore
+
+
+def loader_options(model: Any, schema: Schema) -> List[Any]:
+    """
+    Return eager loading options for all nested fields of schema.
+
+    Collections are loaded with selectinload(), many-to-one relationships are
+    joined. Nested objects only load the columns their schema dumps.
+    """
+    options = []
+    for name, field in schema.dump_fields.items():
+        if not isinstance(field, fields.Nested):
+            continue
+        attribute = getattr(model, field.attribute or name)
+        relationship = attribute.property
+        strategy = selectinload if relationship.uselist else joinedload
+        nested_model = relationship.mapper.class_
+        nested_schema = field.schema
+        options.append(
+            strategy(attribute)
+            .load_only(*_column_names(relationship.mapper, nested_schema))
+            .options(*loader_options(nested_model, nested_schema))
+        )
+    return options
+
+
+def select_rows(model: Any, schema: Schema, query: Optional[Any] = None) -> List[Any]:
+    """
+    Select the columns dumped by schema from query as named tuples.
+
+    Unlike ORM objects, the rows only contain what the schema dumps and are
+    not registered in the session. Nested fields become a tuple or a list of
+    tuples, each loaded with one additional query. Rows are ordered by
+    primary key.
+    """
+    query = model.query if query is None else query
+    primary_key = inspect(model).primary_key[0]
+    columns = []
+    nested = []
+    children = {}
+    for name, field in schema.dump_fields.items():
+        attribute = field.attribute or name
+        if isinstance(field, fields.Nested):
+            nested.append(attribute)
+            children[attribute] = _select_children(
+                query, model, attribute, field.schema
+            )
+        else:
+            columns.append(attribute)
+
+    row_type = _row_type(model, tuple(columns + nested))
+    rows = query.with_entities(primary_key, *[getattr(model, c) for c in columns])
+    return [
+        row_type(*row[1:], *[children[name](row[0]) for name in nested])
+        for row in rows.order_by(primary_key)
+    ]
+
+
+def _select_children(query: Any, model: Any, name: str, schema: Schema) -> Any:
+    attribute = getattr(model, name)
+    relationship = attribute.property
+    nested_model = relationship.mapper.class_
+    columns = _column_names(relationship.mapper, schema)
+    if len(columns) != len(schema.dump_fields):
+        raise ValueError(f"Nested fields in {name} are not supported")
+    row_type = _row_type(nested_model, tuple(columns))
+    grouped: Dict[Any, List[Any]] = collections.defaultdict(list)
+    rows = query.with_entities(
+        inspect(model).primary_key[0], *[getattr(nested_model, c) for c in columns]
+    ).join(attribute)
+    for parent_id, *values in rows:
+        grouped[parent_id].append(row_type(*values))
+    if relationship.uselist:
+        return lambda parent_id: grouped.get(parent_id, [])
+    return lambda parent_id: next(iter(grouped.get(parent_id, [])), None)
+
+
+def _column_names(mapper: Any, schema: Schema) -> List[str]:
+    return [
+        name
+        for name in schema.dump_fields
+        if isinstance(getattr(mapper.attrs, name, None), ColumnProperty)
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def _row_type(model: Any, columns: Sequence[str]) -> Type[Tuple[Any, ...]]:
+    return collections.namedtuple(f"{model.__name__}Row", columns)
@@ -0,0 +1,447 @@
+"""
+Cold storage of log entries in compressed, columnar segment files.
+
+Log entries past their retention period are moved out of the database into
+segment files in LOGS_ARCHIVE_DIR, see inventorymgr.db.retention. Segments
+are written once and never changed, each compaction batch adds a new one.
+The logs API and export read them along with the database when a request
+reaches back far enough.
+
+A segment holds log entries sorted by timestamp and id, in row groups of up
+to GROUP_ROWS entries. Each column of a row group is a separate zlib
+compressed chunk of little-endian 64 bit integers. Ids and timestamps are
+delta encoded, actions are indexes into a list of the group's actions. A
+JSON footer lists the offset, time range and chunk sizes of each group:
+
+    MAGIC | chunks of group 1 | ... | footer | footer size (8 bytes) | MAGIC
+
+Segments are read through memory maps, and only the chunks of groups
+overlapping the requested time range are decompressed. Footers are cached
+per process.
+
+A segment is written before the transaction deleting its rows commits, so
+if that fails, entries may be both archived and in the database, or archived
+twice. Readers skip such duplicates.
+
+ArchivedItem, ArchivedLog
+    Log entries read from segments, dumped like LogEntry objects.
+
+Segment
+    Time range and row groups of a segment file.
+
+write_segment(), read_segment_footer(), read_segment()
+    Write and read segment files.
+
+LogArchive
+    The segments in a directory.
+
+init_app()
+    Configure the log archive of an app.
+
+get_log_archive()
+    Return the log archive of the current app.
+
+archive_log_entries()
+    Write log entries from the database to a new segment.
+"""
+
+import array
+import bisect
+import collections
+import datetime
+import heapq
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from flask import Flask, current_app
+from sqlalchemy import select  # type: ignore
+
+from . import db
+from .models import LogEntry
+
+MAGIC = b"INVLOGS1"
+GROUP_ROWS = 4096
+SEGMENT_SUFFIX = ".logseg"
+
+_TRAILER = struct.Struct("<Q8s")
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+class ArchivedItem(NamedTuple):
+    """Reference to an item of an archived log entry."""
+
+    id: int
+
+
+class ArchivedLog(NamedTuple):
+    """A log entry read from a segment."""
+
+    id: int
+    timestamp: datetime.datetime
+    action: str
+    subject_id: int
+    secondary_id: Optional[int]
+    items: List[ArchivedItem]
+
+    def as_export(self) -> Dict[str, Any]:
+        """Return the entry like inventorymgr.logs.iter_log_export() does."""
+        return {
+            "id": self.id,
+            "timestamp": self.timestamp.isoformat(),
+            "action": self.action,
+            "subject_id": self.subject_id,
+            "secondary_id": self.secondary_id,
+            "items": [item.id for item in self.items],
+        }
+
+
+class Segment(NamedTuple):
+    """Time range and row groups of a segment file."""
+
+    path: str
+    min_timestamp: datetime.datetime
+    max_timestamp: datetime.datetime
+    groups: List[Dict[str, Any]]
+
+
+def write_segment(path: str, entries: Iterable[ArchivedLog]) -> Segment:
+    """Write entries to a new segment file, atomically."""
+    entries = sorted(entries, key=_position)
+    groups = []
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as out:
+        out.write(MAGIC)
+        offset = len(MAGIC)
+        for start in range(0, len(entries), GROUP_ROWS):
+            group = entries[start : start + GROUP_ROWS]
+            actions = sorted({entry.action for entry in group})
+            codes = {action: code for code, action in enumerate(actions)}
+            columns = (
+                _deltas(entry.id for entry in group),
+                _deltas(_micros(entry.timestamp) for entry in group),
+                (codes[entry.action] for entry in group),
+                (entry.subject_id for entry in group),
+                (entry.secondary_id or 0 for entry in group),
+                (len(entry.items) for entry in group),
+                (item.id for entry in group for item in entry.items),
+            )
+            chunks = [zlib.compress(_pack(column)) for column in columns]
+            for chunk in chunks:
+                out.write(chunk)
+            groups.append(
+                {
+                    "offset": offset,
+                    "sizes": [len(chunk) for chunk in chunks],
+                    "rows": len(group),
+                    "actions": actions,
+                    "min_timestamp": _micros(group[0].timestamp),
+                    "max_timestamp": _micros(group[-1].timestamp),
+                }
+            )
+            offset += sum(len(chunk) for chunk in chunks)
+        footer = json.dumps({"rows": len(entries), "groups": groups}).encode()
+        out.write(footer)
+        out.write(_TRAILER.pack(len(footer), MAGIC))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temp_path, path)
+    return _segment(path, groups)
+
+
+def read_segment_footer(path: str) -> Segment:
+    """Read the footer of a segment file, raising ValueError if invalid."""
+    with open(path, "rb") as segment_file, mmap.mmap(
+        segment_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        size, magic = _TRAILER.unpack(data[-_TRAILER.size :])
+        if magic != MAGIC or data[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a log segment")
+        footer = json.loads(data[-_TRAILER.size - size : -_TRAILER.size])
+    return _segment(path, footer["groups"])
+
+
+def read_segment(
+    segment: Segment,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    newest_first: bool = False,
+) -> Iterator[ArchivedLog]:
+    """
+    Yield the entries of a segment from since up to, excluding, until, in
+    chronological order or newest first.
+    """
+    groups = [
+        group
+        for group in segment.groups
+        if (since is None or group["max_timestamp"] >= _micros(since))
+        and (until is None or group["min_timestamp"] < _micros(until))
+    ]
+    if not groups:
+        return
+    if newest_first:
+        groups.reverse()
+    with open(segment.path, "rb") as segment_file, mmap.mmap(
+        segment_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        for group in groups:
+            yield from _read_group(data, group, since, until, newest_first)
+
+
+class LogArchive:
+    """The segments in a directory, with their footers cached."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._segments: Dict[str, Segment] = {}
+
+    def segments(self) -> List[Segment]:
+        """Return all segments, oldest first."""
+        try:
+            names = sorted(
+                name
+                for name in os.listdir(self.directory)
+                if name.endswith(SEGMENT_SUFFIX)
+            )
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            self._segments = {
+                name: self._segments.get(name)
+                or read_segment_footer(os.path.join(self.directory, name))
+                for name in names
+            }
+            return list(self._segments.values())
+
+    def newest(self) -> Optional[datetime.datetime]:
+        """Return the timestamp of the newest archived entry, if any."""
+        return max((s.max_timestamp for s in self.segments()), default=None)
+
+    def append(self, entries: List[ArchivedLog]) -> Optional[Segment]:
+        """Write entries to a new segment, unless there are none."""
+        if not entries:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        first = min(entries, key=_position)
+        name = f"{first.timestamp:%Y%m%dT%H%M%S%f}-{first.id}{SEGMENT_SUFFIX}"
+        return write_segment(os.path.join(self.directory, name), entries)
+
+    def entries(
+        self,
+        filters: Mapping[str, Any],
+        before: Optional[Tuple[datetime.datetime, int]] = None,
+        newest_first: bool = False,
+    ) -> Iterator[ArchivedLog]:
+        """
+        Yield archived entries matching the filters of a LogFilterSchema, with
+        naive UTC timestamps, ordered by timestamp and id.
+
+        If before is given as a timestamp and id, only entries positioned
+        before it are yielded.
+        """
+        since, until = filters.get("since"), filters.get("until")
+        if before is not None:
+            before_until = before[0] + _MICROSECOND
+            until = before_until if until is None else min(until, before_until)
+        clusters = _overlapping_clusters(
+            segment
+            for segment in self.segments()
+            if (since is None or segment.max_timestamp >= since)
+            and (until is None or segment.min_timestamp < until)
+        )
+        if newest_first:
+            clusters.reverse()
+        merged = itertools.chain.from_iterable(
+            heapq.merge(
+                *(read_segment(s, since, until, newest_first) for s in cluster),
+                key=_position,
+                reverse=newest_first,
+            )
+            for cluster in clusters
+        )
+        last_id = None
+        for entry in merged:
+            if entry.id == last_id:
+                continue
+            last_id = entry.id
+            if before is not None and _position(entry) >= before:
+                continue
+            if _matches(entry, filters):
+                yield entry
+
+
+def init_app(app: Flask) -> None:
+    """Configure the log archive of an app from its config."""
+    directory = app.config["LOGS_ARCHIVE_DIR"] or os.path.join(
+        app.instance_path, "logs-archive"
+    )
+    app.extensions["log_archive"] = LogArchive(directory)
+
+
+def get_log_archive() -> LogArchive:
+    """Return the log archive of the current app."""
+    return current_app.extensions["log_archive"]  # type: ignore
+
+
+def archive_log_entries(ids: List[int]) -> None:
+    """Write the log entries with the given ids to a new segment."""
+    items_table = LogEntry.items.property.secondary
+    items = collections.defaultdict(list)
+    for entry_id, item_id in db.session.execute(
+        select([items_table.c.logentry_id, items_table.c.item_id])
+        .where(items_table.c.logentry_id.in_(ids))
+        .order_by(items_table.c.logentry_id, items_table.c.item_id)
+    ):
+        items[entry_id].append(ArchivedItem(item_id))
+    rows = db.session.execute(
+        LogEntry.__table__.select().where(LogEntry.id.in_(ids))
+    )
+    get_log_archive().append(
+        [
+            ArchivedLog(
+                id=row.id,
+                timestamp=row.timestamp,
+                action=row.action,
+                subject_id=row.subject_id,
+                secondary_id=row.secondary_id,
+                items=items[row.id],
+            )
+            for row in rows
+        ]
+    )
+
+
+def _position(entry: Any) -> Any:
+    return entry.timestamp, entry.id
+
+
+def _overlapping_clusters(segments: Iterable[Segment]) -> List[List[Segment]]:
+    # Segments written by successive compactions usually cover disjoint time
+    # ranges. Only those that overlap have to be merged, the rest are read
+    # one after another without decompressing them up front.
+    clusters: List[List[Segment]] = []
+    end = datetime.datetime.min
+    for segment in sorted(segments, key=lambda s: s.min_timestamp):
+        if clusters and segment.min_timestamp <= end:
+            clusters[-1].append(segment)
+        else:
+            clusters.append([segment])
+        end = max(end, segment.max_timestamp)
+    return clusters
+
+
+def _matches(entry: ArchivedLog, filters: Mapping[str, Any]) -> bool:
+    for column in ("action", "subject_id", "secondary_id"):
+        if column in filters and getattr(entry, column) != filters[column]:
+            return False
+    if "item_id" in filters:
+        return any(item.id == filters["item_id"] for item in entry.items)
+    return True
+
+
+def _segment(path: str, groups: List[Dict[str, Any]]) -> Segment:
+    return Segment(
+        path,
+        _EPOCH + groups[0]["min_timestamp"] * _MICROSECOND,
+        _EPOCH + max(group["max_timestamp"] for group in groups) * _MICROSECOND,
+        groups,
+    )
+
+
+class _GroupColumns(NamedTuple):
+    ids: List[int]
+    timestamps: List[int]
+    actions: Sequence[int]
+    subjects: Sequence[int]
+    secondaries: Sequence[int]
+    item_counts: Sequence[int]
+    item_ids: Sequence[int]
+
+
+def _decode_group(data: Any, group: Dict[str, Any]) -> _GroupColumns:
+    chunks = []
+    offset = group["offset"]
+    for size in group["sizes"]:
+        chunks.append(_unpack(zlib.decompress(data[offset : offset + size])))
+        offset += size
+    return _GroupColumns(
+        ids=list(itertools.accumulate(chunks[0])),
+        timestamps=list(itertools.accumulate(chunks[1])),
+        actions=chunks[2],
+        subjects=chunks[3],
+        secondaries=chunks[4],
+        item_counts=chunks[5],
+        item_ids=chunks[6],
+    )
+
+
+def _read_group(
+    data: Any,
+    group: Dict[str, Any],
+    since: Optional[datetime.datetime],
+    until: Optional[datetime.datetime],
+    newest_first: bool,
+) -> Iterator[ArchivedLog]:
+    columns = _decode_group(data, group)
+    stamps = columns.timestamps
+    item_ends = list(itertools.accumulate(columns.item_counts))
+    # Entries are only built for the rows in the time range.
+    start = 0 if since is None else bisect.bisect_left(stamps, _micros(since))
+    end = len(stamps) if until is None else bisect.bisect_left(stamps, _micros(until))
+    rows = range(end - 1, start - 1, -1) if newest_first else range(start, end)
+    for row in rows:
+        items_start = item_ends[row] - columns.item_counts[row]
+        yield ArchivedLog(
+            id=columns.ids[row],
+            timestamp=_EPOCH + stamps[row] * _MICROSECOND,
+            action=group["actions"][columns.actions[row]],
+            subject_id=columns.subjects[row],
+            secondary_id=columns.secondaries[row] or None,
+            items=[
+                ArchivedItem(item_id)
+                for item_id in columns.item_ids[items_start : item_ends[row]]
+            ],
+        )
+
+
+def _micros(timestamp: datetime.datetime) -> int:
+    return (timestamp - _EPOCH) // _MICROSECOND
+
+
+def _deltas(values: Iterable[int]) -> List[int]:
+    values = list(values)
+    return [b - a for a, b in zip([0] + values, values)]
+
+
+def _pack(values: Iterable[int]) -> bytes:
+    packed = array.array("q", values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(data: bytes) -> "array.array[int]":
+    unpacked = array.array("q")
+    unpacked.frombytes(data)
+    if sys.byteorder == "big":
+        unpacked.byteswap()
+    return unpacked
@@ -0,0 +1,524 @@
+"""
+Versioned schema migrations.
+
+db.create_all() only creates missing tables, so it cannot bring an existing
+database up to date with the models. Migrations are functions registered with
+the migration() decorator under increasing version numbers. upgrade() applies
+every migration that is missing from the schema_migration history table, in
+order, and records it there. Databases created from scratch by init-db already
+have the current schema and are stamped with all versions instead.
+
+Migrations must not depend on the current models, as later migrations expect
+the schema as of their predecessors. They run frozen copies of the DDL of the
+tables, columns and indexes they create, the first one for the tables
+predating migrations.
+
+SQLite cannot change column definitions or constraints in place. Migrations
+doing so can use rebuild_table(), which copies a table into a new table created
+from the current model definition and swaps the two. The copy is done in
+batches, each in its own short transaction, so the database stays writable
+during the upgrade. Triggers mirror concurrent writes to the old table into
+the new one until the swap. None of the migrations so far needs it.
+
+Only some of their statements are quick on large tables. Adding a column with
+a constant default only changes the schema in SQLite, whatever the table
+size. Creating an index reads the whole table in a single statement, and
+holds the write lock until it finishes. Migrations 2 and 5 do so on
+borrow_state and log_entry, so on large databases they should be applied when
+writes can wait, or their indexes created beforehand with create-indexes.
+
+migration()
+    Register a migration function under a version number.
+
+upgrade()
+    Apply all pending migrations.
+
+stamp()
+    Record all migrations as applied without running them.
+
+add_column()
+    Add a column to an existing table.
+
+rebuild_table()
+    Rebuild a SQLite table from its model definition in batches.
+
+create_indexes()
+    Create indexes missing from an existing database.
+
+init_db_command()
+    Command line interface for recreating the database.
+
+create_indexes_command()
+    Command line interface for creating missing indexes.
+
+db_upgrade_command()
+    Command line interface for applying pending migrations.
+"""
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import MetaData, Table, inspect, text  # type: ignore
+from sqlalchemy.schema import CreateTable  # type: ignore
+
+from . import db
+from .models import SchemaMigration
+
+#: Number of rows rebuild_table() copies per transaction.
+REBUILD_BATCH_SIZE = 5000
+
+
+class Migration(NamedTuple):
+    """A registered migration."""
+
+    version: int
+    description: str
+    upgrade: Callable[[], None]
+
+
+MIGRATIONS: Dict[int, Migration] = {}
+
+
+def migration(
+    version: int, description: str
+) -> Callable[[Callable[[], None]], Callable[[], None]]:
+    """
+    Register the decorated function as the migration to version.
+
+    The function runs in an app context. It may commit as often as it needs to.
+    """
+
+    def register(upgrade_func: Callable[[], None]) -> Callable[[], None]:
+        assert version not in MIGRATIONS, f"duplicate migration {version}"
+        MIGRATIONS[version] = Migration(version, description, upgrade_func)
+        return upgrade_func
+
+    return register
+
+
+def pending_migrations() -> List[Migration]:
+    """Return the migrations missing from the history table, in order."""
+    SchemaMigration.__table__.create(bind=db.engine, checkfirst=True)
+    applied = {version for version, in db.session.query(SchemaMigration.version)}
+    return [MIGRATIONS[v] for v in sorted(MIGRATIONS) if v not in applied]
+
+
+def upgrade() -> List[Migration]:
+    """Apply and record all pending migrations, return the applied ones."""
+    applied = []
+    for pending in pending_migrations():
+        pending.upgrade()
+        db.session.add(
+            SchemaMigration(version=pending.version, description=pending.description)
+        )
+        db.session.commit()
+        applied.append(pending)
+    return applied
+
+
+def stamp() -> None:
+    """Record all pending migrations as applied without running them."""
+    for pending in pending_migrations():
+        db.session.add(
+            SchemaMigration(version=pending.version, description=pending.description)
+        )
+    db.session.commit()
+
+
+def add_column(table_name: str, column_name: str, definition: str) -> None:
+    """Add a column with a type and constraints to a table, unless it exists."""
+    columns = {c["name"] for c in inspect(db.engine).get_columns(table_name)}
+    if column_name not in columns:
+        db.session.execute(
+            f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}"
+        )
+        db.session.commit()
+
+
+def rebuild_table(table: Table, batch_size: int = REBUILD_BATCH_SIZE) -> int:
+    """
+    Rebuild a SQLite table from its current definition, return the copied rows.
+
+    Columns present in both the old and the new definition are copied, new
+    columns must be nullable or have a server default. The table needs a single
+    integer primary key, which is used to copy the rows in batches.
+    """
+    (primary_key,) = table.primary_key.columns
+    pk = primary_key.name
+    new_name = f"_rebuild_{table.name}"
+    old_columns = {c["name"] for c in inspect(db.engine).get_columns(table.name)}
+    columns = [c.name for c in table.columns if c.name in old_columns]
+    batch_end, copy_batch = _copy_statements(table.name, new_name, pk, columns)
+
+    db.session.remove()
+    connection = db.engine.connect()
+    try:
+        # Dropping the old table would otherwise cascade to referencing rows.
+        # The pragma has no effect inside a transaction.
+        connection.execute("PRAGMA foreign_keys=OFF")
+        with connection.begin():
+            connection.execute(f"DROP TABLE IF EXISTS {new_name}")
+            connection.execute(CreateTable(_renamed_copy(table, new_name)))
+            for trigger in _mirror_triggers(table.name, new_name, pk, columns):
+                connection.execute(trigger)
+            first = connection.execute(f"SELECT MIN({pk}) FROM {table.name}").scalar()
+
+        copied = _copy_in_batches(connection, batch_end, copy_batch, first, batch_size)
+
+        with connection.begin():
+            for trigger in ("insert", "update", "delete"):
+                connection.execute(f"DROP TRIGGER {new_name}_{trigger}")
+            connection.execute(f"DROP TABLE {table.name}")
+            connection.execute(f"ALTER TABLE {new_name} RENAME TO {table.name}")
+            for index in table.indexes:
+                index.create(bind=connection)
+            violations = connection.execute(
+                f"PRAGMA foreign_key_check({table.name})"
+            ).fetchall()
+            if violations:
+                raise RuntimeError(
+                    f"rebuilding {table.name} violates foreign keys: {violations}"
+                )
+    finally:
+        connection.execute("PRAGMA foreign_keys=ON")
+        connection.close()
+    return copied
+
+
+def _copy_statements(
+    old: str, new: str, pk: str, columns: List[str]
+) -> Tuple[text, text]:
+    # The end of the batch after :last, and the copy of the rows up to it.
+    names = ", ".join(columns)
+    batch_end = text(
+        f"SELECT MAX({pk}) FROM (SELECT {pk} FROM {old} "
+        f"WHERE {pk} > :last ORDER BY {pk} LIMIT :limit)"
+    )
+    copy_batch = text(
+        f"INSERT OR IGNORE INTO {new} ({names}) SELECT {names} "
+        f"FROM {old} WHERE {pk} > :last AND {pk} <= :end"
+    )
+    return batch_end, copy_batch
+
+
+def _copy_in_batches(
+    connection: Any,
+    batch_end: text,
+    copy_batch: text,
+    first: Optional[int],
+    batch_size: int,
+) -> int:
+    # Each batch is copied in its own transaction, starting after the row before
+    # first, until batch_end finds no more rows.
+    copied = 0
+    last = None if first is None else first - 1
+    while last is not None:
+        with connection.begin():
+            end = connection.execute(batch_end, last=last, limit=batch_size).scalar()
+            if end is not None:
+                copied += connection.execute(copy_batch, last=last, end=end).rowcount
+            last = end
+    return copied
+
+
+def _renamed_copy(table: Table, name: str) -> Table:
+    # Foreign keys are resolved against the metadata, so the other tables are
+    # copied along. Indexes are created after the swap, under their own names.
+    metadata = MetaData()
+    for other in table.metadata.sorted_tables:
+        if other is not table:
+            other.tometadata(metadata)
+    copy = table.tometadata(metadata, name=name)
+    copy.indexes.clear()
+    return copy
+
+
+def _mirror_triggers(old: str, new: str, pk: str, columns: List[str]) -> List[str]:
+    names = ", ".join(columns)
+    values = ", ".join(f"NEW.{column}" for column in columns)
+    upsert = f"INSERT OR REPLACE INTO {new} ({names}) VALUES ({values});"
+    delete = f"DELETE FROM {new} WHERE {pk} = OLD.{pk};"
+    return [
+        f"CREATE TRIGGER {new}_insert AFTER INSERT ON {old} BEGIN {upsert} END",
+        f"CREATE TRIGGER {new}_update AFTER UPDATE ON {old} BEGIN {delete} {upsert} END",
+        f"CREATE TRIGGER {new}_delete AFTER DELETE ON {old} BEGIN {delete} END",
+    ]
+
+
+# The schema of the tables predating migrations. Do not change, add migrations.
+_INITIAL_TABLES = [
+    """CREATE TABLE IF NOT EXISTS borrowable_item (
+        id INTEGER NOT NULL,
+        name VARCHAR NOT NULL,
+        quantity_total INTEGER NOT NULL,
+        quantity_in_stock INTEGER NOT NULL,
+        unmatched_returns INTEGER NOT NULL,
+        description TEXT,
+        PRIMARY KEY (id),
+        UNIQUE (name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS javascript_error (
+        id INTEGER NOT NULL,
+        timestamp DATETIME NOT NULL,
+        user_agent_raw VARCHAR NOT NULL,
+        platform VARCHAR,
+        browser VARCHAR,
+        browser_version VARCHAR,
+        browser_language VARCHAR,
+        location VARCHAR NOT NULL,
+        message VARCHAR,
+        source VARCHAR,
+        lineno INTEGER,
+        colno INTEGER,
+        stack VARCHAR,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS qualification (
+        id INTEGER NOT NULL,
+        name VARCHAR NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS registration_token (
+        id INTEGER NOT NULL,
+        token VARCHAR NOT NULL,
+        expires TIMESTAMP NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (token)
+    )""",
+    """CREATE TABLE IF NOT EXISTS user (
+        id INTEGER NOT NULL,
+        username VARCHAR NOT NULL,
+        password VARCHAR NOT NULL,
+        create_users BOOLEAN NOT NULL,
+        view_users BOOLEAN NOT NULL,
+        update_users BOOLEAN NOT NULL,
+        edit_qualifications BOOLEAN NOT NULL,
+        create_items BOOLEAN NOT NULL,
+        manage_checkouts BOOLEAN NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (username),
+        CHECK (create_users IN (0, 1)),
+        CHECK (view_users IN (0, 1)),
+        CHECK (update_users IN (0, 1)),
+        CHECK (edit_qualifications IN (0, 1)),
+        CHECK (create_items IN (0, 1)),
+        CHECK (manage_checkouts IN (0, 1))
+    )""",
+    """CREATE TABLE IF NOT EXISTS borrow_state (
+        id INTEGER NOT NULL,
+        borrowing_user_id INTEGER NOT NULL,
+        borrowed_item_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        received_at DATETIME NOT NULL,
+        returned_at DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(borrowing_user_id) REFERENCES user (id),
+        FOREIGN KEY(borrowed_item_id) REFERENCES borrowable_item (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS log_entry (
+        id INTEGER NOT NULL,
+        timestamp DATETIME NOT NULL,
+        action VARCHAR NOT NULL,
+        subject_id INTEGER NOT NULL,
+        secondary_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(subject_id) REFERENCES user (id),
+        FOREIGN KEY(secondary_id) REFERENCES user (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS required_qualifications (
+        item_id INTEGER,
+        qualification_id INTEGER,
+        FOREIGN KEY(item_id) REFERENCES borrowable_item (id),
+        FOREIGN KEY(qualification_id) REFERENCES qualification (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS user_qualifications (
+        user_id INTEGER,
+        qualification_id INTEGER,
+        FOREIGN KEY(user_id) REFERENCES user (id),
+        FOREIGN KEY(qualification_id) REFERENCES qualification (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS logentry_items (
+        logentry_id INTEGER,
+        item_id INTEGER,
+        FOREIGN KEY(logentry_id) REFERENCES log_entry (id),
+        FOREIGN KEY(item_id) REFERENCES borrowable_item (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS transfer_request (
+        id INTEGER NOT NULL,
+        issuing_user_id INTEGER NOT NULL,
+        target_user_id INTEGER NOT NULL,
+        borrowstate_id INTEGER NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(issuing_user_id) REFERENCES user (id),
+        FOREIGN KEY(target_user_id) REFERENCES user (id),
+        FOREIGN KEY(borrowstate_id) REFERENCES borrow_state (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS collection_version (
+        name VARCHAR NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (name)
+    )""",
+]
+
+
+@migration(1, "Create tables missing from databases predating migrations")
+def _create_missing_tables() -> None:
+    for statement in _INITIAL_TABLES:
+        db.session.execute(statement)
+    db.session.execute(
+        "INSERT OR IGNORE INTO collection_version (name, version) VALUES (:name, 0)",
+        [{"name": name} for name in ("items", "qualifications", "users")],
+    )
+    db.session.commit()
+
+
+# Lookups on the logs, borrow states and transfer requests.
+_LOOKUP_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_borrow_state_borrowing_user_id "
+    "ON borrow_state (borrowing_user_id)",
+    "CREATE INDEX IF NOT EXISTS ix_borrow_state_open_item_user "
+    "ON borrow_state (borrowed_item_id, borrowing_user_id) "
+    "WHERE returned_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_log_entry_subject_id ON log_entry (subject_id)",
+    "CREATE INDEX IF NOT EXISTS ix_log_entry_timestamp ON log_entry (timestamp)",
+    "CREATE INDEX IF NOT EXISTS ix_logentry_items_item_id ON logentry_items (item_id)",
+    "CREATE INDEX IF NOT EXISTS ix_logentry_items_logentry_id "
+    "ON logentry_items (logentry_id)",
+    "CREATE INDEX IF NOT EXISTS ix_transfer_request_borrowstate_id "
+    "ON transfer_request (borrowstate_id)",
+    "CREATE INDEX IF NOT EXISTS ix_transfer_request_target_user_id "
+    "ON transfer_request (target_user_id)",
+]
+
+
+@migration(2, "Create indexes for log, borrow state and transfer request lookups")
+def _create_lookup_indexes() -> None:
+    for statement in _LOOKUP_INDEXES:
+        db.session.execute(statement)
+    db.session.commit()
+
+
+@migration(3, "Add version columns for optimistic locking")
+def _add_version_columns() -> None:
+    for table in ("borrowable_item", "borrow_state", "user"):
+        add_column(table, "version", "INTEGER DEFAULT '1' NOT NULL")
+
+
+@migration(4, "Add aggregates of open borrow states per item")
+def _add_open_borrow_aggregates() -> None:
+    db.session.execute(
+        """CREATE TABLE IF NOT EXISTS item_open_borrows (
+            item_id INTEGER NOT NULL,
+            open_quantity INTEGER NOT NULL,
+            borrower_count INTEGER NOT NULL,
+            PRIMARY KEY (item_id),
+            FOREIGN KEY(item_id) REFERENCES borrowable_item (id) ON DELETE CASCADE
+        )"""
+    )
+    db.session.execute("DELETE FROM item_open_borrows")
+    db.session.execute(
+        "INSERT INTO item_open_borrows (item_id, open_quantity, borrower_count) "
+        "SELECT borrowed_item_id, SUM(quantity), COUNT(DISTINCT borrowing_user_id) "
+        "FROM borrow_state WHERE returned_at IS NULL GROUP BY borrowed_item_id"
+    )
+
+
+@migration(5, "Add aggregates of open borrow states per user, index overdue ones")
+def _add_user_open_borrow_aggregates() -> None:
+    db.session.execute(
+        """CREATE TABLE IF NOT EXISTS user_open_borrows (
+            user_id INTEGER NOT NULL,
+            open_quantity INTEGER NOT NULL,
+            item_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id),
+            FOREIGN KEY(user_id) REFERENCES user (id) ON DELETE CASCADE
+        )"""
+    )
+    db.session.execute("DELETE FROM user_open_borrows")
+    db.session.execute(
+        "INSERT INTO user_open_borrows (user_id, open_quantity, item_count) "
+        "SELECT borrowing_user_id, SUM(quantity), COUNT(DISTINCT borrowed_item_id) "
+        "FROM borrow_state WHERE returned_at IS NULL GROUP BY borrowing_user_id"
+    )
+    db.session.commit()
+    db.session.execute(
+        "CREATE INDEX IF NOT EXISTS ix_borrow_state_open_item_received_at "
+        "ON borrow_state (borrowed_item_id, received_at, quantity, returned_at) "
+        "WHERE returned_at IS NULL"
+    )
+    db.session.commit()
+
+
+@migration(6, "Count identical JS error reports")
+def _add_error_report_occurrences() -> None:
+    add_column("javascript_error", "occurrences", "INTEGER DEFAULT '1' NOT NULL")
+
+
+@migration(7, "Add archive table for borrow states")
+def _add_archive_tables() -> None:
+    db.session.execute(
+        """CREATE TABLE IF NOT EXISTS borrow_state_archive (
+            id INTEGER NOT NULL,
+            borrowing_user_id INTEGER NOT NULL,
+            borrowed_item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            received_at DATETIME NOT NULL,
+            returned_at DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        )"""
+    )
+    db.session.commit()
+
+
+@migration(8, "Add version counter for item stock")
+def _add_stock_version() -> None:
+    db.session.execute(
+        "INSERT OR IGNORE INTO collection_version (name, version) "
+        "VALUES ('items_stock', 0)"
+    )
+    db.session.commit()
+
+
+def create_indexes() -> List[str]:
+    """Create the indexes declared on the models that the database lacks."""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    created = []
+    for table in db.Model.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(bind=db.engine)
+                created.append(index.name)
+    return created
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command() -> None:
+    """CLI command to recreate the database from its schema."""
+    db.create_all()
+    stamp()
+    click.echo("Initialized database.")
+
+
+@click.command("create-indexes")
+@with_appcontext
+def create_indexes_command() -> None:
+    """CLI command to add missing indexes to an existing database."""
+    for name in create_indexes():
+        click.echo(f"Created index {name}.")
+    click.echo("Indexes are up to date.")
+
+
+@click.command("db-upgrade")
+@with_appcontext
+def db_upgrade_command() -> None:
+    """CLI command to apply pending schema migrations."""
+    for applied in upgrade():
+        click.echo(f"Applied migration {applied.version}: {applied.description}.")
+    click.echo("Database is up to date.")
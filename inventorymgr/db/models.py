@@ -1,6 +1,10 @@
 """Database ORM models. """
 
 import datetime
+from typing import Any
+
+from sqlalchemy import event, inspect  # type: ignore
+from sqlalchemy.orm.attributes import flag_modified  # type: ignore
 
 from . import db
 
@@ -25,8 +29,10 @@ _REQUIRED_QUALIFICATIONS_TABLE = db.Table(
 _LOGENTRY_ITEMS_TABLE = db.Table(
     "logentry_items",
     db.Model.metadata,
-    db.Column("logentry_id", db.Integer, db.ForeignKey("log_entry.id")),
-    db.Column("item_id", db.Integer, db.ForeignKey("borrowable_item.id")),
+    db.Column("logentry_id", db.Integer, db.ForeignKey("log_entry.id"), index=True),
+    db.Column(
+        "item_id", db.Integer, db.ForeignKey("borrowable_item.id"), index=True
+    ),
 )
 
 
@@ -43,6 +49,7 @@ class User(db.Model):  # type: ignore
     edit_qualifications = db.Column(db.Boolean, nullable=False, default=False)
     create_items = db.Column(db.Boolean, nullable=False, default=False)
     manage_checkouts = db.Column(db.Boolean, nullable=False, default=False)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
     qualifications = db.relationship(
         "Qualification", secondary=_USER_QUALIFICATIONS_TABLE, back_populates="users"
     )
@@ -73,6 +80,8 @@ class User(db.Model):  # type: ignore
         foreign_keys="TransferRequest.target_user_id",
     )
 
+    __mapper_args__ = {"version_id_col": version}
+
 
 class RegistrationToken(db.Model):  # type: ignore
 
@@ -109,6 +118,7 @@ class BorrowableItem(db.Model):  # type: ignore
     quantity_in_stock = db.Column(db.Integer, default=1, nullable=False)
     unmatched_returns = db.Column(db.Integer, default=0, nullable=False)
     description = db.Column(db.Text)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
     required_qualifications = db.relationship(
         "Qualification",
         secondary=_REQUIRED_QUALIFICATIONS_TABLE,
@@ -122,13 +132,18 @@ class BorrowableItem(db.Model):  # type: ignore
     log_entries = db.relationship(
         "LogEntry", secondary=_LOGENTRY_ITEMS_TABLE, back_populates="items"
     )
+    open_borrows = db.relationship("ItemOpenBorrows", uselist=False, viewonly=True)
+
+    __mapper_args__ = {"version_id_col": version}
 
 
 class BorrowState(db.Model):  # type: ignore
     """ORM model for borrow state of items."""
 
     id = db.Column(db.Integer, primary_key=True)
-    borrowing_user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    borrowing_user_id = db.Column(
+        db.Integer, db.ForeignKey("user.id"), nullable=False, index=True
+    )
     borrowing_user = db.relationship("User", back_populates="borrowstates")
     borrowed_item_id = db.Column(
         db.Integer, db.ForeignKey("borrowable_item.id"), nullable=False
@@ -137,12 +152,77 @@ class BorrowState(db.Model):  # type: ignore
     quantity = db.Column(db.Integer, nullable=False)
     received_at = db.Column(db.DateTime, nullable=False)
     returned_at = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
     transfer_requests = db.relationship(
         "TransferRequest",
         back_populates="borrowstate",
         cascade="all, delete, delete-orphan",
     )
 
+    # Check-in only ever looks at open borrow states of an item, optionally of a
+    # single user, and the inventory statistics at overdue ones, which are
+    # summed per item from the index alone. SQLite only uses an index as
+    # covering if it includes the columns of its WHERE clause, too. Partial
+    # indexes keep them small regardless of the history size.
+    __table_args__ = (
+        db.Index(
+            "ix_borrow_state_open_item_user",
+            "borrowed_item_id",
+            "borrowing_user_id",
+            sqlite_where=db.text("returned_at IS NULL"),
+            postgresql_where=db.text("returned_at IS NULL"),
+        ),
+        db.Index(
+            "ix_borrow_state_open_item_received_at",
+            "borrowed_item_id",
+            "received_at",
+            "quantity",
+            "returned_at",
+            sqlite_where=db.text("returned_at IS NULL"),
+            postgresql_where=db.text("returned_at IS NULL"),
+        ),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+
+class ItemOpenBorrows(db.Model):  # type: ignore
+    """
+    ORM model for the open borrow states of an item, aggregated.
+
+    Rows are maintained by inventorymgr.db.aggregates, items without open
+    borrow states may have no row.
+    """
+
+    __tablename__ = "item_open_borrows"
+
+    item_id = db.Column(
+        db.Integer,
+        db.ForeignKey("borrowable_item.id", ondelete="CASCADE"),
+        primary_key=True,
+        autoincrement=False,
+    )
+    open_quantity = db.Column(db.Integer, nullable=False, default=0)
+    borrower_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserOpenBorrows(db.Model):  # type: ignore
+    """
+    ORM model for the open borrow states of a user, aggregated.
+
+    Maintained like ItemOpenBorrows.
+    """
+
+    __tablename__ = "user_open_borrows"
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey("user.id", ondelete="CASCADE"),
+        primary_key=True,
+        autoincrement=False,
+    )
+    open_quantity = db.Column(db.Integer, nullable=False, default=0)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+
 
 class JavascriptError(db.Model):  # type: ignore
     """ORM model for storing JS errors sent from window.onerror."""
@@ -160,15 +240,19 @@ class JavascriptError(db.Model):  # type: ignore
     lineno = db.Column(db.Integer)
     colno = db.Column(db.Integer)
     stack = db.Column(db.String)
+    # Number of identical reports counted together with this one.
+    occurrences = db.Column(db.Integer, nullable=False, server_default="1")
 
 
 class LogEntry(db.Model):  # type: ignore
     """ORM model for checkout / checkin logs."""
 
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, index=True)
     action = db.Column(db.String, nullable=False)
-    subject_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    subject_id = db.Column(
+        db.Integer, db.ForeignKey("user.id"), nullable=False, index=True
+    )
     secondary_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     subject = db.relationship(
         "User", back_populates="log_entries", foreign_keys="LogEntry.subject_id"
@@ -183,14 +267,34 @@ class LogEntry(db.Model):  # type: ignore
     )
 
 
+class ArchivedBorrowState(db.Model):  # type: ignore
+    """
+    ORM model for borrow states moved out of borrow_state by the retention
+    policy, see inventorymgr.db.retention.
+
+    Users and items are referenced by id only, they may since be deleted.
+    """
+
+    __tablename__ = "borrow_state_archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    borrowing_user_id = db.Column(db.Integer, nullable=False)
+    borrowed_item_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    received_at = db.Column(db.DateTime, nullable=False)
+    returned_at = db.Column(db.DateTime, nullable=False)
+
+
 class TransferRequest(db.Model):  # type: ignore
     """ORM model for transfer requests."""
 
     id = db.Column(db.Integer, primary_key=True)
     issuing_user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    target_user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    target_user_id = db.Column(
+        db.Integer, db.ForeignKey("user.id"), nullable=False, index=True
+    )
     borrowstate_id = db.Column(
-        db.Integer, db.ForeignKey("borrow_state.id"), nullable=False
+        db.Integer, db.ForeignKey("borrow_state.id"), nullable=False, index=True
     )
     issuing_user = db.relationship(
         "User",
@@ -203,3 +307,44 @@ class TransferRequest(db.Model):  # type: ignore
         foreign_keys=[target_user_id],
     )
     borrowstate = db.relationship("BorrowState", back_populates="transfer_requests")
+
+
+COLLECTION_NAMES = ("items", "items_stock", "qualifications", "users")
+
+
+class CollectionVersion(db.Model):  # type: ignore
+    """ORM model for version counters of API collections, used for ETags."""
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+@event.listens_for(CollectionVersion.__table__, "after_create")
+def _insert_collection_versions(target: Any, connection: Any, **_kwargs: Any) -> None:
+    connection.execute(
+        target.insert(), [{"name": name, "version": 0} for name in COLLECTION_NAMES]
+    )
+
+
+class SchemaMigration(db.Model):  # type: ignore
+    """ORM model for the history of applied schema migrations."""
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String, nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+
+
+@event.listens_for(db.session, "before_flush")
+def _version_collection_changes(session: Any, _context: Any, _instances: Any) -> None:
+    # The version of a row is only incremented when one of its columns changes.
+    # Re-writing an unchanged column makes changes to many-to-many collections,
+    # e.g. the qualifications of a user, increment the version as well.
+    for obj in session.dirty:
+        mapper = inspect(obj).mapper
+        if (
+            mapper.version_id_col is not None
+            and session.is_modified(obj)
+            and not session.is_modified(obj, include_collections=False)
+        ):
+            column = next(c for c in mapper.column_attrs if not c.columns[0].primary_key)
+            flag_modified(obj, column.key)
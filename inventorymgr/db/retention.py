@@ -0,0 +1,235 @@
+"""
+Retention of closed borrow states, logs and JS error reports.
+
+Rows older than the retention period configured for their table are moved
+to an archive table or file, or deleted if the table has none:
+
+- Borrow states returned more than RETENTION_BORROWSTATES_DAYS ago are moved
+  to borrow_state_archive.
+- Log entries older than RETENTION_LOGS_DAYS are moved to segment files,
+  LOGS_SEGMENT_ROWS at a time, see inventorymgr.db.logarchive.
+- JS error reports older than RETENTION_JS_ERRORS_DAYS are deleted.
+
+A retention period of None keeps rows forever.
+
+Rows are moved COMPACT_BATCH_SIZE at a time, each batch in its own
+transaction, so writers are never blocked for long. Batches walk the primary
+key, so the whole table is scanned once in total rather than once per batch.
+
+Compaction runs with the compact command, or every COMPACT_INTERVAL seconds
+in a background thread of the app if that is set. With several worker
+processes, set it in one of them only.
+
+RetentionPolicy
+    Where to move rows of a table to, and after how long.
+
+compact()
+    Apply all retention policies.
+
+compact_command()
+    Command line interface for applying the retention policies.
+
+init_app()
+    Start the compaction thread of an app, if configured.
+"""
+
+import datetime
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from sqlalchemy import Column, Table, select  # type: ignore
+
+from . import db
+from .logarchive import archive_log_entries
+from .models import (
+    ArchivedBorrowState,
+    BorrowState,
+    JavascriptError,
+    LogEntry,
+    TransferRequest,
+)
+
+_utcnow = datetime.datetime.utcnow  # pylint: disable=invalid-name
+
+
+class RetentionPolicy(NamedTuple):
+    """
+    Where to move rows of a table to, and after how long.
+
+    Rows are moved once the timestamp column is older than the number of days
+    configured under config_key. Rows of dependent tables referencing them
+    by a column are moved or deleted first, depending on whether an archive
+    table is given for them. Instead of an archive table, move can store the
+    rows with the ids of each batch elsewhere before they are deleted.
+
+    Batches are as large as configured under batch_size_key, if given.
+    """
+
+    name: str
+    table: Table
+    timestamp: Column
+    config_key: str
+    archive: Optional[Table]
+    dependents: Sequence[Tuple[Table, Column, Optional[Table]]] = ()
+    move: Optional[Callable[[List[int]], None]] = None
+    batch_size_key: Optional[str] = None
+
+
+POLICIES = (
+    RetentionPolicy(
+        "borrowstates",
+        BorrowState.__table__,
+        # Open borrow states have no return date, which is never older.
+        BorrowState.returned_at,
+        "RETENTION_BORROWSTATES_DAYS",
+        ArchivedBorrowState.__table__,
+        ((TransferRequest.__table__, TransferRequest.borrowstate_id, None),),
+    ),
+    RetentionPolicy(
+        "logs",
+        LogEntry.__table__,
+        LogEntry.timestamp,
+        "RETENTION_LOGS_DAYS",
+        None,
+        (
+            (
+                LogEntry.items.property.secondary,
+                LogEntry.items.property.secondary.c.logentry_id,
+                None,
+            ),
+        ),
+        move=archive_log_entries,
+        batch_size_key="LOGS_SEGMENT_ROWS",
+    ),
+    RetentionPolicy(
+        "js_errors",
+        JavascriptError.__table__,
+        JavascriptError.timestamp,
+        "RETENTION_JS_ERRORS_DAYS",
+        None,
+    ),
+)
+
+
+def compact(
+    batch_size: Optional[int] = None,
+    progress: Optional[Callable[[str, int], None]] = None,
+) -> Dict[str, int]:
+    """
+    Apply all retention policies and return the number of rows moved or
+    deleted per policy name.
+
+    progress is called with the policy name and the number of rows done so
+    far after each batch.
+    """
+    now = _utcnow()
+    done = {}
+    for policy in POLICIES:
+        days = current_app.config[policy.config_key]
+        if days is not None:
+            cutoff = now - datetime.timedelta(days=days)
+            policy_batch_size = batch_size or current_app.config[
+                policy.batch_size_key or "COMPACT_BATCH_SIZE"
+            ]
+            done[policy.name] = _compact_table(
+                policy, cutoff, policy_batch_size, progress
+            )
+    return done
+
+
+def _compact_table(
+    policy: RetentionPolicy,
+    cutoff: datetime.datetime,
+    batch_size: int,
+    progress: Optional[Callable[[str, int], None]],
+) -> int:
+    (primary_key,) = policy.table.primary_key.columns
+    last_id = 0
+    done = 0
+    while True:
+        ids = [
+            row_id
+            for row_id, in db.session.execute(
+                select([primary_key])
+                .where(primary_key > last_id)
+                .where(policy.timestamp < cutoff)
+                .order_by(primary_key)
+                .limit(batch_size)
+            )
+        ]
+        if not ids:
+            return done
+        if policy.move is not None:
+            policy.move(ids)
+        for dependent, column, archive in policy.dependents:
+            if archive is not None:
+                _copy(dependent, archive, column.in_(ids))
+            db.session.execute(dependent.delete().where(column.in_(ids)))
+        if policy.archive is not None:
+            _copy(policy.table, policy.archive, primary_key.in_(ids))
+        db.session.execute(policy.table.delete().where(primary_key.in_(ids)))
+        db.session.commit()
+        done += len(ids)
+        last_id = ids[-1]
+        if progress is not None:
+            progress(policy.name, done)
+
+
+def _copy(table: Table, archive: Table, condition: Any) -> None:
+    names = [column.name for column in archive.columns]
+    db.session.execute(
+        archive.insert().from_select(
+            names, select([table.columns[name] for name in names]).where(condition)
+        )
+    )
+
+
+@click.command("compact")
+@click.option("--batch-size", type=int, help="Number of rows moved at once.")
+@with_appcontext
+def compact_command(batch_size: Optional[int]) -> None:
+    """CLI command to archive or delete rows past their retention period."""
+
+    def report(name: str, done: int) -> None:
+        click.echo(f"{name}: {done} rows")
+
+    done = compact(batch_size, report)
+    summary = ", ".join(f"{name} {count}" for name, count in done.items())
+    click.echo(f"Compacted {summary or 'nothing'}.")
+
+
+def init_app(app: Flask) -> None:
+    """
+    Start a thread compacting the database every COMPACT_INTERVAL seconds
+    with the first request, if set.
+    """
+    interval = app.config["COMPACT_INTERVAL"]
+    if not interval:
+        return
+
+    def start() -> None:
+        threading.Thread(
+            target=_run_scheduler,
+            args=(app, interval, threading.Event()),
+            name="compact-scheduler",
+            daemon=True,
+        ).start()
+
+    app.before_first_request(start)
+
+
+def _run_scheduler(app: Flask, interval: float, stop: threading.Event) -> None:
+    while not stop.wait(interval):
+        with app.app_context():
+            try:
+                done = compact()
+            except Exception:  # pylint: disable=broad-except
+                db.session.rollback()
+                app.logger.exception("Compacting the database failed.")
+            else:
+                app.logger.info("Compacted the database: %s", done)
+            finally:
+                db.session.remove()
@@ -0,0 +1,93 @@
+"""
+Routing of read-only views to a replica database.
+
+If SQLALCHEMY_REPLICA_URI is set, views decorated with replica_reads() run
+their queries on that database, e.g. a streaming replica of the PostgreSQL
+primary. All other views, and every statement of a session after it has
+written anything, use the primary.
+
+Replicas lag behind the primary. After a request that wrote to the database,
+the user's session is pinned to the primary for REPLICA_STICKY_SECONDS so
+that users read their own writes.
+
+For local testing, a read-only connection to the SQLite primary serves as a
+stand-in replica, e.g.
+"sqlite+pysqlite:///file:/path/to/db.sqlite?mode=ro&uri=true". The explicit
+driver keeps Flask-SQLAlchemy from treating the URI as a relative path.
+
+RoutingSQLAlchemy
+    Flask-SQLAlchemy extension creating routing sessions.
+
+RoutingSession
+    SQLAlchemy session choosing the replica for reads where allowed.
+
+replica_reads()
+    Decorate a read-only view to query the replica.
+
+init_app()
+    Configure replica routing for an app.
+"""
+
+import functools
+import time
+from typing import Any, Callable
+
+from flask import Flask, Response, current_app, g, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state  # type: ignore
+from sqlalchemy import orm  # type: ignore
+from sqlalchemy.sql.expression import UpdateBase  # type: ignore
+
+REPLICA_BIND = "replica"
+
+
+class RoutingSession(SignallingSession):  # type: ignore
+    """Session sending reads to the replica inside replica_reads() views."""
+
+    # pylint: disable=too-few-public-methods
+
+    def get_bind(self, mapper: Any = None, clause: Any = None) -> Any:
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["wrote"] = True
+        if self.info.get("wrote") or not _reads_from_replica():
+            return super().get_bind(mapper, clause)
+        return get_state(self.app).db.get_engine(self.app, bind=REPLICA_BIND)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):  # type: ignore
+    """Flask-SQLAlchemy extension whose sessions are RoutingSessions."""
+
+    def create_session(self, options: Any) -> Any:
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_reads(to_be_wrapped: Callable[..., Any]) -> Callable[..., Any]:
+    """Let a read-only view query the replica, unless pinned to the primary."""
+
+    @functools.wraps(to_be_wrapped)
+    def inner(*args: Any, **kwargs: Any) -> Any:
+        if current_app.config["SQLALCHEMY_REPLICA_URI"] is not None:
+            g.replica_reads = session.get("primary_reads_until", 0) <= time.time()
+        return to_be_wrapped(*args, **kwargs)
+
+    return inner
+
+
+def init_app(app: Flask) -> None:
+    """Register the replica engine of app and pin writing users to the primary."""
+    replica_uri = app.config["SQLALCHEMY_REPLICA_URI"]
+    if replica_uri is None:
+        return
+    binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+    binds[REPLICA_BIND] = replica_uri
+    app.config["SQLALCHEMY_BINDS"] = binds
+
+    @app.after_request
+    def _pin_to_primary(response: Response) -> Response:
+        if get_state(app).db.session().info.get("wrote"):
+            sticky_seconds = app.config["REPLICA_STICKY_SECONDS"]
+            session["primary_reads_until"] = time.time() + sticky_seconds
+        return response
+
+
+def _reads_from_replica() -> bool:
+    return has_request_context() and bool(g.get("replica_reads", False))
@@ -0,0 +1,107 @@
+"""
+Connection settings for SQLite databases.
+
+Every new SQLite connection enforces foreign keys and applies a performance
+profile suited to several worker processes sharing one database file: the WAL
+journal lets readers proceed while a check-in writes, synchronous=NORMAL
+avoids an fsync per commit in WAL mode, and busy_timeout makes writers wait
+for the lock instead of failing with "database is locked".
+
+Each pragma can be overridden by a configuration key, set it to None to keep
+SQLite's default:
+
+    SQLITE_BUSY_TIMEOUT    busy_timeout in milliseconds (5000)
+    SQLITE_JOURNAL_MODE    journal_mode ("WAL")
+    SQLITE_SYNCHRONOUS     synchronous ("NORMAL")
+    SQLITE_CACHE_SIZE      cache_size, negative values in KiB (-20000)
+    SQLITE_MMAP_SIZE       mmap_size in bytes (268435456)
+    SQLITE_TEMP_STORE      temp_store ("MEMORY")
+
+A SQLite replica configured with SQLALCHEMY_REPLICA_URI gets the same
+settings. The settings in effect are read back and logged once, on the first
+connection of each process.
+
+init_app()
+    Install the connect hook for an app using SQLite.
+
+connection_settings()
+    Return the settings in effect on a connection.
+"""
+
+import re
+from typing import Any, Dict, List, Tuple
+
+from flask import Flask
+from sqlalchemy import event  # type: ignore
+
+from . import db
+from .routing import REPLICA_BIND
+
+# Pragmas in the order they are applied. busy_timeout comes first so that
+# switching the journal mode waits for concurrent connections.
+PRAGMA_CONFIG = {
+    "busy_timeout": "SQLITE_BUSY_TIMEOUT",
+    "journal_mode": "SQLITE_JOURNAL_MODE",
+    "synchronous": "SQLITE_SYNCHRONOUS",
+    "cache_size": "SQLITE_CACHE_SIZE",
+    "mmap_size": "SQLITE_MMAP_SIZE",
+    "temp_store": "SQLITE_TEMP_STORE",
+}
+
+
+def init_app(app: Flask) -> None:
+    """Apply the SQLite connection settings of app to each new connection."""
+    pragmas = _configured_pragmas(app)
+    reported = False
+
+    def _sqlite_connect(dbapi_con: Any, _con_record: Any) -> None:
+        nonlocal reported
+        dbapi_con.execute("PRAGMA foreign_keys=ON;")
+        for pragma, value in pragmas:
+            dbapi_con.execute(f"PRAGMA {pragma}={value};")
+        if not reported:
+            reported = True
+            _report(app, pragmas, connection_settings(dbapi_con))
+
+    with app.app_context():
+        event.listen(db.engine, "connect", _sqlite_connect)
+        replica_uri = app.config["SQLALCHEMY_REPLICA_URI"]
+        if replica_uri is not None and replica_uri.startswith("sqlite"):
+            replica = db.get_engine(app, bind=REPLICA_BIND)
+            event.listen(replica, "connect", _sqlite_connect)
+
+
+def connection_settings(dbapi_con: Any) -> Dict[str, str]:
+    """Return the values of foreign_keys and the tuned pragmas on a connection."""
+    settings = {}
+    for pragma in ["foreign_keys", *PRAGMA_CONFIG]:
+        # Some pragmas, e.g. mmap_size, return no row for in-memory databases.
+        row = dbapi_con.execute(f"PRAGMA {pragma};").fetchone()
+        settings[pragma] = "" if row is None else str(row[0])
+    return settings
+
+
+def _configured_pragmas(app: Flask) -> List[Tuple[str, str]]:
+    pragmas = []
+    for pragma, key in PRAGMA_CONFIG.items():
+        value = app.config.get(key)
+        if value is None:
+            continue
+        if not re.fullmatch(r"-?\w+", str(value)):
+            raise ValueError(f"invalid value for {key}: {value!r}")
+        pragmas.append((pragma, str(value)))
+    return pragmas
+
+
+def _report(app: Flask, pragmas: List[Tuple[str, str]], actual: Dict[str, str]) -> None:
+    app.logger.info(
+        "SQLite settings: %s", ", ".join(f"{k}={v}" for k, v in actual.items())
+    )
+    requested_mode = dict(pragmas).get("journal_mode", "").lower()
+    actual_mode = actual["journal_mode"].lower()
+    if requested_mode and actual_mode not in (requested_mode, "memory"):
+        app.logger.warning(
+            "SQLite journal_mode is %s instead of %s",
+            actual["journal_mode"],
+            requested_mode,
+        )
@@ -1,37 +1,250 @@
-"""Javascript error reporting API endpoints."""
+"""
+Javascript error reporting API endpoints.
 
+Reports are not written by the request sending them. They are queued in
+memory and written in batches by a background thread, so that a broken
+frontend reporting the same error on every page does not compete with
+checkouts for the database's write lock:
+
+- Reports with the same message, source, line and column are counted
+  together. The first of them is written along with the number of
+  occurrences once ERROR_REPORTS_WINDOW seconds have passed since it arrived.
+- Each client, told apart by remote address, may send ERROR_REPORTS_RATE_LIMIT
+  reports per window. Further reports are rejected with status 429.
+- At most ERROR_REPORTS_MAX_PENDING distinct reports are queued, further
+  ones are dropped until the queue has been written.
+
+Queued reports of all queues are written when the process exits, but are
+lost if it is killed.
+
+RateLimiter
+    Counts requests per client in fixed windows of time.
+
+ErrorReportQueue
+    Counts, rate limits and batches error reports in memory.
+
+init_app()
+    Configure the error report queue of an app.
+
+get_error_report_queue()
+    Return the error report queue of the current app.
+
+javascript_error()
+    Flask view queueing a JS error report.
+"""
+
+import atexit
+import collections
 import datetime
+import itertools
+import threading
+import time
+import weakref
+from typing import Any, Callable, Counter, Dict, List, Optional, Tuple
 
-from flask import Blueprint, request
+from flask import Blueprint, Flask, current_app, request
+from werkzeug.useragents import UserAgent
 
+from inventorymgr.api.models import JavascriptErrorSchema
 from inventorymgr.db import db
 from inventorymgr.db.models import JavascriptError
 
 bp = Blueprint("errorreports", __name__, url_prefix="/api/v1/errors")
 
+_ReportKey = Tuple[Optional[str], Optional[str], Optional[int], Optional[int]]
+
+# Queues with a writer thread, flushed when the process exits.
+_STARTED_QUEUES: "weakref.WeakSet[ErrorReportQueue]" = weakref.WeakSet()
+
+
+class RateLimiter:
+    """
+    Counts requests per client in fixed windows of time.
+
+    Not thread-safe, callers have to lock around allow().
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._window = -1
+        self._counts: Counter[str] = collections.Counter()
+
+    def allow(self, client: str, window: int) -> bool:
+        """Count a request of client in window, return whether it is allowed."""
+        if window != self._window:
+            self._window = window
+            self._counts.clear()
+        self._counts[client] += 1
+        return self._counts[client] <= self.limit
+
+
+class _PendingReports:
+    """
+    Distinct reports with the time they are due, in order of arrival, so
+    those due to be written come first. Not thread-safe.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.dropped = 0
+        self._reports: Dict[_ReportKey, Tuple[float, Dict[str, Any]]] = {}
+
+    def add(self, key: _ReportKey, due: float, report: Dict[str, Any]) -> bool:
+        """Count or queue a report, return whether it was queued as a new one."""
+        if key in self._reports:
+            self._reports[key][1]["occurrences"] += 1
+        elif len(self._reports) < self.max_size:
+            self._reports[key] = (due, {**report, "occurrences": 1})
+            return True
+        else:
+            self.dropped += 1
+        return False
+
+    def next_due(self) -> Optional[float]:
+        """Return when the first report is due, None if there is none."""
+        if not self._reports:
+            return None
+        due, _ = next(iter(self._reports.values()))
+        return due
+
+    def take_due(self, now: float) -> List[Dict[str, Any]]:
+        """Remove and return the reports due at now."""
+        due = list(
+            itertools.takewhile(lambda item: item[1][0] <= now, self._reports.items())
+        )
+        for key, _ in due:
+            del self._reports[key]
+        return [report for _, (_, report) in due]
+
+
+class ErrorReportQueue:
+    """
+    Counts, rate limits and batches error reports in memory.
+
+    A writer thread is started with the first report. Reports can also be
+    written from the calling thread with flush().
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        window: float,
+        rate_limit: int,
+        max_pending: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.app = app
+        self.window = window
+        self.rate_limiter = RateLimiter(rate_limit)
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._pending = _PendingReports(max_pending)
+        self._writer: Optional[threading.Thread] = None
+
+    @property
+    def dropped(self) -> int:
+        """The number of reports dropped because too many were queued."""
+        return self._pending.dropped
+
+    def submit(self, client: str, report: Dict[str, Any]) -> bool:
+        """Queue a report, return False if client exceeded its rate limit."""
+        now = self._clock()
+        key = (report["message"], report["source"], report["lineno"], report["colno"])
+        with self._condition:
+            if not self.rate_limiter.allow(client, int(now // self.window)):
+                return False
+            if self._pending.add(key, now + self.window, report):
+                self._condition.notify()
+            if self._writer is None:
+                self._start_writer()
+        return True
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Write the reports whose window has passed, or all reports if force is
+        set, and return their number.
+        """
+        with self._condition:
+            rows = self._pending.take_due(float("inf") if force else self._clock())
+        self._write(rows)
+        return len(rows)
+
+    def _start_writer(self) -> None:
+        self._writer = threading.Thread(
+            target=self._run_writer, name="error-report-writer", daemon=True
+        )
+        self._writer.start()
+        _STARTED_QUEUES.add(self)
+
+    def _run_writer(self) -> None:
+        while True:
+            with self._condition:
+                timeout = self._seconds_to_due()
+                while timeout is None or timeout > 0:
+                    self._condition.wait(timeout)
+                    timeout = self._seconds_to_due()
+                rows = self._pending.take_due(self._clock())
+            try:
+                self._write(rows)
+            except Exception:  # pylint: disable=broad-except
+                self.app.logger.exception("Writing JS error reports failed.")
+
+    def _seconds_to_due(self) -> Optional[float]:
+        due = self._pending.next_due()
+        return None if due is None else due - self._clock()
+
+    def _write(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        for row in rows:
+            user_agent = UserAgent(row["user_agent_raw"])
+            row["platform"] = user_agent.platform
+            row["browser"] = user_agent.browser
+            row["browser_version"] = user_agent.version
+            row["browser_language"] = user_agent.language
+        with self.app.app_context(), db.engine.begin() as connection:
+            connection.execute(JavascriptError.__table__.insert(), rows)
+
+
+@atexit.register
+def _flush_started_queues() -> None:
+    for queue in list(_STARTED_QUEUES):
+        queue.flush(force=True)
+
+
+def init_app(app: Flask) -> None:
+    """Configure the error report queue of an app from its config."""
+    app.extensions["error_reports"] = ErrorReportQueue(
+        app,
+        app.config["ERROR_REPORTS_WINDOW"],
+        app.config["ERROR_REPORTS_RATE_LIMIT"],
+        app.config["ERROR_REPORTS_MAX_PENDING"],
+    )
+
+
+def get_error_report_queue() -> ErrorReportQueue:
+    """Return the error report queue of the current app."""
+    return current_app.extensions["error_reports"]  # type: ignore
+
 
 @bp.route("/js", methods=("POST",))
-def javascript_error() -> str:
-    """API endpoint to store a JS error report."""
-    if request.is_json:
-        platform = request.user_agent.platform  # type: ignore
-        browser = request.user_agent.browser  # type: ignore
-        browser_version = request.user_agent.version  # type: ignore
-        browser_language = request.user_agent.language  # type: ignore
-        row = {
-            "timestamp": datetime.datetime.utcnow(),
-            "user_agent_raw": request.user_agent.string,
-            "platform": platform,
-            "browser": browser,
-            "browser_version": browser_version,
-            "browser_language": browser_language,
-            "location": request.json["location"],
-            "message": request.json.get("message"),
-            "source": request.json.get("source"),
-            "lineno": request.json.get("lineno"),
-            "colno": request.json.get("colno"),
-            "stack": request.json.get("stack"),
-        }
-        db.session.add(JavascriptError(**row))
-        db.session.commit()
-    return ""
+def javascript_error() -> Any:
+    """API endpoint to queue a JS error report."""
+    if not request.is_json:
+        return ""
+    report = JavascriptErrorSchema().load(request.json)
+    row = {
+        "timestamp": datetime.datetime.utcnow(),
+        "user_agent_raw": request.user_agent.string,
+        "location": report["location"],
+        "message": report.get("message"),
+        "source": report.get("source"),
+        "lineno": report.get("lineno"),
+        "colno": report.get("colno"),
+        "stack": report.get("stack"),
+    }
+    if not get_error_report_queue().submit(request.remote_addr or "", row):
+        return {"reason": "rate_limited"}, 429
+    return "", 202
@@ -0,0 +1,129 @@
+"""
+Reading and reporting of bulk imports.
+
+Imports accept CSV with a header row or NDJSON, one object per line. Rows
+that fail validation are skipped and reported with their line number, all
+other rows are imported.
+
+import_format()
+    Guess the format of an import from a file name or MIME type.
+
+read_rows()
+    Parse the lines of an import into dicts.
+
+load_rows()
+    Validate the rows of an import with a schema.
+
+ImportReport
+    Per-row errors and throughput statistics of an import.
+
+batched()
+    Split rows into lists of a fixed size.
+"""
+
+import csv
+import itertools
+import json
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from marshmallow import Schema, ValidationError
+
+IMPORT_FORMATS = ("ndjson", "csv")
+
+
+def import_format(name: Optional[str]) -> str:
+    """Return "csv" for .csv file names and the text/csv type, else "ndjson"."""
+    if name is not None and (name == "text/csv" or name.lower().endswith(".csv")):
+        return "csv"
+    return "ndjson"
+
+
+class ImportReport:
+    """Collects per-row errors and counts of an import while it runs."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.created = 0
+        self.updated = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def error(self, row: int, errors: Any) -> None:
+        """Record that a row was skipped because of errors."""
+        self.errors.append({"row": row, "errors": errors})
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the report as JSON compatible dict."""
+        seconds = time.perf_counter() - self.started
+        rows = self.created + self.updated + len(self.errors)
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "failed": len(self.errors),
+            "errors": sorted(self.errors, key=lambda error: error["row"]),
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(rows / seconds) if seconds else rows,
+        }
+
+
+def read_rows(
+    lines: Iterable[str], fmt: str, report: ImportReport
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Yield line number and data of each row of an import.
+
+    Empty CSV cells are left out. NDJSON lines which are not JSON objects are
+    recorded as errors in the report and skipped.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, {k: v for k, v in row.items() if k and v != ""}
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            yield number, data
+        else:
+            report.error(number, {"_schema": ["Not a JSON object."]})
+
+
+def load_rows(
+    lines: Iterable[str], fmt: str, schema: Schema, key: str, report: ImportReport
+) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    Return line number and data of each row of an import loaded with schema.
+
+    Invalid rows and rows repeating the key of an earlier row are recorded as
+    errors in the report and skipped.
+    """
+    seen = set()
+    valid = []
+    for number, data in read_rows(lines, fmt, report):
+        try:
+            row = schema.load(data)
+        except ValidationError as exc:
+            report.error(number, exc.messages)
+            continue
+        if row[key] in seen:
+            report.error(number, {key: [f"Repeated {key}."]})
+            continue
+        seen.add(row[key])
+        valid.append((number, row))
+    return valid
+
+
+def batched(rows: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Yield lists of size rows, the last one may be shorter."""
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
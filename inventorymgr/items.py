@@ -1,16 +1,42 @@
-"""API endpoints for dealing with borrowable items."""
+"""
+API endpoints and CLI commands for dealing with borrowable items.
 
+Catalogs are loaded with bulk imports of CSV or NDJSON rows, see
+import_items(). Items are matched by name: new names are inserted, existing
+items are updated in place.
+"""
 
-from typing import Any, Dict, Tuple, cast
-from flask import Blueprint, request
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import click
+from flask import Blueprint, current_app, request
+from flask.cli import with_appcontext
+from sqlalchemy import text  # type: ignore
 from sqlalchemy.exc import IntegrityError  # type: ignore
 
 from inventorymgr.accesscontrol import requires_permissions
 from inventorymgr.api import APIError
-from inventorymgr.api.models import BorrowableItemSchema
+from inventorymgr.api.models import (
+    BorrowableItemSchema,
+    ImportQuerySchema,
+    ItemImportSchema,
+)
+from inventorymgr.api.serializers import dump_many
 from inventorymgr.auth import authentication_required
 from inventorymgr.db import db
+from inventorymgr.db.loaders import select_rows
 from inventorymgr.db.models import BorrowableItem, Qualification
+from inventorymgr.db.routing import replica_reads
+from inventorymgr.imports import (
+    IMPORT_FORMATS,
+    ImportReport,
+    batched,
+    import_format,
+    load_rows,
+)
+from inventorymgr.qualifications import resolve_qualifications
+from inventorymgr.versions import bump_versions, check_if_match, versioned, with_etag
 
 
 bp = Blueprint("items", __name__, url_prefix="/api/v1/items")
@@ -45,6 +71,7 @@ def create_item() -> Tuple[Dict[str, Any], int]:
             required_qualifications=qualifications,
         )
         db.session.add(item)
+        bump_versions("items")
         db.session.commit()
         return BorrowableItemSchema().dump(item), 200
     except IntegrityError as exc:
@@ -52,17 +79,43 @@ def create_item() -> Tuple[Dict[str, Any], int]:
 
 
 @bp.route("", methods=("GET",))
+@replica_reads
 @authentication_required
+@versioned("items", "items_stock")
 def list_items() -> Dict[str, Any]:
-    """JSON endpoint for getting all borrowable items."""
-    items = BorrowableItemSchema(many=True).dump(BorrowableItem.query.all())
+    """
+    JSON endpoint for getting all borrowable items.
+
+    The optional fields query parameter is a comma separated list of fields
+    to return, e.g. fields=id,name,barcode. Only those columns are queried.
+    """
+    requested = requested_fields(request.args.get("fields"))
+    if requested is None:
+        schema = BorrowableItemSchema(many=True)
+    else:
+        only = sorted((requested - {"barcode"}) | {"id"})
+        schema = BorrowableItemSchema(many=True, only=only)
+    items = dump_many(schema, select_rows(BorrowableItem, schema))
+    if requested is not None and "id" not in requested:
+        items = [{k: v for k, v in item.items() if k in requested} for item in items]
     return {"items": items}
 
 
+def requested_fields(fields_arg: Optional[str]) -> Optional[Set[str]]:
+    """Parse the fields query parameter, raising APIError for unknown fields."""
+    if fields_arg is None:
+        return None
+    requested = {name.strip() for name in fields_arg.split(",") if name.strip()}
+    known = set(BorrowableItemSchema().dump_fields) | {"barcode"}
+    if not requested or not requested <= known:
+        raise APIError(reason="unknown_fields", status_code=400)
+    return requested
+
+
 @bp.route("/<int:item_id>", methods=("PUT",))
 @authentication_required
 @requires_permissions("create_items")
-def update_item(item_id: int) -> Dict[str, Any]:
+def update_item(item_id: int) -> Any:
     """JSON endpoint for updating borrowable item."""
     schema = BorrowableItemSchema()
     received_item = schema.load(request.json)
@@ -73,6 +126,7 @@ def update_item(item_id: int) -> Dict[str, Any]:
     item = BorrowableItem.query.get(item_id)
     if item is None:
         raise APIError(reason="nonexistent_item", status_code=400)
+    check_if_match(item)
 
     qual_ids = [q["id"] for q in received_item["required_qualifications"]]
     qualifications = [Qualification.query.get(q_id) for q_id in qual_ids]
@@ -86,12 +140,13 @@ def update_item(item_id: int) -> Dict[str, Any]:
         item.unmatched_returns = received_item["unmatched_returns"]
         item.description = received_item["description"]
         item.required_qualifications = qualifications
+        bump_versions("items")
         db.session.commit()
     except IntegrityError as exc:
         db.session.rollback()
         raise APIError(reason="item_exists", status_code=400) from exc
 
-    return cast(Dict[str, Any], schema.dump(item))
+    return with_etag(schema.dump(item), item)
 
 
 @bp.route("/<int:item_id>", methods=("DELETE",))
@@ -102,6 +157,7 @@ def delete_item(item_id: int) -> Dict[str, Any]:
     item = BorrowableItem.query.get(item_id)
     if item is not None:
         db.session.delete(item)
+        bump_versions("items")
         db.session.commit()
     return {"success": True}
 
@@ -113,4 +169,183 @@ def get_item(item_id: int) -> Any:
     item = BorrowableItem.query.get(item_id)
     if item is None:
         raise APIError(reason="nonexistent_item", status_code=400)
-    return BorrowableItemSchema().dump(item)
+    return with_etag(BorrowableItemSchema().dump(item), item)
+
+
+# Stock of updated items follows the change of quantity_total, so items
+# which are checked out stay accounted for. quantity_in_stock of a row only
+# applies to new items. Items are not updated if quantity_total would drop
+# below the quantity checked out.
+_UPSERT_ITEM = text(
+    "INSERT INTO borrowable_item (name, description, quantity_total, "
+    "quantity_in_stock, unmatched_returns, version) "
+    "VALUES (:name, :description, :quantity_total, :quantity_in_stock, 0, 1) "
+    "ON CONFLICT (name) DO UPDATE SET "
+    "description = excluded.description, "
+    "quantity_total = excluded.quantity_total, "
+    "quantity_in_stock = borrowable_item.quantity_in_stock "
+    "+ excluded.quantity_total - borrowable_item.quantity_total, "
+    "version = borrowable_item.version + 1 "
+    "WHERE borrowable_item.quantity_total - excluded.quantity_total "
+    "<= borrowable_item.quantity_in_stock"
+)
+
+_UPSERT_DIALECTS = ("sqlite", "postgresql")
+
+
+@bp.route("/import", methods=("POST",))
+@authentication_required
+@requires_permissions("create_items")
+def import_items_view() -> Dict[str, Any]:
+    """
+    API endpoint for bulk imports of items from CSV or NDJSON.
+
+    The format is taken from the format query parameter, or else from the
+    content type. Returns the import report.
+    """
+    import_query = ImportQuerySchema().load(request.args)
+    lines = request.get_data(as_text=True).splitlines(keepends=True)
+    report = import_items(
+        lines,
+        import_query.get("format") or import_format(request.mimetype),
+        import_query.get("batch_size") or current_app.config["ITEMS_IMPORT_BATCH_SIZE"],
+    )
+    return report.as_dict()
+
+
+@click.command("import-items")
+@click.option("--format", "import_fmt", type=click.Choice(IMPORT_FORMATS))
+@click.option("--batch-size", type=int, help="Number of rows committed at once.")
+@click.argument("source", type=click.File("r"))
+@with_appcontext
+def import_items_command(
+    import_fmt: Optional[str], batch_size: Optional[int], source: Any
+) -> None:
+    """CLI command to import items from NDJSON or CSV (for .csv files)."""
+    report = import_items(
+        source,
+        import_fmt or import_format(source.name),
+        batch_size or current_app.config["ITEMS_IMPORT_BATCH_SIZE"],
+    ).as_dict()
+    for error in report["errors"]:
+        click.echo(f"Row {error['row']}: {error['errors']}", err=True)
+    click.echo(
+        f"Created {report['created']}, updated {report['updated']}, "
+        f"failed {report['failed']} items in {report['seconds']}s "
+        f"({report['rows_per_second']} rows/s)."
+    )
+
+
+def import_items(lines: Iterable[str], fmt: str, batch_size: int) -> ImportReport:
+    """
+    Insert or update items from the lines of a CSV or NDJSON import.
+
+    Rows are validated with ItemImportSchema, invalid rows and repeated names
+    are reported and skipped. Valid rows are upserted batch_size rows at a
+    time, each batch in its own transaction. Updates lowering quantity_total
+    below the quantity checked out are reported and skipped, too.
+    """
+    if db.engine.dialect.name not in _UPSERT_DIALECTS:
+        raise APIError(reason="import_unsupported", status_code=500)
+    report = ImportReport()
+    valid = load_rows(lines, fmt, ItemImportSchema(), "name", report)
+    for batch in batched(valid, batch_size):
+        _upsert_batch(batch, report)
+    return report
+
+
+def _upsert_batch(
+    batch: List[Tuple[int, Dict[str, Any]]], report: ImportReport
+) -> None:
+    qualifications = resolve_qualifications(
+        ref for _, row in batch for ref in row.get("required_qualifications", [])
+    )
+    rows = []
+    for number, row in batch:
+        unknown = [
+            ref
+            for ref in row.get("required_qualifications", [])
+            if ref not in qualifications
+        ]
+        if unknown:
+            message = f"Unknown qualifications: {', '.join(map(str, unknown))}."
+            report.error(number, {"required_qualifications": [message]})
+        else:
+            rows.append((number, row))
+    if not rows:
+        return
+
+    names = [row["name"] for _, row in rows]
+    existing = {
+        name
+        for name, in db.session.query(BorrowableItem.name).filter(
+            BorrowableItem.name.in_(names)
+        )
+    }
+    result = db.session.execute(
+        _UPSERT_ITEM,
+        [
+            {
+                "name": row["name"],
+                "description": row["description"],
+                "quantity_total": row["quantity_total"],
+                "quantity_in_stock": row.get(
+                    "quantity_in_stock", row["quantity_total"]
+                ),
+            }
+            for _, row in rows
+        ],
+    )
+    if result.rowcount != len(rows):
+        rows = _skip_unapplied(rows, existing, report)
+    _replace_required_qualifications(
+        [row for _, row in rows if "required_qualifications" in row], qualifications
+    )
+    bump_versions("items")
+    db.session.commit()
+    updated = sum(row["name"] in existing for _, row in rows)
+    report.created += len(rows) - updated
+    report.updated += updated
+
+
+def _skip_unapplied(
+    rows: List[Tuple[int, Dict[str, Any]]], existing: Set[str], report: ImportReport
+) -> List[Tuple[int, Dict[str, Any]]]:
+    # Updates are only skipped by the WHERE clause of the upsert, which leaves
+    # the previous, higher quantity_total in place.
+    totals = dict(
+        db.session.query(BorrowableItem.name, BorrowableItem.quantity_total).filter(
+            BorrowableItem.name.in_(existing)
+        )
+    )
+    applied = []
+    for number, row in rows:
+        if totals.get(row["name"], row["quantity_total"]) != row["quantity_total"]:
+            message = "Less than the quantity checked out."
+            report.error(number, {"quantity_total": [message]})
+        else:
+            applied.append((number, row))
+    return applied
+
+
+def _replace_required_qualifications(
+    rows: List[Dict[str, Any]], qualifications: Dict[Any, int]
+) -> None:
+    if not rows:
+        return
+    item_ids = dict(
+        db.session.query(BorrowableItem.name, BorrowableItem.id).filter(
+            BorrowableItem.name.in_([row["name"] for row in rows])
+        )
+    )
+    table = BorrowableItem.required_qualifications.property.secondary
+    db.session.execute(
+        table.delete().where(table.c.item_id.in_(list(item_ids.values())))
+    )
+    links = [
+        {"item_id": item_ids[row["name"]], "qualification_id": q_id}
+        for row in rows
+        for q_id in sorted({qualifications[r] for r in row["required_qualifications"]})
+    ]
+    if links:
+        db.session.execute(table.insert(), links)
@@ -1,19 +1,290 @@
-"""API endpoints for getting checkout / checkin logs."""
+"""
+API endpoints and CLI commands for getting checkout / checkin logs.
 
-from typing import Any, Dict
+Logs are returned newest first in pages. Each page carries an opaque cursor
+pointing past its last entry, which is passed back to fetch the next page.
 
-from flask import Blueprint
+The complete log can be exported as NDJSON or CSV. Exports are streamed in
+chronological order and fetched in batches, so memory use does not depend
+on the size of the log.
 
-from inventorymgr.api.models import LogEntrySchema
+Entries past their retention period are moved to segment files, see
+inventorymgr.db.logarchive. Pages and exports reaching back to the newest
+archived entry read the segments too, and merge them with the database.
+"""
+
+import base64
+import binascii
+import csv
+import datetime
+import heapq
+import io
+import itertools
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import click
+from flask import Blueprint, Response, current_app, request, stream_with_context
+from flask.cli import with_appcontext
+from sqlalchemy import and_, or_
+
+from inventorymgr.api import APIError
+from inventorymgr.api.models import (
+    LogEntrySchema,
+    LogExportQuerySchema,
+    LogQuerySchema,
+)
+from inventorymgr.api.serializers import dump_many
 from inventorymgr.auth import authentication_required
-from inventorymgr.db.models import LogEntry
+from inventorymgr.db import db
+from inventorymgr.db.loaders import loader_options
+from inventorymgr.db.logarchive import get_log_archive
+from inventorymgr.db.models import BorrowableItem, LogEntry
+from inventorymgr.db.routing import replica_reads
+from inventorymgr.imports import batched
 
 
 bp = Blueprint("logs", __name__, url_prefix="/api/v1/logs")
 
 
 @bp.route("", methods=("GET",))
+@replica_reads
 @authentication_required
 def get_logs() -> Dict[str, Any]:
-    """API endpoint for getting checkout / checkin logs."""
-    return {"logs": LogEntrySchema(many=True).dump(LogEntry.query.all())}
+    """API endpoint for getting a page of checkout / checkin logs."""
+    log_query = LogQuerySchema().load(request.args)
+    page_size = min(
+        log_query.get("limit", current_app.config["LOGS_PAGE_SIZE"]),
+        current_app.config["LOGS_MAX_PAGE_SIZE"],
+    )
+
+    query = filter_logs(LogEntry.query, log_query)
+    position = None
+    if "cursor" in log_query:
+        position = timestamp, entry_id = decode_cursor(log_query["cursor"])
+        query = query.filter(
+            or_(
+                LogEntry.timestamp < timestamp,
+                and_(LogEntry.timestamp == timestamp, LogEntry.id < entry_id),
+            )
+        )
+
+    schema = LogEntrySchema(many=True)
+    entries = (
+        query.options(*loader_options(LogEntry, schema))
+        .order_by(LogEntry.timestamp.desc(), LogEntry.id.desc())
+        .limit(page_size + 1)
+        .all()
+    )
+    archive_newest = get_log_archive().newest()
+    if archive_newest is not None and (
+        len(entries) <= page_size or entries[-1].timestamp <= archive_newest
+    ):
+        archived = get_log_archive().entries(
+            _archive_filters(log_query), before=position, newest_first=True
+        )
+        entries = _merge_newest_first(entries, archived, page_size + 1)
+
+    next_cursor: Optional[str] = None
+    if len(entries) > page_size:
+        entries = entries[:page_size]
+        next_cursor = encode_cursor(entries[-1])
+
+    return {
+        "logs": dump_many(schema, entries),
+        "next_cursor": next_cursor,
+    }
+
+
+def filter_logs(query: Any, log_query: Dict[str, Any]) -> Any:
+    """Apply the filters of a parsed LogQuerySchema to a LogEntry query."""
+    for column in ("action", "subject_id", "secondary_id"):
+        if column in log_query:
+            query = query.filter(getattr(LogEntry, column) == log_query[column])
+    if "item_id" in log_query:
+        query = query.filter(
+            LogEntry.items.any(BorrowableItem.id == log_query["item_id"])
+        )
+    if "since" in log_query:
+        query = query.filter(LogEntry.timestamp >= _naive(log_query["since"]))
+    if "until" in log_query:
+        query = query.filter(LogEntry.timestamp < _naive(log_query["until"]))
+    return query
+
+
+def _archive_filters(log_query: Dict[str, Any]) -> Dict[str, Any]:
+    filters = dict(log_query)
+    for key in ("since", "until"):
+        if key in filters:
+            filters[key] = _naive(filters[key])
+    return filters
+
+
+def _merge_newest_first(
+    entries: List[Any], archived: Iterable[Any], limit: int
+) -> List[Any]:
+    # Entries can be both archived and in the database if compaction failed
+    # to commit, see inventorymgr.db.logarchive.
+    merged = heapq.merge(
+        entries, archived, key=lambda e: (e.timestamp, e.id), reverse=True
+    )
+    unique = (next(group) for _, group in itertools.groupby(merged, lambda e: e.id))
+    return list(itertools.islice(unique, limit))
+
+
+def encode_cursor(entry: Any) -> str:
+    """Encode the position of a log entry as an opaque cursor string."""
+    position = json.dumps([entry.timestamp.isoformat(), entry.id])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """Decode a cursor created by encode_cursor(), raising APIError if invalid."""
+    try:
+        timestamp, entry_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.datetime.fromisoformat(timestamp), int(entry_id)
+    except (binascii.Error, TypeError, ValueError) as exc:
+        raise APIError(reason="invalid_cursor", status_code=400) from exc
+
+
+def _naive(timestamp: datetime.datetime) -> datetime.datetime:
+    """Convert aware datetimes to naive UTC, as log timestamps are stored."""
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+_EXPORT_COLUMNS = ("id", "timestamp", "action", "subject_id", "secondary_id", "items")
+
+_EXPORT_MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+@bp.route("/export", methods=("GET",))
+@replica_reads
+@authentication_required
+def export_logs() -> Response:
+    """API endpoint streaming all matching logs as NDJSON or CSV."""
+    export_query = LogExportQuerySchema().load(request.args)
+    export_format = export_query["format"]
+    lines = format_log_export(
+        iter_archived_log_export(
+            export_query, current_app.config["LOGS_EXPORT_BATCH_SIZE"]
+        ),
+        export_format,
+    )
+    response = Response(
+        stream_with_context(lines), mimetype=_EXPORT_MIMETYPES[export_format]
+    )
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=logs.{export_format}"
+    )
+    return response
+
+
+@click.command("export-logs")
+@click.option("--format", "export_format", type=click.Choice(("ndjson", "csv")))
+@click.option("--since", type=click.DateTime(), help="Only export logs from then.")
+@click.option("--until", type=click.DateTime(), help="Only export logs before then.")
+@click.option("--batch-size", type=int, help="Number of logs fetched at once.")
+@click.argument("output", type=click.File("w"), default="-")
+@with_appcontext
+def export_logs_command(
+    export_format: Optional[str],
+    since: Optional[datetime.datetime],
+    until: Optional[datetime.datetime],
+    batch_size: Optional[int],
+    output: Any,
+) -> None:
+    """CLI command to export the logs as NDJSON (default) or CSV."""
+    filters = {"since": since, "until": until}
+    entries = iter_archived_log_export(
+        {k: v for k, v in filters.items() if v},
+        batch_size or current_app.config["LOGS_EXPORT_BATCH_SIZE"],
+    )
+    for line in format_log_export(entries, export_format or "ndjson"):
+        output.write(line)
+
+
+def iter_log_export(query: Any, batch_size: int) -> Iterator[Dict[str, Any]]:
+    """
+    Yield log entries of a query as plain dicts in chronological order.
+
+    Entries are fetched batch_size rows at a time, and the item ids of each
+    batch are looked up with one additional query.
+    """
+    rows = (
+        query.with_entities(
+            LogEntry.id,
+            LogEntry.timestamp,
+            LogEntry.action,
+            LogEntry.subject_id,
+            LogEntry.secondary_id,
+        )
+        .order_by(LogEntry.timestamp, LogEntry.id)
+        .yield_per(batch_size)
+    )
+    for batch in batched(rows, batch_size):
+        items = _item_ids_by_entry([row.id for row in batch])
+        for row in batch:
+            yield {
+                "id": row.id,
+                "timestamp": row.timestamp.isoformat(),
+                "action": row.action,
+                "subject_id": row.subject_id,
+                "secondary_id": row.secondary_id,
+                "items": items.get(row.id, []),
+            }
+
+
+def iter_archived_log_export(
+    filters: Dict[str, Any], batch_size: int
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield log entries matching the filters of a LogFilterSchema like
+    iter_log_export(), including archived entries.
+    """
+    entries = iter_log_export(filter_logs(LogEntry.query, filters), batch_size)
+    if get_log_archive().newest() is None:
+        return entries
+    archived = (
+        entry.as_export()
+        for entry in get_log_archive().entries(_archive_filters(filters))
+    )
+    merged = heapq.merge(
+        archived,
+        entries,
+        key=lambda e: (datetime.datetime.fromisoformat(e["timestamp"]), e["id"]),
+    )
+    return (next(group) for _, group in itertools.groupby(merged, lambda e: e["id"]))
+
+
+def format_log_export(entries: Iterable[Dict[str, Any]], fmt: str) -> Iterator[str]:
+    """Format exported log entries as lines of NDJSON or CSV."""
+    if fmt == "ndjson":
+        for entry in entries:
+            yield json.dumps(entry) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(_EXPORT_COLUMNS)
+    for entry in entries:
+        entry = dict(entry, items=" ".join(str(i) for i in entry["items"]))
+        writer.writerow(entry[column] for column in _EXPORT_COLUMNS)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _item_ids_by_entry(entry_ids: List[int]) -> Dict[int, List[int]]:
+    pairs = (
+        db.session.query(LogEntry.id, BorrowableItem.id)
+        .join(LogEntry.items)
+        .filter(LogEntry.id.in_(entry_ids))
+        .order_by(LogEntry.id, BorrowableItem.id)
+    )
+    items: Dict[int, List[int]] = {}
+    for entry_id, item_id in pairs:
+        items.setdefault(entry_id, []).append(item_id)
+    return items
@@ -0,0 +1,335 @@
+"""
+Password hashing with configurable algorithms and cost.
+
+New passwords are hashed with PASSWORD_HASH_METHOD, one of:
+
+- "pbkdf2:sha256" or "pbkdf2:sha512" with PASSWORD_HASH_ITERATIONS
+  iterations, stored in werkzeug's format,
+- "scrypt" with the cost parameters PASSWORD_HASH_SCRYPT_N, _R and _P.
+
+Alternatively, PASSWORD_HASHER can be set to any object implementing the
+PasswordHasher interface. Stored hashes of every built-in method can be
+verified whatever method is configured, so changing it or its cost only
+affects passwords set afterwards.
+
+Hashing and verification are CPU-bound, so they run in a pool of
+PASSWORD_HASH_WORKERS processes (one per CPU if None, in the calling thread
+if 0) shared by all apps of a process and shut down when it exits. This caps
+the CPU spent on logins, and request threads only wait for the result instead
+of holding the CPU.
+At most PASSWORD_HASH_MAX_PENDING passwords are hashed or verified at once,
+further requests fail with 503 until the pool catches up.
+
+The benchmark-hash command calibrates the cost of a method to a target
+latency.
+
+PasswordHasher
+    Interface for password hashing algorithms.
+
+Pbkdf2Hasher, ScryptHasher
+    The built-in password hashing algorithms.
+
+PasswordHashing
+    Runs a hasher in a bounded pool of worker processes.
+
+verify_password()
+    Check a password against a hash of any built-in method.
+
+init_app()
+    Configure password hashing for an app.
+
+get_password_hashing()
+    Return the password hashing of the current app.
+
+benchmark_hash_command()
+    Command line interface for calibrating the cost of a method.
+"""
+
+import abc
+import atexit
+import concurrent.futures
+import contextlib
+import hashlib
+import hmac
+import math
+import os
+import secrets
+import statistics
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from werkzeug.security import check_password_hash, gen_salt, generate_password_hash
+
+from .api import APIError
+
+METHODS = ("pbkdf2:sha256", "pbkdf2:sha512", "scrypt")
+
+SALT_LENGTH = 16
+
+
+class PasswordHasher(abc.ABC):
+    """
+    Interface for password hashing algorithms.
+
+    Hashers are pickled to the worker processes, so they should only hold
+    their parameters. cost and with_cost() are used by the benchmark-hash
+    command.
+    """
+
+    #: Config key of the cost parameter.
+    cost_key: str = ""
+
+    @abc.abstractmethod
+    def hash(self, password: str) -> str:
+        """Return a salted hash of password."""
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        """Check whether password_hash is a hash of password."""
+        return verify_password(password_hash, password)
+
+    @property
+    @abc.abstractmethod
+    def cost(self) -> int:
+        """The parameter that hashing time grows linearly with."""
+
+    @abc.abstractmethod
+    def with_cost(self, cost: int) -> "PasswordHasher":
+        """Return a hasher with the nearest valid cost to cost."""
+
+
+class Pbkdf2Hasher(PasswordHasher):
+    """PBKDF2 with an HMAC digest, stored in werkzeug's format."""
+
+    cost_key = "PASSWORD_HASH_ITERATIONS"
+
+    def __init__(self, digest: str, iterations: int) -> None:
+        self.digest = digest
+        self.iterations = iterations
+
+    def hash(self, password: str) -> str:
+        return str(
+            generate_password_hash(
+                password,
+                f"pbkdf2:{self.digest}:{self.iterations}",
+                salt_length=SALT_LENGTH,
+            )
+        )
+
+    @property
+    def cost(self) -> int:
+        return self.iterations
+
+    def with_cost(self, cost: int) -> "Pbkdf2Hasher":
+        return Pbkdf2Hasher(self.digest, max(1000, round(cost, -3)))
+
+
+class ScryptHasher(PasswordHasher):
+    """scrypt, stored as "scrypt:n:r:p$salt$hash"."""
+
+    cost_key = "PASSWORD_HASH_SCRYPT_N"
+
+    def __init__(self, n: int, r: int, p: int) -> None:
+        self.n = n  # pylint: disable=invalid-name
+        self.r = r  # pylint: disable=invalid-name
+        self.p = p  # pylint: disable=invalid-name
+
+    def hash(self, password: str) -> str:
+        salt = gen_salt(SALT_LENGTH)
+        key = _scrypt(password, salt, self.n, self.r, self.p)
+        return f"scrypt:{self.n}:{self.r}:{self.p}${salt}${key}"
+
+    @property
+    def cost(self) -> int:
+        return self.n
+
+    def with_cost(self, cost: int) -> "ScryptHasher":
+        # n has to be a power of two.
+        return ScryptHasher(2 ** max(1, round(math.log2(cost))), self.r, self.p)
+
+
+def _scrypt(password: str, salt: str, n: int, r: int, p: int) -> str:
+    # pylint: disable=invalid-name
+    return hashlib.scrypt(
+        password.encode(),
+        salt=salt.encode(),
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * r * (n + p + 2),
+    ).hex()
+
+
+def verify_password(password_hash: str, password: str) -> bool:
+    """Check a password against a hash of any built-in method."""
+    if not password_hash.startswith("scrypt:"):
+        return bool(check_password_hash(password_hash, password))
+    try:
+        method, salt, key = password_hash.split("$", 2)
+        n, r, p = (int(param) for param in method.split(":")[1:])
+    except ValueError:
+        return False
+    return hmac.compare_digest(_scrypt(password, salt, n, r, p), key)
+
+
+def make_hasher(
+    method: str, iterations: int, scrypt_n: int, scrypt_r: int, scrypt_p: int
+) -> PasswordHasher:
+    """Return the built-in hasher for method with the given cost."""
+    if method == "scrypt":
+        return ScryptHasher(scrypt_n, scrypt_r, scrypt_p)
+    if method.startswith("pbkdf2:") and method in METHODS:
+        return Pbkdf2Hasher(method.split(":", 1)[1], iterations)
+    raise ValueError(f"Unknown password hash method {method!r}.")
+
+
+_POOLS: Dict[int, concurrent.futures.ProcessPoolExecutor] = {}
+_POOLS_LOCK = threading.Lock()
+# Shuts the pools down when the process exits.
+_POOLS_STACK = contextlib.ExitStack()
+atexit.register(_POOLS_STACK.close)
+
+
+def _get_pool(workers: int) -> concurrent.futures.ProcessPoolExecutor:
+    with _POOLS_LOCK:
+        if workers not in _POOLS:
+            _POOLS[workers] = _POOLS_STACK.enter_context(
+                concurrent.futures.ProcessPoolExecutor(workers)
+            )
+        return _POOLS[workers]
+
+
+class PasswordHashing:
+    """
+    Runs a hasher in a pool of worker processes, or in the calling thread if
+    workers is 0.
+
+    Calls fail with 503 while max_pending passwords are hashed or verified.
+    """
+
+    def __init__(self, hasher: PasswordHasher, workers: int, max_pending: int) -> None:
+        self.hasher = hasher
+        self.workers = workers
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._dummy_hash: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def hash(self, password: str) -> str:
+        """Return a salted hash of password."""
+        return str(self._run(self.hasher.hash, password))
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        """Check whether password_hash is a hash of password."""
+        return bool(self._run(self.hasher.verify, password_hash, password))
+
+    @property
+    def dummy_hash(self) -> str:
+        """
+        A hash of a random password made with the configured parameters.
+
+        Verifying a password against it takes as long as for users whose
+        password was hashed with the same parameters, so unknown usernames
+        can't be told apart from wrong passwords by timing.
+        """
+        with self._lock:
+            if self._dummy_hash is None:
+                self._dummy_hash = self.hash(secrets.token_urlsafe())
+            return self._dummy_hash
+
+    def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        # A non-blocking acquire can't use with, it is released below.
+        # pylint: disable=consider-using-with
+        if not self._pending.acquire(blocking=False):
+            raise APIError(reason="password_hashing_busy", status_code=503)
+        try:
+            if not self.workers:
+                return function(*args)
+            return _get_pool(self.workers).submit(function, *args).result()
+        finally:
+            self._pending.release()
+
+
+def init_app(app: Flask) -> None:
+    """Configure password hashing for an app from its config."""
+    hasher = app.config["PASSWORD_HASHER"]
+    if hasher is None:
+        hasher = make_hasher(
+            app.config["PASSWORD_HASH_METHOD"],
+            app.config["PASSWORD_HASH_ITERATIONS"],
+            app.config["PASSWORD_HASH_SCRYPT_N"],
+            app.config["PASSWORD_HASH_SCRYPT_R"],
+            app.config["PASSWORD_HASH_SCRYPT_P"],
+        )
+    workers = app.config["PASSWORD_HASH_WORKERS"]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    app.extensions["password_hashing"] = PasswordHashing(
+        hasher, workers, app.config["PASSWORD_HASH_MAX_PENDING"]
+    )
+
+
+def get_password_hashing() -> PasswordHashing:
+    """Return the password hashing of the current app."""
+    hashing: PasswordHashing = current_app.extensions["password_hashing"]
+    return hashing
+
+
+def time_hasher(hasher: PasswordHasher, rounds: int) -> float:
+    """Return the median time hasher takes to hash a password, in seconds."""
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        hasher.hash("benchmark")
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate(
+    hasher: PasswordHasher, target: float, rounds: int, steps: int = 4
+) -> PasswordHasher:
+    """
+    Return a hasher whose cost is scaled to take about target seconds per
+    hash, measured in the calling thread.
+    """
+    for _ in range(steps):
+        seconds = time_hasher(hasher, rounds)
+        scaled = hasher.with_cost(max(1, round(hasher.cost * target / seconds)))
+        if scaled.cost == hasher.cost:
+            break
+        hasher = scaled
+    return hasher
+
+
+@click.command("benchmark-hash")
+@click.option(
+    "--target-ms", type=float, default=250.0, help="Time a login may take to hash."
+)
+@click.option("--method", type=click.Choice(METHODS), help="Defaults to the config.")
+@click.option("--rounds", type=int, default=5, help="Hashes timed per cost.")
+@with_appcontext
+def benchmark_hash_command(
+    target_ms: float, method: Optional[str], rounds: int
+) -> None:
+    """CLI command to calibrate the cost of password hashing to a latency."""
+    config = current_app.config
+    if method is None and config["PASSWORD_HASHER"] is not None:
+        hasher = config["PASSWORD_HASHER"]
+    else:
+        hasher = make_hasher(
+            method or config["PASSWORD_HASH_METHOD"],
+            config["PASSWORD_HASH_ITERATIONS"],
+            config["PASSWORD_HASH_SCRYPT_N"],
+            config["PASSWORD_HASH_SCRYPT_R"],
+            config["PASSWORD_HASH_SCRYPT_P"],
+        )
+    for label in ("Configured", "Calibrated"):
+        if label == "Calibrated":
+            hasher = calibrate(hasher, target_ms / 1000, rounds)
+        milliseconds = time_hasher(hasher, rounds) * 1000
+        click.echo(f"{label} cost {hasher.cost}: {milliseconds:.0f}ms per hash")
+    if method is not None:
+        click.echo(f'PASSWORD_HASH_METHOD = "{method}"')
+    click.echo(f"{hasher.cost_key} = {hasher.cost}")
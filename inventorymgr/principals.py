@@ -0,0 +1,221 @@
+"""
+Per-process cache of authenticated principals.
+
+A principal is the part of a user that access control needs: the id, the
+permission flags and the qualification ids. Caching it lets protected views
+skip the database entirely when authenticating and checking permissions.
+
+The cache is disabled unless PRINCIPAL_CACHE_TTL is set to a positive number
+of seconds, in which case an in-process LRU cache of PRINCIPAL_CACHE_SIZE
+entries is used. Alternatively, PRINCIPAL_CACHE can be set to any object
+implementing the PrincipalCacheBackend interface, e.g. a client for a cache
+shared between worker processes.
+
+Views that change users or qualifications call invalidate_principal() or
+invalidate_all_principals() after committing. Invalidation only reaches the
+cache of the process handling the request: other worker processes keep
+serving their cached principals until the entries expire, unless they share
+a backend. Changes made directly in the database are likewise only picked
+up once entries expire.
+
+Principal
+    Cached access control data of a user.
+
+PrincipalCacheBackend
+    Interface for principal cache storage.
+
+LRUPrincipalCache
+    In-process LRU cache whose entries expire after a TTL.
+
+PrincipalCache
+    Wraps a backend and counts hits and misses.
+
+init_app()
+    Configure the principal cache of an app.
+
+get_principal_cache()
+    Return the principal cache of the current app, if enabled.
+
+invalidate_principal(), invalidate_all_principals()
+    Drop cached principals after changes to users or qualifications.
+"""
+
+import abc
+import collections
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+from flask import Flask, current_app, g
+
+from .db.models import User
+
+
+class Principal(NamedTuple):
+    """Cached access control data of a user."""
+
+    id: int
+    create_users: bool
+    view_users: bool
+    update_users: bool
+    edit_qualifications: bool
+    create_items: bool
+    manage_checkouts: bool
+    qualification_ids: FrozenSet[int]
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        """Create a principal from a user ORM object."""
+        return cls(
+            id=user.id,
+            create_users=user.create_users,
+            view_users=user.view_users,
+            update_users=user.update_users,
+            edit_qualifications=user.edit_qualifications,
+            create_items=user.create_items,
+            manage_checkouts=user.manage_checkouts,
+            qualification_ids=frozenset(q.id for q in user.qualifications),
+        )
+
+
+class PrincipalCacheBackend(abc.ABC):
+    """Interface for principal cache storage."""
+
+    @abc.abstractmethod
+    def get(self, user_id: int) -> Optional[Principal]:
+        """Return the principal for user_id, or None if it is not cached."""
+
+    @abc.abstractmethod
+    def set(self, user_id: int, principal: Principal) -> None:
+        """Store the principal for user_id."""
+
+    @abc.abstractmethod
+    def delete(self, user_id: int) -> None:
+        """Remove the principal for user_id, if cached."""
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        """Remove all principals."""
+
+
+class LRUPrincipalCache(PrincipalCacheBackend):
+    """In-process LRU cache whose entries expire after a TTL."""
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "collections.OrderedDict[int, Tuple[float, Principal]]" = (
+            collections.OrderedDict()
+        )
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires, principal = entry
+            if expires <= self._clock():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return principal
+
+    def set(self, user_id: int, principal: Principal) -> None:
+        with self._lock:
+            self._entries[user_id] = (self._clock() + self.ttl, principal)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class PrincipalCache:
+    """Wraps a principal cache backend and counts hits and misses."""
+
+    def __init__(self, backend: PrincipalCacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        """Look up a principal, counting the hit or miss."""
+        principal = self.backend.get(user_id)
+        with self._lock:
+            if principal is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return principal
+
+    def set(self, user_id: int, principal: Principal) -> None:
+        """Store a principal."""
+        self.backend.set(user_id, principal)
+
+    def delete(self, user_id: int) -> None:
+        """Remove a principal."""
+        self.backend.delete(user_id)
+
+    def clear(self) -> None:
+        """Remove all principals."""
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit and miss counters."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+def init_app(app: Flask) -> None:
+    """Configure the principal cache of an app from its config."""
+    backend: Optional[PrincipalCacheBackend] = app.config["PRINCIPAL_CACHE"]
+    if backend is None and app.config["PRINCIPAL_CACHE_TTL"] > 0:
+        backend = LRUPrincipalCache(
+            app.config["PRINCIPAL_CACHE_SIZE"], app.config["PRINCIPAL_CACHE_TTL"]
+        )
+    app.extensions["principal_cache"] = (
+        None if backend is None else PrincipalCache(backend)
+    )
+
+
+def get_principal_cache() -> Optional[PrincipalCache]:
+    """Return the principal cache of the current app, or None if disabled."""
+    return current_app.extensions.get("principal_cache")  # type: ignore
+
+
+def invalidate_principal(user_id: int) -> None:
+    """Drop the cached principal of a user, call after committing changes."""
+    cache = get_principal_cache()
+    if cache is not None:
+        cache.delete(user_id)
+    _forget_request_principal()
+
+
+def invalidate_all_principals() -> None:
+    """Drop all cached principals, call after committing changes."""
+    cache = get_principal_cache()
+    if cache is not None:
+        cache.clear()
+    _forget_request_principal()
+
+
+def _forget_request_principal() -> None:
+    for key in ("session_principal", "session_principal_id"):
+        g.pop(key, None)
@@ -5,23 +5,29 @@ Qualifications are string tags that can be attached to a user to indicate they
 hold some kind of qualification or skill, e.g. a driver's license.
 """
 
-from typing import Any, Dict, cast
+from typing import Any, Dict, Iterable, cast
 
 from flask import Blueprint, jsonify, request
+from sqlalchemy import or_  # type: ignore
 from sqlalchemy.exc import IntegrityError  # type: ignore
 
 from .accesscontrol import requires_permissions
 from .api import APIError, QualificationSchema
 from .auth import authentication_required
 from .db import db
-from .db.models import Qualification
+from .db.models import COLLECTION_NAMES, Qualification
+from .db.routing import replica_reads
+from .principals import invalidate_all_principals
+from .versions import bump_versions, versioned
 
 
 bp = Blueprint("qualifications", __name__, url_prefix="/api/v1/qualifications")
 
 
 @bp.route("", methods=("GET",))
+@replica_reads
 @authentication_required
+@versioned("qualifications")
 def list_qualifications() -> Dict[str, Any]:
     """API endpoint that returns a list of all qualifications."""
     qualifications_schema = QualificationSchema(many=True)
@@ -44,6 +50,7 @@ def create_qualification() -> Dict[str, Any]:
 
     try:
         db.session.add(qualification_obj)
+        bump_versions("qualifications")
         db.session.commit()
     except IntegrityError as exc:
         db.session.rollback()
@@ -69,6 +76,7 @@ def update_qualification(qual_id: int) -> Dict[str, Any]:
 
     try:
         qualification_obj.name = qualification["name"]
+        bump_versions(*COLLECTION_NAMES)
         db.session.commit()
     except IntegrityError:
         raise APIError(reason="qualification_exists", status_code=400)
@@ -90,7 +98,9 @@ def delete_qualification(qual_id: int) -> Dict[str, bool]:
         raise APIError(reason="no_such_object", status_code=400)
 
     db.session.delete(Qualification.query.get(qual_id))
+    bump_versions(*COLLECTION_NAMES)
     db.session.commit()
+    invalidate_all_principals()
 
     return {"success": True}
 
@@ -103,3 +113,23 @@ def get_qualification(qual_id: int) -> Any:
     if qualification is None:
         raise APIError(reason="no_such_object", status_code=400)
     return QualificationSchema().dump(qualification)
+
+
+def resolve_qualifications(references: Iterable[Any]) -> Dict[Any, int]:
+    """
+    Map qualification ids and names to ids with a single query.
+
+    References to qualifications which do not exist are left out.
+    """
+    refs = set(references)
+    if not refs:
+        return {}
+    ids = [ref for ref in refs if isinstance(ref, int)]
+    names = [ref for ref in refs if isinstance(ref, str)]
+    resolved: Dict[Any, int] = {}
+    for q_id, name in db.session.query(Qualification.id, Qualification.name).filter(
+        or_(Qualification.id.in_(ids), Qualification.name.in_(names))
+    ):
+        resolved[q_id] = q_id
+        resolved[name] = q_id
+    return {ref: resolved[ref] for ref in refs if ref in resolved}
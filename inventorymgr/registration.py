@@ -9,13 +9,14 @@ import click
 from flask import Blueprint, request
 from flask.cli import with_appcontext
 from sqlalchemy.exc import IntegrityError  # type: ignore
-from werkzeug.security import generate_password_hash
 
 from .accesscontrol import requires_permissions
 from .api.models import RegistrationTokenSchema
 from .auth import authentication_required
 from .db import db
 from .db.models import RegistrationToken, User
+from .passwords import get_password_hashing
+from .versions import bump_versions
 
 
 bp = Blueprint("registration", __name__, url_prefix="/api/v1/registration")
@@ -52,8 +53,9 @@ def handle_registration_request(token: str) -> Tuple[Dict[str, Any], int]:
 
     try:
         db.session.add(
-            User(username=username, password=generate_password_hash(password))
+            User(username=username, password=get_password_hashing().hash(password))
         )
+        bump_versions("users")
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
@@ -14,8 +14,11 @@ function createRequestParams(obj) {
     return params;
 }
 
-function updateRequestParams(obj) {
+function updateRequestParams(obj, etag) {
     const headers = contentTypeJson();
+    if (etag) {
+        headers.append('If-Match', etag);
+    }
     const params = {
         method: 'PUT',
         headers,
@@ -41,7 +44,8 @@ function isJsonResponse(response) {
 
 function unpackJson(response) {
     if (response.ok) {
-        return response.json().then(json => { return { success: true, data: json }; });
+        const etag = response.headers.get('ETag');
+        return response.json().then(json => { return { success: true, data: json, etag }; });
     } else if (isJsonResponse(response)) {
         return response.json().then(json => { return { success: false, error: json }; });
     } else {
@@ -57,8 +61,8 @@ export function createItem(item) {
     return fetch('/api/v1/items', params).then(unpackJson);
 }
 
-export function updateItem(item) {
-    const params = updateRequestParams(item);
+export function updateItem(item, etag) {
+    const params = updateRequestParams(item, etag);
     return fetch('/api/v1/items/' + item.id, params).then(unpackJson);
 }
 
@@ -121,8 +125,8 @@ export function createUser(user) {
     return fetch('/api/v1/users', params).then(unpackJson);
 }
 
-export function updateUser(user_id, user) {
-    const params = updateRequestParams(user);
+export function updateUser(user_id, user, etag) {
+    const params = updateRequestParams(user, etag);
     return fetch('/api/v1/users/' + user_id, params).then(unpackJson);
 }
 
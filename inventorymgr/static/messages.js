@@ -44,12 +44,14 @@ export const messages = {
             password_mismatch: 'Passwords do not match.',
             password_missing: 'Password is missing.',
             permissions_not_subset: 'You cannot set permissions you do not have yourself.',
+            precondition_required: 'It must be reloaded before saving, try refreshing the page.',
             qualification_exists: 'Qualification already exists.',
             unknown: 'An unknown error occurred during processing.',
             unknown_qualification: 'Qualification does not exist.',
             unknown_resource: 'Unknown API endpoint.',
             user_exists: 'User already exists.',
             validation_failed: 'API request was malformed, try refreshing the page.',
+            version_conflict: 'It was changed in the meantime, try refreshing the page.',
         },
         fields: {
             actions: 'Actions',
@@ -149,12 +151,14 @@ export const messages = {
             password_mismatch: 'Passwörter stimmen nicht überein.',
             password_missing: 'Passwort fehlt.',
             permissions_not_subset: 'Du kannst keine Berechtigungen setzen, die du nicht selbst hast.',
+            precondition_required: 'Muss vor dem Speichern neu geladen werden, bitte Seite neu laden.',
             qualification_exists: 'Qualifikation existiert bereits.',
             unknown: 'Bei der Verarbeitung trat ein unbekannter Fehler auf.',
             unknown_qualification: 'Qualifikation existiert nicht.',
             unknown_resource: 'Unbekannter API-Endpoint.',
             user_exists: 'Benutzer existiert bereits.',
             validation_failed: 'API-Anfrage fehlgeschlagen, bitte Seite neu laden.',
+            version_conflict: 'Wurde zwischenzeitlich geändert, bitte Seite neu laden.',
         },
         fields: {
             actions: 'Aktionen',
@@ -1,27 +1,36 @@
-import { mapState } from '/static/vuex.esm.browser.js'
-import { updateItem } from '/static/api.js'
+import { fetchItem, updateItem } from '/static/api.js'
 import ItemForm from '/static/views/itemform.js'
 
 
 const template = `
     <item-form
-      v-if="currentItem"
+      v-if="item"
       context="edit"
-      :current="currentItem"
+      :current="item"
       :error="errorMessage"
       @commit-item-change="sendUpdateItemRequest"
       @cancel-item-change="cancelEdit">
     </item-form>`
 
 
-function currentItem() {
-    const id = parseInt(this.$route.params.id);
-    return this.items.find(i => i.id === id);
+// The item is loaded with its ETag, so saving fails instead of overwriting
+// changes made since, e.g. to its stock by checkouts.
+function loadItem() {
+    fetchItem(parseInt(this.$route.params.id)).then(response => {
+        if (response.success) {
+            this.$store.commit('addItem', response.data);
+            this.item = response.data;
+            this.etag = response.etag;
+        } else {
+            console.error(response.error);
+            this.errorMessage = this.$t(`errors.${response.error.reason}`);
+        }
+    });
 }
 
 
 function sendUpdateItemRequest(item) {
-    updateItem(item).then(response => {
+    updateItem(item, this.etag).then(response => {
         if (response.success) {
             this.$store.commit('addItem', response.data);
             this.$router.push('/items');
@@ -40,9 +49,9 @@ function cancelEdit() {
 export default {
     template,
     data: () => {
-        return { errorMessage: '' }
+        return { errorMessage: '', item: null, etag: null }
     },
-    computed: { currentItem, ...mapState(['items']) },
+    created: loadItem,
     methods: { sendUpdateItemRequest, cancelEdit },
     components: { ItemForm },
 }
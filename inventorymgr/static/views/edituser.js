@@ -1,18 +1,31 @@
-import { mapState } from '/static/vuex.esm.browser.js'
-import { updateUser } from '/static/api.js'
+import { fetchUser, updateUser } from '/static/api.js'
 import UserForm from '/static/views/userform.js'
 
 
 const template = `
     <user-form
-      v-if="currentUser"
-      :current="currentUser"
+      v-if="user"
+      :current="user"
       :error="errorMessage"
       context="edit"
       @commit-user-change="sendUpdateUserRequest"
       @cancel-user-change="returnToUsers">
     </user-form>`
 
+// The user is loaded with its ETag, so saving fails instead of overwriting
+// changes made since.
+function loadUser() {
+    fetchUser(this.$route.params.id).then(response => {
+        if (response.success) {
+            this.user = response.data;
+            this.etag = response.etag;
+        } else {
+            console.error(response.error);
+            this.errorMessage = this.$t(`errors.${response.error.reason}`);
+        }
+    });
+}
+
 function sendUpdateUserRequest(user, repeatedPassword) {
     if ((user.password || repeatedPassword) && user.password !== repeatedPassword) {
         this.errorMessage = this.$t('errors.password_mismatch');
@@ -23,7 +36,7 @@ function sendUpdateUserRequest(user, repeatedPassword) {
         delete user.password;
     }
 
-    updateUser(this.$route.params.id, user).then(response => {
+    updateUser(this.$route.params.id, user, this.etag).then(response => {
         if (response.success) {
             this.$store.commit('updateUser', response.data);
             if (this.$route.params.id === 'me') {
@@ -44,18 +57,9 @@ function returnToUsers() {
 export default {
     template,
     data: () => {
-        return { errorMessage: '' }
-    },
-    computed: {
-        currentUser: function() {
-            if (this.$route.params.id === 'me') {
-                return this.sessionUser;
-            }
-            const id = parseInt(this.$route.params.id);
-            return this.users.find(u => u.id === id);
-        },
-        ...mapState(['users', 'sessionUser']),
+        return { errorMessage: '', user: null, etag: null }
     },
+    created: loadUser,
     methods: {
         sendUpdateUserRequest,
         returnToUsers
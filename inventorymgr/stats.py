@@ -0,0 +1,123 @@
+"""
+API endpoints for dashboard statistics.
+
+Stock levels and open borrows are read from the open borrow aggregates, see
+inventorymgr.db.aggregates, so no borrow states are scanned. Overdue borrow
+states are looked up with a partial index on the receipt time of open borrow
+states.
+
+inventory()
+    Flask view returning stock levels, open borrows and overdue items.
+"""
+
+import datetime
+from typing import Any, Dict, List
+
+from flask import Blueprint, current_app
+from sqlalchemy import func  # type: ignore
+
+from .accesscontrol import requires_permissions
+from .auth import authentication_required
+from .db import db
+from .db.models import BorrowableItem, BorrowState, User
+from .db.models import ItemOpenBorrows, UserOpenBorrows
+from .db.routing import replica_reads
+
+
+bp = Blueprint("stats", __name__, url_prefix="/api/v1/stats")
+
+
+_utcnow = datetime.datetime.utcnow  # pylint: disable=invalid-name
+
+
+@bp.route("/inventory", methods=("GET",))
+@replica_reads
+@authentication_required
+@requires_permissions("manage_checkouts")
+def inventory() -> Dict[str, Any]:
+    """
+    API endpoint for the current stock of each item, open borrows of each user
+    and the items that were borrowed longer than LOAN_PERIOD_DAYS ago.
+    """
+    loan_period = datetime.timedelta(days=current_app.config["LOAN_PERIOD_DAYS"])
+    overdue_before = _utcnow() - loan_period
+    return {
+        "items": item_stock(),
+        "users": user_open_borrows(),
+        "overdue": overdue_items(overdue_before),
+        "overdue_before": overdue_before.isoformat(),
+    }
+
+
+def item_stock() -> List[Dict[str, Any]]:
+    """Return the stock levels and open borrows of all items."""
+    rows = (
+        db.session.query(
+            BorrowableItem.id,
+            BorrowableItem.name,
+            BorrowableItem.quantity_total,
+            BorrowableItem.quantity_in_stock,
+            BorrowableItem.unmatched_returns,
+            ItemOpenBorrows.open_quantity,
+            ItemOpenBorrows.borrower_count,
+        )
+        .outerjoin(ItemOpenBorrows, ItemOpenBorrows.item_id == BorrowableItem.id)
+        .order_by(BorrowableItem.id)
+    )
+    return [
+        {
+            "id": row.id,
+            "name": row.name,
+            "quantity_total": row.quantity_total,
+            "quantity_in_stock": row.quantity_in_stock,
+            "quantity_borrowed": row.open_quantity or 0,
+            "unmatched_returns": row.unmatched_returns,
+            "borrower_count": row.borrower_count or 0,
+        }
+        for row in rows
+    ]
+
+
+def user_open_borrows() -> List[Dict[str, Any]]:
+    """Return the open borrows of all users that have any."""
+    rows = (
+        db.session.query(
+            User.id,
+            User.username,
+            UserOpenBorrows.open_quantity,
+            UserOpenBorrows.item_count,
+        )
+        .join(UserOpenBorrows, UserOpenBorrows.user_id == User.id)
+        .filter(UserOpenBorrows.open_quantity > 0)
+        .order_by(User.id)
+    )
+    return [
+        {
+            "id": row.id,
+            "username": row.username,
+            "quantity_borrowed": row.open_quantity,
+            "item_count": row.item_count,
+        }
+        for row in rows
+    ]
+
+
+def overdue_items(received_before: datetime.datetime) -> List[Dict[str, Any]]:
+    """Return the quantities of items borrowed before a time and not returned."""
+    rows = (
+        db.session.query(
+            BorrowState.borrowed_item_id,
+            func.sum(BorrowState.quantity),
+            func.min(BorrowState.received_at),
+        )
+        .filter(
+            BorrowState.returned_at.is_(None),
+            BorrowState.received_at < received_before,
+        )
+        .group_by(BorrowState.borrowed_item_id)
+        .order_by(BorrowState.borrowed_item_id)
+    )
+    return [
+        {"item_id": item_id, "quantity": quantity, "since": since.isoformat()}
+        for item_id, quantity, since in rows
+    ]
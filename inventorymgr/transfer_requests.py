@@ -5,10 +5,13 @@ from typing import Any, Dict
 
 from flask import Blueprint, request, session
 
+from inventorymgr.accesscontrol import get_session_user
 from inventorymgr.api import APIError
 from inventorymgr.api.models import TransferRequestSchema
 from inventorymgr.auth import authentication_required
+from inventorymgr.changes import queue_change
 from inventorymgr.db import db
+from inventorymgr.db.loaders import loader_options
 from inventorymgr.db.models import BorrowState, LogEntry, TransferRequest, User
 
 
@@ -19,11 +22,11 @@ bp = Blueprint("transfer_requests", __name__, url_prefix="/api/v1/transferreques
 @authentication_required
 def get_transfer_requests() -> Dict[str, Any]:
     """Returns a list of transfer requests for the current user."""
-    return {
-        "transferrequests": TransferRequestSchema(many=True).dump(
-            TransferRequest.query.filter_by(target_user_id=session["user_id"])
-        )
-    }
+    schema = TransferRequestSchema(many=True)
+    transfer_requests = TransferRequest.query.options(
+        *loader_options(TransferRequest, schema)
+    ).filter_by(target_user_id=session["user_id"])
+    return {"transferrequests": schema.dump(transfer_requests.all())}
 
 
 @bp.route("", methods=("POST",))
@@ -32,7 +35,7 @@ def create_transfer_request() -> Dict[str, bool]:
     """API endpoint for creating transfer requests."""
     transfer_request_json = TransferRequestSchema().load(request.json, partial=("id",))
     borrowstate = BorrowState.query.get(transfer_request_json["borrowstate_id"])
-    issuing_user = User.query.get(session["user_id"])
+    issuing_user = get_session_user()
     if borrowstate is None:
         raise APIError(reason="unknown_borrowstate", status_code=400)
     if borrowstate.borrowing_user_id != issuing_user.id:
@@ -47,6 +50,8 @@ def create_transfer_request() -> Dict[str, bool]:
         target_user=target_user, issuing_user=issuing_user, borrowstate=borrowstate
     )
     db.session.add(transfer_request)
+    db.session.flush()
+    _queue_transfer_request_change(transfer_request, "created")
     db.session.commit()
     return {"success": True}
 
@@ -55,7 +60,7 @@ def create_transfer_request() -> Dict[str, bool]:
 @authentication_required
 def accept_or_decline_transfer_request(request_id: int) -> Dict[str, bool]:
     """API endpoint to accept or decline a transfer request."""
-    user = User.query.get(session["user_id"])
+    user = get_session_user()
     transfer_request = TransferRequest.query.get(request_id)
     if transfer_request is None:
         raise APIError(reason="unknown_transfer_request", status_code=404)
@@ -84,10 +89,26 @@ def accept_or_decline_transfer_request(request_id: int) -> Dict[str, bool]:
         transfer_request.borrowstate.borrowing_user = user
     elif request.json["action"] != "decline":
         raise APIError(reason="unknown_transfer_request_action", status_code=400)
+    _queue_transfer_request_change(
+        transfer_request,
+        "accepted" if request.json["action"] == "accept" else "declined",
+    )
     db.session.delete(transfer_request)
     db.session.commit()
     return {"success": True}
 
 
+def _queue_transfer_request_change(
+    transfer_request: TransferRequest, action: str
+) -> None:
+    queue_change(
+        "transfer_request",
+        action=action,
+        id=transfer_request.id,
+        borrowstate_id=transfer_request.borrowstate_id,
+        user_ids=[transfer_request.issuing_user_id, transfer_request.target_user_id],
+    )
+
+
 def _utcnow() -> datetime.datetime:
     return datetime.datetime.utcnow()
@@ -9,26 +9,39 @@ update_user()
 
 list_users()
     Flask view to get a list of users using GET.
+
+import_users()
+    Create users in bulk from CSV or NDJSON rows.
 """
 
-from typing import Any, Dict, List, cast
+import concurrent.futures
+from typing import Any, Dict, Iterable, List, Optional, Tuple, cast
 
 import click
-from flask import Blueprint, request, session
+from flask import Blueprint, current_app, request, session
 from flask.cli import with_appcontext
 from sqlalchemy.exc import IntegrityError  # type: ignore
-from werkzeug.security import generate_password_hash
 
 from .accesscontrol import (
     PERMISSIONS,
     can_set_permissions,
     can_set_qualifications,
+    load_session_user,
     requires_permissions,
 )
 from .api import APIError, UserSchema
+from .api.models import UserImportSchema
+from .api.serializers import dump_many
 from .auth import authentication_required, logout
 from .db import db
+from .db.loaders import loader_options
 from .db.models import User, Qualification
+from .db.routing import replica_reads
+from .imports import IMPORT_FORMATS, ImportReport, batched, import_format, load_rows
+from .passwords import get_password_hashing
+from .principals import invalidate_principal
+from .qualifications import resolve_qualifications
+from .versions import bump_versions, check_if_match, versioned, with_etag
 
 
 bp = Blueprint("users", __name__, url_prefix="/api/v1/users")
@@ -57,12 +70,13 @@ def new_user() -> Dict[str, Any]:
     try:
         user = User(
             username=username,
-            password=generate_password_hash(password),
+            password=get_password_hashing().hash(password),
             qualifications=qualifications,
             **{k: user_dict[k] for k in PERMISSIONS},
         )
 
         db.session.add(user)
+        bump_versions("users")
         db.session.commit()
         return cast(Dict[str, Any], user_schema.dump(user))
 
@@ -73,7 +87,7 @@ def new_user() -> Dict[str, Any]:
 @bp.route("/<int:user_id>", methods=("PUT",))
 @authentication_required
 @requires_permissions("view_users", "update_users")
-def update_user(user_id: int) -> Dict[str, Any]:
+def update_user(user_id: int) -> Any:
     """Flask view to update a user using PUT."""
     user_schema = UserSchema()
     user_dict = user_schema.load(request.json, partial=("password",))
@@ -84,18 +98,21 @@ def update_user(user_id: int) -> Dict[str, Any]:
     user = User.query.get(user_id)
     if user is None:
         raise APIError(reason="no_such_user", status_code=400)
+    check_if_match(user)
 
     try:
         update_user_qualifications(user, user_dict)
         update_user_permissions(user, user_dict)
         update_user_username(user, user_dict)
         update_user_password(user, user_dict)
+        bump_versions("users")
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
         raise APIError(reason="user_exists", status_code=400)
+    invalidate_principal(user_id)
 
-    return cast(Dict[str, Any], user_schema.dump(user))
+    return with_etag(user_schema.dump(user), user)
 
 
 def update_user_qualifications(user: User, user_dict: Dict[str, Any]) -> None:
@@ -129,7 +146,7 @@ def update_user_username(user: User, user_dict: Dict[str, Any]) -> None:
 def update_user_password(user: User, user_dict: Dict[str, Any]) -> None:
     """Update user password."""
     if "password" in user_dict:
-        user.password = generate_password_hash(user_dict["password"])
+        user.password = get_password_hashing().hash(user_dict["password"])
 
 
 @bp.route("/<int:user_id>", methods=("DELETE",))
@@ -141,7 +158,9 @@ def delete_user(user_id: int) -> str:
     user = User.query.get(user_id)
     if user is not None:
         db.session.delete(User.query.get(user_id))
+        bump_versions("users")
         db.session.commit()
+        invalidate_principal(user_id)
 
     return str(user_id)
 
@@ -154,18 +173,17 @@ def get_user(user_id: int) -> Any:
     user = User.query.get(user_id)
     if user is None:
         raise APIError(reason="no_such_user", status_code=400)
-    return UserSchema().dump(user)
+    return with_etag(UserSchema().dump(user), user)
 
 
 @bp.route("/me", methods=("GET",))
 @authentication_required
 def get_self() -> Any:
     """Flask view to get the current session's user as JSON."""
-    self_id = session["user_id"]
-    self_user = User.query.get(self_id)
+    self_user = load_session_user()
     if self_user is None:
         raise APIError(reason="no_such_user", status_code=400)
-    return UserSchema().dump(self_user)
+    return with_etag(UserSchema().dump(self_user), self_user)
 
 
 @bp.route("/me", methods=("PUT",))
@@ -178,9 +196,10 @@ def update_self() -> Any:
     if user_dict["id"] != session["user_id"]:
         raise APIError(reason="incorrect_id", status_code=400)
 
-    user = User.query.get(user_dict["id"])
+    user = load_session_user()
     if user is None:
         raise APIError(reason="no_such_user", status_code=400)
+    check_if_match(user)
 
     if user.edit_qualifications:
         update_user_qualifications(user, user_dict)
@@ -195,9 +214,11 @@ def update_self() -> Any:
     update_user_username(user, user_dict)
     update_user_password(user, user_dict)
 
+    bump_versions("users")
     db.session.commit()
+    invalidate_principal(user.id)
 
-    return cast(Dict[str, Any], user_schema.dump(user))
+    return with_etag(user_schema.dump(user), user)
 
 
 def insufficient_permissions() -> APIError:
@@ -221,22 +242,26 @@ def wants_to_update_permissions(user: User, user_dict: Dict[str, Any]) -> bool:
 @authentication_required
 def delete_self() -> Any:
     """Flask view to delete current session's user."""
-    user_id = session["user_id"]
-    user = User.query.get(user_id)
+    user = load_session_user()
     if user is not None:
-        db.session.delete(User.query.get(user_id))
+        db.session.delete(user)
+        bump_versions("users")
         db.session.commit()
+        invalidate_principal(user.id)
 
     return logout()
 
 
 @bp.route("", methods=("GET",))
+@replica_reads
 @authentication_required
 @requires_permissions("view_users")
-def list_users() -> Dict[str, List[str]]:
+@versioned("users")
+def list_users() -> Dict[str, List[Dict[str, Any]]]:
     """Flask view to get a list of users using GET."""
-    users = UserSchema(many=True).dump(User.query.all())
-    return {"users": users}
+    schema = UserSchema(many=True)
+    users = User.query.options(*loader_options(User, schema))
+    return {"users": dump_many(schema, users)}
 
 
 @click.command("create-user")
@@ -257,7 +282,118 @@ def list_users() -> Dict[str, List[str]]:
 @with_appcontext
 def create_user_command(**args: Any) -> None:
     """CLI command to create a new user."""
-    args["password"] = generate_password_hash(args["password"])
+    args["password"] = get_password_hashing().hasher.hash(args["password"])
     db.session.add(User(**args))
+    bump_versions("users")
     db.session.commit()
     click.echo("Created user {}".format(args["username"]))
+
+
+@click.command("import-users")
+@click.option("--format", "import_fmt", type=click.Choice(IMPORT_FORMATS))
+@click.option("--batch-size", type=int, help="Number of users inserted at once.")
+@click.option("--workers", type=int, help="Number of password hashing processes.")
+@click.argument("source", type=click.File("r"))
+@with_appcontext
+def import_users_command(
+    import_fmt: Optional[str],
+    batch_size: Optional[int],
+    workers: Optional[int],
+    source: Any,
+) -> None:
+    """CLI command to create users from NDJSON or CSV (for .csv files)."""
+    report = import_users(
+        source,
+        import_fmt or import_format(source.name),
+        batch_size or current_app.config["USERS_IMPORT_BATCH_SIZE"],
+        workers,
+    ).as_dict()
+    for error in report["errors"]:
+        click.echo(f"Row {error['row']}: {error['errors']}", err=True)
+    click.echo(
+        f"Created {report['created']}, failed {report['failed']} users "
+        f"in {report['seconds']}s ({report['rows_per_second']} rows/s)."
+    )
+
+
+def import_users(
+    lines: Iterable[str], fmt: str, batch_size: int, workers: Optional[int] = None
+) -> ImportReport:
+    """
+    Create users from the lines of a CSV or NDJSON import.
+
+    Rows are validated with UserImportSchema. Invalid rows, repeated and
+    existing usernames and unknown qualifications are reported and skipped.
+
+    Passwords are hashed with the configured hasher by a pool of worker
+    processes (one per CPU by default), as hashing is CPU-bound. Hashing runs
+    ahead while users are inserted batch_size rows at a time, each batch in
+    its own transaction.
+    """
+    report = ImportReport()
+    valid = load_rows(lines, fmt, UserImportSchema(), "username", report)
+    if valid:
+        _hash_and_insert_users(valid, batch_size, workers, report)
+    return report
+
+
+def _hash_and_insert_users(
+    valid: List[Tuple[int, Dict[str, Any]]],
+    batch_size: int,
+    workers: Optional[int],
+    report: ImportReport,
+) -> None:
+    hasher = get_password_hashing().hasher
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        hashes = pool.map(
+            hasher.hash, [row["password"] for _, row in valid], chunksize=8
+        )
+        for batch in batched(zip(valid, hashes), batch_size):
+            _insert_user_batch(batch, report)
+
+
+def _insert_user_batch(
+    batch: List[Tuple[Tuple[int, Dict[str, Any]], str]], report: ImportReport
+) -> None:
+    qualifications = resolve_qualifications(
+        ref for (_, row), _ in batch for ref in row["qualifications"]
+    )
+    existing = {
+        username
+        for username, in db.session.query(User.username).filter(
+            User.username.in_([row["username"] for (_, row), _ in batch])
+        )
+    }
+    users = []
+    for (number, row), password_hash in batch:
+        unknown = [ref for ref in row["qualifications"] if ref not in qualifications]
+        if row["username"] in existing:
+            report.error(number, {"username": ["User exists."]})
+        elif unknown:
+            message = f"Unknown qualifications: {', '.join(map(str, unknown))}."
+            report.error(number, {"qualifications": [message]})
+        else:
+            users.append(dict(row, password=password_hash))
+    if not users:
+        return
+
+    db.session.execute(
+        User.__table__.insert(),
+        [{k: v for k, v in user.items() if k != "qualifications"} for user in users],
+    )
+    user_ids = dict(
+        db.session.query(User.username, User.id).filter(
+            User.username.in_([user["username"] for user in users])
+        )
+    )
+    links = [
+        {"user_id": user_ids[user["username"]], "qualification_id": q_id}
+        for user in users
+        for q_id in sorted({qualifications[ref] for ref in user["qualifications"]})
+    ]
+    if links:
+        table = User.qualifications.property.secondary
+        db.session.execute(table.insert(), links)
+    bump_versions("users")
+    db.session.commit()
+    report.created += len(users)
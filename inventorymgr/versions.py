@@ -0,0 +1,124 @@
+"""
+Collection and row versions for conditional requests.
+
+Each API collection has a version counter in the collection_version table.
+Views that change a collection call bump_versions() before committing, so the
+counter changes in the same transaction as the rows.
+
+Stock moves change items far more often than anything else. Checkouts and
+check-ins bump the separate items_stock counter, once per transaction, and
+leave the items counter to creating, editing and deleting items. The items
+collection is versioned by both counters.
+
+Collection views decorated with versioned() send a strong ETag derived from
+the counters and the query string. If a client sends a matching
+If-None-Match header, a 304 response is returned after a single lookup of the
+counters, without querying or serializing the collection itself.
+
+Items, borrow states and users also carry a version column, which SQLAlchemy
+increments on every update and checks in the update's WHERE clause. Views of
+a single object send that version as ETag. PUT views require If-Match and
+answer 428 without it, so a client cannot overwrite changes it never saw. They
+answer 409 if the object changed since the client read it, a concurrent
+update that slips in between is detected by SQLAlchemy and answered with 409
+as well.
+
+bump_versions()
+    Increment the version counters of collections.
+
+get_versions()
+    Return the current version counters of collections.
+
+versioned()
+    Decorate a collection view with ETag and If-None-Match handling.
+
+check_if_match()
+    Raise an API error if If-Match is missing or does not match an object's
+    version.
+
+with_etag()
+    Return a response with an object's version as ETag.
+"""
+
+import functools
+import hashlib
+from typing import Any, Callable, Dict
+
+from flask import Response, make_response, request
+
+from .api import APIError, version_conflict
+from .db import db
+from .db.models import COLLECTION_NAMES, CollectionVersion
+
+
+def bump_versions(*names: str) -> None:
+    """Increment the version counters of collections in the current transaction."""
+    assert set(names) <= set(COLLECTION_NAMES)
+    result = db.session.execute(
+        CollectionVersion.__table__.update()
+        .where(CollectionVersion.name.in_(names))
+        .values(version=CollectionVersion.version + 1)
+    )
+    if result.rowcount < len(names):
+        existing = {
+            name
+            for name, in db.session.query(CollectionVersion.name).filter(
+                CollectionVersion.name.in_(names)
+            )
+        }
+        for name in set(names) - existing:
+            db.session.add(CollectionVersion(name=name, version=1))
+
+
+def get_versions(*names: str) -> Dict[str, int]:
+    """Return the version counters of collections, 0 if never bumped."""
+    versions = dict(
+        db.session.query(CollectionVersion.name, CollectionVersion.version).filter(
+            CollectionVersion.name.in_(names)
+        )
+    )
+    return {name: versions.get(name, 0) for name in names}
+
+
+def versioned(*names: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Wrap a collection view with ETag and If-None-Match handling."""
+
+    def outer(to_be_wrapped: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(to_be_wrapped)
+        def inner(*args: Any, **kwargs: Any) -> Any:
+            versions = get_versions(*names)
+            etag = "-".join(f"{name}{versions[name]}" for name in names)
+            if request.query_string:
+                etag += "-" + hashlib.sha1(request.query_string).hexdigest()[:16]
+
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(to_be_wrapped(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+            return response
+
+        return inner
+
+    return outer
+
+
+def check_if_match(obj: Any) -> None:
+    """
+    Raise a 428 API error if the request has no If-Match header, or a 409 API
+    error if it excludes obj's version.
+    """
+    if not request.if_match:
+        raise APIError(reason="precondition_required", status_code=428)
+    if not request.if_match.contains(str(obj.version)):
+        raise version_conflict()
+
+
+def with_etag(data: Any, obj: Any) -> Response:
+    """Return a response for data with the version of obj as ETag."""
+    response = make_response(data)
+    response.set_etag(str(obj.version))
+    return response
@@ -1,8 +1,10 @@
 import datetime
 import os
+import shutil
 import tempfile
 
 import pytest
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash
 
 from inventorymgr import create_app
@@ -21,9 +23,14 @@ from inventorymgr.db.models import (
 @pytest.fixture
 def app():
     db_fd, db_path = tempfile.mkstemp()
+    archive_path = tempfile.mkdtemp()
 
     app = create_app(
-        {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///{}".format(db_path),}
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///{}".format(db_path),
+            "LOGS_ARCHIVE_DIR": archive_path,
+        }
     )
 
     with app.app_context():
@@ -68,6 +75,7 @@ def app():
             BorrowState(
                 borrowing_user_id=1,
                 borrowed_item_id=1,
+                quantity=1,
                 received_at=datetime.datetime(2020, 1, 2, 12, 34, 56),
             )
         )
@@ -75,6 +83,7 @@ def app():
             BorrowState(
                 borrowing_user_id=1,
                 borrowed_item_id=3,
+                quantity=1,
                 received_at=datetime.datetime(2020, 1, 2, 12, 34, 57),
             )
         )
@@ -98,6 +107,7 @@ def app():
 
     os.close(db_fd)
     os.unlink(db_path)
+    shutil.rmtree(archive_path)
 
 
 @pytest.fixture
@@ -122,3 +132,20 @@ class AuthenticationManager:
 @pytest.fixture
 def auth(client):
     return AuthenticationManager(client)
+
+
+@pytest.fixture
+def count_statements(app):
+    class StatementCounter:
+        def __init__(self):
+            self.statements = []
+
+        def __call__(self, conn, cursor, statement, *args):
+            self.statements.append(statement)
+
+    counter = StatementCounter()
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", counter)
+    yield counter
+    with app.app_context():
+        event.remove(db.engine, "before_cursor_execute", counter)
@@ -60,3 +60,21 @@ def test_logout_when_logged_in(client):
 
     cookies = {cookie.name: cookie.value for cookie in client.cookie_jar}
     assert cookies.get("is_authenticated") is None
+
+
+def test_session_user_loaded_once_per_request(client, auth, count_statements):
+    auth.login("test")
+    count_statements.statements.clear()
+    response = client.get("/api/v1/users/me")
+    assert response.status_code == 200
+    assert response.json["qualifications"] == [{"id": 1, "name": "Driver's License"}]
+    assert len(count_statements.statements) == 1
+
+
+def test_permission_check_reuses_session_user(client, auth, count_statements):
+    auth.login("test")
+    count_statements.statements.clear()
+    response = client.get("/api/v1/registration/tokens")
+    assert response.status_code == 200
+    user_queries = [s for s in count_statements.statements if "FROM user" in s]
+    assert len(user_queries) == 1
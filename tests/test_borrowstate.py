@@ -1,8 +1,19 @@
+import concurrent.futures
 import datetime
 
 import pytest
+from sqlalchemy import event
 
-from inventorymgr.db.models import BorrowState, LogEntry
+from inventorymgr.db import db
+from inventorymgr.db.models import (
+    BorrowableItem,
+    BorrowState,
+    ItemOpenBorrows,
+    LogEntry,
+    Qualification,
+    TransferRequest,
+    UserOpenBorrows,
+)
 
 
 def test_fetch_borrowstates_unauthenticated(client):
@@ -194,3 +205,381 @@ def test_checkin_successful(client, auth, checkin_request, app, monkeypatch):
         assert logentry.timestamp == datetime.datetime(2020, 1, 6, 13, 37, 42)
         assert logentry.subject_id == 1
         assert logentry.items == [borrowstate.borrowed_item]
+
+
+def test_checkout_query_count_independent_of_cart_size(
+    client, auth, app, count_statements
+):
+    with app.app_context():
+        for i in range(6):
+            db.session.add(
+                BorrowableItem(
+                    name=f"bulk_item_{i}",
+                    quantity_total=10,
+                    quantity_in_stock=10,
+                    required_qualifications=[Qualification.query.get(1)],
+                )
+            )
+        db.session.commit()
+        item_ids = [
+            item.id
+            for item in BorrowableItem.query.filter(
+                BorrowableItem.name.like("bulk_item_%")
+            )
+        ]
+
+    auth.login("test")
+
+    def checkout(ids):
+        count_statements.statements.clear()
+        response = client.post(
+            "/api/v1/borrowstates/checkout",
+            json={
+                "borrowing_user_id": 1,
+                "borrowed_item_ids": [{"id": i, "count": 1} for i in ids],
+            },
+        )
+        assert response.status_code == 200
+        return list(count_statements.statements)
+
+    small_cart = checkout(item_ids[:1])
+    large_cart = checkout(item_ids[1:])
+
+    def without_borrowstate_inserts(statements):
+        # The ORM needs one INSERT per borrow state to learn its primary key.
+        return [s for s in statements if not s.startswith("INSERT INTO borrow_state")]
+
+    assert len(without_borrowstate_inserts(small_cart)) == len(
+        without_borrowstate_inserts(large_cart)
+    )
+    assert len(large_cart) - len(small_cart) == len(item_ids[1:]) - 1
+
+
+@pytest.fixture
+def shared_item(app):
+    with app.app_context():
+        shared = BorrowableItem(
+            name="shared_item", quantity_total=10, quantity_in_stock=5
+        )
+        spare = BorrowableItem(name="spare_item", quantity_total=1, quantity_in_stock=1)
+        db.session.add_all([shared, spare])
+        db.session.flush()
+        received_at = datetime.datetime(2020, 1, 3)
+        db.session.add_all(
+            [
+                BorrowState(
+                    borrowing_user_id=1,
+                    borrowed_item_id=shared.id,
+                    quantity=2,
+                    received_at=received_at,
+                ),
+                BorrowState(
+                    borrowing_user_id=2,
+                    borrowed_item_id=shared.id,
+                    quantity=3,
+                    received_at=received_at,
+                ),
+            ]
+        )
+        db.session.commit()
+        return shared.id, spare.id
+
+
+def test_checkin_matches_quantities_across_borrowers(client, auth, app, shared_item):
+    shared_id, spare_id = shared_item
+    auth.login("test")
+    response = client.post(
+        "/api/v1/borrowstates/checkin",
+        json={
+            "user_id": 2,
+            "item_ids": [
+                {"id": shared_id, "count": 2},
+                {"id": shared_id, "count": 3},
+                {"id": spare_id, "count": 1},
+            ],
+        },
+    )
+    assert response.status_code == 200
+    returned = response.json["borrowstates"]
+    assert [bs["borrowing_user"]["id"] for bs in returned] == [1, 2]
+    assert [bs["quantity"] for bs in returned] == [2, 1]
+
+    with app.app_context():
+        shared = BorrowableItem.query.get(shared_id)
+        assert shared.quantity_in_stock == 10
+        assert shared.unmatched_returns == 0
+        assert all(bs.returned_at is not None for bs in shared.borrowstates)
+        spare = BorrowableItem.query.get(spare_id)
+        assert spare.quantity_in_stock == 2
+        assert spare.unmatched_returns == 1
+
+
+def test_checkin_matches_returning_users_borrowstates(client, auth, app, shared_item):
+    shared_id, _ = shared_item
+    auth.login("test")
+    response = client.post(
+        "/api/v1/borrowstates/checkin",
+        json={"user_id": 2, "item_ids": [{"id": shared_id, "count": 1}]},
+    )
+    assert response.status_code == 200
+    assert response.json["borrowstates"] == []
+
+    with app.app_context():
+        open_quantities = {
+            bs.borrowing_user_id: bs.quantity
+            for bs in BorrowState.query.filter_by(borrowed_item_id=shared_id)
+        }
+        assert open_quantities == {1: 2, 2: 2}
+        assert BorrowableItem.query.get(shared_id).open_borrows.open_quantity == 4
+
+
+def test_checkin_nonexistent_item(client, auth):
+    auth.login("test")
+    response = client.post(
+        "/api/v1/borrowstates/checkin",
+        json={"user_id": 1, "item_ids": [{"id": 42, "count": 1}]},
+    )
+    assert response.status_code == 400
+    assert response.is_json
+    assert response.json["reason"] == "nonexistent_item"
+
+
+def test_checkin_query_count_independent_of_cart_size(
+    client, auth, app, count_statements
+):
+    with app.app_context():
+        for i in range(6):
+            item = BorrowableItem(
+                name=f"bulk_item_{i}", quantity_total=1, quantity_in_stock=0
+            )
+            db.session.add(item)
+            db.session.add(
+                BorrowState(
+                    borrowing_user_id=2,
+                    borrowed_item=item,
+                    quantity=1,
+                    received_at=datetime.datetime(2020, 1, 3),
+                )
+            )
+        db.session.commit()
+        item_ids = [
+            item.id
+            for item in BorrowableItem.query.filter(
+                BorrowableItem.name.like("bulk_item_%")
+            )
+        ]
+
+    auth.login("test")
+
+    def checkin(ids):
+        count_statements.statements.clear()
+        response = client.post(
+            "/api/v1/borrowstates/checkin",
+            json={"user_id": 2, "item_ids": [{"id": i, "count": 1} for i in ids]},
+        )
+        assert response.status_code == 200
+        assert len(response.json["borrowstates"]) == len(ids)
+        return list(count_statements.statements)
+
+    assert len(checkin(item_ids[:1])) == len(checkin(item_ids[1:]))
+
+
+def test_checkout_rejects_duplicate_items_exceeding_stock(client, auth, app):
+    auth.login("test")
+    response = client.post(
+        "/api/v1/borrowstates/checkout",
+        json={
+            "borrowing_user_id": 1,
+            "borrowed_item_ids": [{"id": 4, "count": 1}, {"id": 4, "count": 1}],
+        },
+    )
+    assert response.status_code == 400
+    assert response.json["reason"] == "already_borrowed"
+    with app.app_context():
+        assert BorrowableItem.query.get(4).quantity_in_stock == 1
+
+
+def test_checkout_loses_race_for_last_unit(client, auth, app):
+    raced = []
+
+    def take_last_unit(conn, cursor, statement, *args):
+        if statement.startswith("UPDATE borrowable_item") and not raced:
+            raced.append(statement)
+            with db.engine.connect() as other:
+                other.execute("UPDATE borrowable_item SET quantity_in_stock = 0")
+
+    auth.login("test")
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", take_last_unit)
+    try:
+        response = client.post(
+            "/api/v1/borrowstates/checkout",
+            json={"borrowing_user_id": 1, "borrowed_item_ids": [{"id": 4, "count": 1}]},
+        )
+    finally:
+        with app.app_context():
+            event.remove(db.engine, "before_cursor_execute", take_last_unit)
+
+    assert response.status_code == 400
+    assert response.json == {
+        "reason": "already_borrowed",
+        "items": [{"id": 4, "count": 0}],
+    }
+    with app.app_context():
+        assert BorrowableItem.query.get(4).quantity_in_stock == 0
+        assert BorrowState.query.filter_by(borrowed_item_id=4).count() == 0
+
+
+def test_checkout_reserves_stock_returned_after_lost_race(client, auth, app):
+    writes = []
+
+    def race(conn, cursor, statement, *args):
+        if statement.startswith("UPDATE borrowable_item") and not writes:
+            writes.append("UPDATE borrowable_item SET quantity_in_stock = 0")
+        elif statement.startswith("SELECT borrowable_item") and len(writes) == 1:
+            writes.append("UPDATE borrowable_item SET quantity_in_stock = 1")
+        else:
+            return
+        with db.engine.connect() as other:
+            other.execute(writes[-1])
+
+    auth.login("test")
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", race)
+    try:
+        response = client.post(
+            "/api/v1/borrowstates/checkout",
+            json={"borrowing_user_id": 1, "borrowed_item_ids": [{"id": 4, "count": 1}]},
+        )
+    finally:
+        with app.app_context():
+            event.remove(db.engine, "before_cursor_execute", race)
+
+    assert len(writes) == 2
+    assert response.status_code == 200
+    with app.app_context():
+        assert BorrowableItem.query.get(4).quantity_in_stock == 0
+        assert BorrowState.query.filter_by(borrowed_item_id=4).count() == 1
+
+
+def test_concurrent_checkouts_do_not_oversell(app):
+    with app.app_context():
+        db.session.add(
+            BorrowableItem(name="contended", quantity_total=20, quantity_in_stock=20)
+        )
+        db.session.commit()
+        item_id = BorrowableItem.query.filter_by(name="contended").one().id
+
+    def desk(attempts):
+        client = app.test_client()
+        client.post("/api/v1/auth/login", json={"username": "test", "password": "test"})
+        statuses = []
+        for _ in range(attempts):
+            response = client.post(
+                "/api/v1/borrowstates/checkout",
+                json={
+                    "borrowing_user_id": 1,
+                    "borrowed_item_ids": [{"id": item_id, "count": 1}],
+                },
+            )
+            statuses.append(response.status_code)
+        return statuses
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = [s for result in pool.map(desk, [5] * 8) for s in result]
+
+    assert statuses.count(200) == 20
+    assert statuses.count(400) == 20
+    with app.app_context():
+        assert BorrowableItem.query.get(item_id).quantity_in_stock == 0
+        borrowed = BorrowState.query.filter_by(borrowed_item_id=item_id).all()
+        assert sum(bs.quantity for bs in borrowed) == 20
+
+
+def open_borrows(app, item_id):
+    with app.app_context():
+        row = ItemOpenBorrows.query.get(item_id)
+        return None if row is None else (row.open_quantity, row.borrower_count)
+
+
+def test_open_borrows_follow_checkout_and_checkin(client, auth, app, shared_item):
+    shared_id, spare_id = shared_item
+    assert open_borrows(app, shared_id) == (5, 2)
+    assert open_borrows(app, spare_id) is None
+    auth.login("test")
+
+    def post(endpoint, payload):
+        response = client.post(f"/api/v1/borrowstates/{endpoint}", json=payload)
+        assert response.status_code == 200
+
+    post(
+        "checkout",
+        {"borrowing_user_id": 1, "borrowed_item_ids": [{"id": shared_id, "count": 1}]},
+    )
+    post(
+        "checkout",
+        {"borrowing_user_id": 2, "borrowed_item_ids": [{"id": spare_id, "count": 1}]},
+    )
+    assert open_borrows(app, shared_id) == (6, 2)
+    assert open_borrows(app, spare_id) == (1, 1)
+
+    post("checkin", {"user_id": 2, "item_ids": [{"id": shared_id, "count": 1}]})
+    assert open_borrows(app, shared_id) == (5, 2)
+
+    post("checkin", {"user_id": 2, "item_ids": [{"id": shared_id, "count": 2}]})
+    assert open_borrows(app, shared_id) == (3, 1)
+
+    post("checkin", {"user_id": 1, "item_ids": [{"id": shared_id, "count": 3}]})
+    assert open_borrows(app, shared_id) == (0, 0)
+
+
+def test_open_borrows_follow_transfer_acceptance(client, auth, app, shared_item):
+    shared_id, _ = shared_item
+    with app.app_context():
+        borrow_state = BorrowState.query.filter_by(
+            borrowed_item_id=shared_id, borrowing_user_id=1
+        ).one()
+        transfer_request = TransferRequest(
+            issuing_user_id=1, target_user_id=2, borrowstate_id=borrow_state.id
+        )
+        db.session.add(transfer_request)
+        db.session.commit()
+        request_id = transfer_request.id
+
+    auth.login("min_permissions_user")
+    response = client.delete(
+        f"/api/v1/transferrequests/{request_id}", json={"action": "accept"}
+    )
+    assert response.status_code == 200
+    assert open_borrows(app, shared_id) == (5, 1)
+
+
+def test_deleting_item_deletes_open_borrows(client, auth, app, shared_item):
+    shared_id, _ = shared_item
+    auth.login("test")
+    assert client.delete(f"/api/v1/items/{shared_id}").status_code == 200
+    assert open_borrows(app, shared_id) is None
+
+
+def test_deleting_user_updates_open_borrows(client, auth, app, shared_item):
+    shared_id, _ = shared_item
+    auth.login("test")
+    assert client.delete("/api/v1/users/2").status_code == 200
+    assert open_borrows(app, shared_id) == (2, 1)
+    with app.app_context():
+        assert UserOpenBorrows.query.get(2) is None
+        assert UserOpenBorrows.query.get(1).item_count == 3
+
+
+def test_rebuild_aggregates_command(runner, app, shared_item):
+    shared_id, _ = shared_item
+    with app.app_context():
+        db.session.execute("DELETE FROM item_open_borrows")
+        db.session.execute(
+            "UPDATE borrow_state SET quantity = 4 WHERE borrowing_user_id = 2"
+        )
+        db.session.commit()
+
+    result = runner.invoke(args=["rebuild-aggregates"])
+    assert result.output == "Rebuilt open borrows of 3 items and 2 users.\n"
+    assert open_borrows(app, shared_id) == (6, 2)
@@ -0,0 +1,160 @@
+import threading
+
+from inventorymgr.changes import InProcessHub, get_change_hub, queue_change
+from inventorymgr.db import db
+
+
+def last_seq(client):
+    response = client.get("/api/v1/changes")
+    assert response.status_code == 200
+    assert response.json["changes"] == []
+    return response.json["last_seq"]
+
+
+def changes_since(client, since):
+    response = client.get(f"/api/v1/changes?since={since}&timeout=0")
+    assert response.status_code == 200
+    assert not response.json["reset"]
+    return [
+        {k: v for k, v in change.items() if k not in ("seq", "timestamp")}
+        for change in response.json["changes"]
+    ]
+
+
+def test_changes_unauthenticated(client):
+    response = client.get("/api/v1/changes?since=0")
+    assert response.status_code == 403
+    assert response.json["reason"] == "authentication_required"
+
+
+def test_changes_invalid_query(client, auth):
+    auth.login("test")
+    response = client.get("/api/v1/changes?since=-1")
+    assert response.status_code == 400
+
+
+def test_hub_wait_returns_changes_after_sequence_number():
+    hub = InProcessHub(3)
+    assert hub.wait(0, 0) == ([], 0)
+    assert hub.publish([{"type": "a"}, {"type": "b"}]) == 2
+    assert hub.wait(1, 0) == ([{"seq": 2, "type": "b"}], 2)
+    assert hub.wait(2, 0) == ([], 2)
+    assert hub.wait(3, 0) == (None, 2)
+
+    hub.publish([{"type": "c"}, {"type": "d"}])
+    assert hub.wait(0, 0) == (None, 4)
+    assert [change["seq"] for change in hub.wait(1, 0)[0]] == [2, 3, 4]
+
+
+def test_hub_wait_wakes_up_on_publish():
+    hub = InProcessHub(10)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(hub.wait(0, 10)))
+    waiter.start()
+    hub.publish([{"type": "a"}])
+    waiter.join(5)
+    assert results == [([{"seq": 1, "type": "a"}], 1)]
+
+
+def test_checkout_publishes_stock_and_log_changes(client, auth):
+    auth.login("test")
+    since = last_seq(client)
+    response = client.post(
+        "/api/v1/borrowstates/checkout",
+        json={"borrowing_user_id": 1, "borrowed_item_ids": [{"id": 4, "count": 1}]},
+    )
+    assert response.status_code == 200
+    assert changes_since(client, since) == [
+        {"type": "stock", "items": [{"id": 4, "delta": -1}]},
+        {
+            "type": "log",
+            "id": 2,
+            "action": "checkout",
+            "subject_id": 1,
+            "secondary_id": None,
+            "items": [4],
+        },
+    ]
+
+
+def test_failed_checkout_publishes_nothing(client, auth):
+    auth.login("test")
+    since = last_seq(client)
+    response = client.post(
+        "/api/v1/borrowstates/checkout",
+        json={"borrowing_user_id": 1, "borrowed_item_ids": [{"id": 4, "count": 5}]},
+    )
+    assert response.status_code == 400
+    assert changes_since(client, since) == []
+
+
+def test_checkin_publishes_stock_changes(client, auth):
+    auth.login("test")
+    since = last_seq(client)
+    response = client.post(
+        "/api/v1/borrowstates/checkin",
+        json={"user_id": 1, "item_ids": [{"id": 3, "count": 1}]},
+    )
+    assert response.status_code == 200
+    changes = changes_since(client, since)
+    assert changes[0] == {"type": "stock", "items": [{"id": 3, "delta": 1}]}
+    assert changes[1]["action"] == "checkin"
+
+
+def test_transfer_request_changes_are_sent_to_involved_users(client, auth, app):
+    auth.login("min_permissions_user")
+    since = last_seq(client)
+    response = client.delete("/api/v1/transferrequests/1", json={"action": "accept"})
+    assert response.status_code == 200
+    with app.app_context():
+        get_change_hub().publish(
+            [{"type": "transfer_request", "action": "created", "user_ids": [7, 8]}]
+        )
+
+    changes = changes_since(client, since)
+    assert [change["type"] for change in changes] == ["transfer_request", "log"]
+    assert changes[0] == {
+        "type": "transfer_request",
+        "action": "accepted",
+        "id": 1,
+        "borrowstate_id": 2,
+        "user_ids": [1, 2],
+    }
+
+
+def test_rolled_back_changes_are_not_published(app):
+    with app.app_context():
+        since = get_change_hub().last_seq()
+        queue_change("stock", items=[{"id": 1, "delta": -1}])
+        db.session.rollback()
+        db.session.commit()
+        assert get_change_hub().wait(since, 0) == ([], since)
+
+
+def test_changes_reset_on_unknown_sequence_number(client, auth):
+    auth.login("test")
+    response = client.get("/api/v1/changes?since=1000&timeout=0")
+    assert response.status_code == 200
+    assert response.json["reset"]
+    assert response.json["last_seq"] == last_seq(client)
+
+
+def test_changes_reset_on_other_epoch(client, auth):
+    auth.login("test")
+    response = client.get("/api/v1/changes")
+    epoch = response.json["epoch"]
+    since = response.json["last_seq"]
+
+    response = client.get(f"/api/v1/changes?since={since}&epoch={epoch}&timeout=0")
+    assert not response.json["reset"]
+    response = client.get(f"/api/v1/changes?since={since}&epoch=other&timeout=0")
+    assert response.json == {
+        "changes": [],
+        "last_seq": since,
+        "epoch": epoch,
+        "reset": True,
+    }
+
+
+def test_hubs_have_distinct_epochs():
+    assert InProcessHub(1).epoch != InProcessHub(1).epoch
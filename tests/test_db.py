@@ -1,4 +1,10 @@
+import logging
+
+import pytest
+
+from inventorymgr import create_app
 from inventorymgr.db import db
+from inventorymgr.db.sqlite import connection_settings
 
 
 def test_init_db_command(runner, monkeypatch):
@@ -14,3 +20,75 @@ def test_init_db_command(runner, monkeypatch):
     result = runner.invoke(args=["init-db"])
     assert "Initialized" in result.output
     assert Recorder.called
+
+
+def test_create_indexes_command(runner, app):
+    with app.app_context():
+        db.session.execute("DROP INDEX ix_borrow_state_open_item_user")
+        db.session.execute("DROP INDEX ix_transfer_request_borrowstate_id")
+        db.session.commit()
+
+    result = runner.invoke(args=["create-indexes"])
+    assert "Created index ix_borrow_state_open_item_user." in result.output
+    assert "Created index ix_transfer_request_borrowstate_id." in result.output
+
+    result = runner.invoke(args=["create-indexes"])
+    assert result.output == "Indexes are up to date.\n"
+
+
+def test_open_borrowstates_use_partial_index(app):
+    with app.app_context():
+        plan = db.session.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM borrow_state "
+            "WHERE borrowed_item_id IN (1, 3) AND returned_at IS NULL"
+        ).fetchall()
+    plan = " ".join(row[-1] for row in plan)
+    assert (
+        "ix_borrow_state_open_item_user" in plan
+        or "ix_borrow_state_open_item_received_at" in plan
+    )
+
+
+def sqlite_settings(app):
+    with app.app_context():
+        connection = db.engine.raw_connection()
+        try:
+            return connection_settings(connection)
+        finally:
+            connection.close()
+
+
+def test_sqlite_default_settings(app):
+    settings = sqlite_settings(app)
+    assert settings["foreign_keys"] == "1"
+    assert settings["journal_mode"] == "wal"
+    assert settings["busy_timeout"] == "5000"
+    assert settings["synchronous"] == "1"
+    assert settings["temp_store"] == "2"
+
+
+def test_sqlite_settings_overrides(tmp_path, caplog):
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'db.sqlite'}",
+            "SQLITE_SYNCHRONOUS": "FULL",
+            "SQLITE_JOURNAL_MODE": None,
+        }
+    )
+    caplog.set_level(logging.INFO)
+    settings = sqlite_settings(app)
+    assert settings["synchronous"] == "2"
+    assert settings["journal_mode"] == "delete"
+    assert "SQLite settings: foreign_keys=1, busy_timeout=5000" in caplog.text
+
+
+def test_sqlite_settings_reject_invalid_values():
+    with pytest.raises(ValueError):
+        create_app({"SQLITE_JOURNAL_MODE": "WAL; DROP TABLE user"})
+
+
+def test_sqlite_settings_in_memory():
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    settings = sqlite_settings(app)
+    assert settings["journal_mode"] == "memory"
+    assert settings["mmap_size"] == ""
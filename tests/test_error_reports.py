@@ -0,0 +1,88 @@
+import datetime
+import time
+
+from inventorymgr.db.models import JavascriptError
+from inventorymgr.error_reports import ErrorReportQueue, get_error_report_queue
+
+FIREFOX = "Mozilla/5.0 (X11; Linux x86_64; rv:78.0) Gecko/20100101 Firefox/78.0"
+
+
+def report(message="TypeError: x is undefined"):
+    return {
+        "location": "http://localhost/items",
+        "message": message,
+        "source": "http://localhost/static/app.js",
+        "lineno": 12,
+        "colno": 34,
+        "stack": None,
+    }
+
+
+def flush_error_reports(app):
+    with app.app_context():
+        return get_error_report_queue().flush(force=True)
+
+
+def test_error_reports_are_counted_and_written_in_batches(client, app):
+    for message in ("first", "second", "first", "first"):
+        response = client.post(
+            "/api/v1/errors/js", json=report(message), headers={"User-Agent": FIREFOX}
+        )
+        assert response.status_code == 202
+
+    with app.app_context():
+        assert JavascriptError.query.count() == 0
+    assert flush_error_reports(app) == 2
+    with app.app_context():
+        errors = JavascriptError.query.order_by(JavascriptError.id).all()
+        assert [(e.message, e.occurrences) for e in errors] == [
+            ("first", 3),
+            ("second", 1),
+        ]
+        assert (errors[0].browser, errors[0].platform) == ("firefox", "linux")
+
+
+def test_error_report_without_location(client):
+    response = client.post("/api/v1/errors/js", json={"message": "oops"})
+    assert response.status_code == 400
+
+
+def test_error_reports_are_rate_limited(client, app):
+    app.extensions["error_reports"].rate_limiter.limit = 2
+    statuses = [
+        client.post("/api/v1/errors/js", json=report(str(i))).status_code
+        for i in range(3)
+    ]
+    assert statuses == [202, 202, 429]
+    assert flush_error_reports(app) == 2
+
+
+def test_error_reports_are_written_once_their_window_passed(app):
+    now = [0.0]
+    queue = ErrorReportQueue(app, 10, 100, max_pending=2, clock=lambda: now[0])
+    # Flush from the test instead of a writer thread.
+    queue._writer = True
+    row = {"timestamp": datetime.datetime(2020, 1, 1), "user_agent_raw": ""}
+    for message in ("a", "b", "c", "a"):
+        assert queue.submit("client", {**row, **report(message)})
+    assert queue.dropped == 1
+
+    now[0] = 5
+    assert queue.flush() == 0
+    now[0] = 10
+    assert queue.flush() == 2
+    with app.app_context():
+        errors = JavascriptError.query.order_by(JavascriptError.id).all()
+        assert [(e.message, e.occurrences) for e in errors] == [("a", 2), ("b", 1)]
+
+
+def test_error_reports_are_written_by_background_thread(client, app):
+    app.extensions["error_reports"].window = 0.05
+    response = client.post("/api/v1/errors/js", json=report())
+    assert response.status_code == 202
+
+    deadline = time.monotonic() + 5
+    with app.app_context():
+        while not JavascriptError.query.count() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert JavascriptError.query.count() == 1
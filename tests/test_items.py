@@ -164,6 +164,7 @@ def test_update_item_unknown_qualification(client, auth, app):
             "name": "new_item_name",
             "required_qualifications": [{"id": 2, "name": "unknown_qualification"}],
         },
+        headers={"If-Match": '"1"'},
     )
     assert response.status_code == 400
     assert response.is_json
@@ -175,6 +176,7 @@ def test_update_item_to_existing_name(client, auth):
     response = client.put(
         "/api/v1/items/2",
         json={"id": 2, "name": "existing_item", "required_qualifications": []},
+        headers={"If-Match": '"1"'},
     )
     assert response.status_code == 400
     assert response.is_json
@@ -188,6 +190,7 @@ def test_update_item_success(client, auth, app):
     response = client.put(
         "/api/v1/items/1",
         json={"id": 1, "name": "new_item_name", "required_qualifications": []},
+        headers={"If-Match": '"1"'},
     )
     assert response.status_code == 200
     assert response.is_json
@@ -257,3 +260,155 @@ def test_get_item_success(client, auth):
     assert response.is_json
     assert response.json["id"] == 1
     assert response.json["name"] == "existing_item"
+
+
+def test_list_items_selected_fields(client, auth, count_statements):
+    auth.login("min_permissions_user")
+    count_statements.statements.clear()
+    response = client.get("/api/v1/items?fields=name,barcode,quantity_in_stock")
+    assert response.status_code == 200
+    assert response.json["items"][0] == {
+        "name": "existing_item",
+        "barcode": "0000000000001",
+        "quantity_in_stock": 1,
+    }
+    item_queries = [s for s in count_statements.statements if "borrowable_item" in s]
+    assert len(item_queries) == 1
+    assert "description" not in item_queries[0]
+
+
+def test_list_items_all_fields(client, auth):
+    auth.login("min_permissions_user")
+    response = client.get("/api/v1/items")
+    assert response.status_code == 200
+    assert response.json["items"][0] == {
+        "id": 1,
+        "name": "existing_item",
+        "barcode": "0000000000001",
+        "quantity_total": 1,
+        "quantity_in_stock": 1,
+        "unmatched_returns": 0,
+        "description": None,
+        "required_qualifications": [{"id": 1, "name": "Driver's License"}],
+    }
+    assert response.json["items"][2]["required_qualifications"] == []
+
+
+def test_list_items_unknown_fields(client, auth):
+    auth.login("min_permissions_user")
+    response = client.get("/api/v1/items?fields=id,password")
+    assert response.status_code == 400
+    assert response.is_json
+    assert response.json["reason"] == "unknown_fields"
+
+
+def test_import_items_insufficient_permissions(client, auth):
+    auth.login("min_permissions_user")
+    response = client.post("/api/v1/items/import", data='{"name": "new_item"}\n')
+    assert response.status_code == 403
+    assert response.json["reason"] == "insufficient_permissions"
+
+
+def test_import_items_ndjson(client, auth, app):
+    auth.login("test")
+    lines = [
+        '{"name": "new_item", "quantity_total": 3,'
+        ' "required_qualifications": ["Driver\'s License"]}',
+        '{"name": "existing_item", "quantity_total": 4, "description": "updated",'
+        ' "required_qualifications": []}',
+        '{"name": "bad_item", "quantity_total": -1}',
+        "not json",
+        '{"name": "new_item"}',
+        '{"name": "unqualified_item", "required_qualifications": [1, "unknown"]}',
+    ]
+    response = client.post(
+        "/api/v1/items/import?batch_size=2", data="\n".join(lines) + "\n"
+    )
+    assert response.status_code == 200
+    report = response.json
+    assert (report["created"], report["updated"], report["failed"]) == (1, 1, 4)
+    assert [error["row"] for error in report["errors"]] == [3, 4, 5, 6]
+    assert "quantity_total" in report["errors"][0]["errors"]
+    assert "required_qualifications" in report["errors"][3]["errors"]
+    assert report["rows_per_second"] >= 0
+
+    with app.app_context():
+        new_item = BorrowableItem.query.filter_by(name="new_item").one()
+        assert new_item.quantity_in_stock == 3
+        assert [q.name for q in new_item.required_qualifications] == [
+            "Driver's License"
+        ]
+        existing_item = BorrowableItem.query.filter_by(name="existing_item").one()
+        assert existing_item.description == "updated"
+        assert existing_item.quantity_total == 4
+        # Stock follows the change of quantity_total from 1 to 4.
+        assert existing_item.quantity_in_stock == 4
+        assert existing_item.version == 2
+        assert existing_item.required_qualifications == []
+        assert BorrowableItem.query.filter_by(name="unqualified_item").count() == 0
+
+
+def test_import_items_keeps_checked_out_quantity(client, auth, app):
+    auth.login("test")
+    response = client.post(
+        "/api/v1/borrowstates/checkout",
+        json={"borrowing_user_id": 1, "borrowed_item_ids": [{"id": 4, "count": 1}]},
+    )
+    assert response.status_code == 200
+    lines = [
+        '{"name": "available_noq", "quantity_total": 0, "description": "lost"}',
+        '{"name": "borrowed_noq", "quantity_total": 3}',
+    ]
+    response = client.post("/api/v1/items/import", data="\n".join(lines) + "\n")
+    assert response.status_code == 200
+    report = response.json
+    assert (report["created"], report["updated"], report["failed"]) == (0, 1, 1)
+    assert report["errors"][0]["row"] == 1
+    assert "quantity_total" in report["errors"][0]["errors"]
+
+    with app.app_context():
+        item = BorrowableItem.query.get(4)
+        assert (item.quantity_total, item.quantity_in_stock) == (1, 0)
+        assert item.description != "lost"
+        assert BorrowableItem.query.get(3).quantity_total == 3
+
+
+def test_import_items_csv_resolves_qualifications_once(
+    client, auth, app, count_statements
+):
+    auth.login("test")
+    csv_data = (
+        "name,quantity_total,required_qualifications\n"
+        "item_a,2,Driver's License\n"
+        "item_b,,1\n"
+        "another_item,5,\n"
+    )
+    before = len(count_statements.statements)
+    response = client.post(
+        "/api/v1/items/import", data=csv_data, content_type="text/csv"
+    )
+    assert response.status_code == 200
+    assert (response.json["created"], response.json["updated"]) == (2, 1)
+    statements = count_statements.statements[before:]
+    assert sum("FROM qualification" in s for s in statements) == 1
+
+    with app.app_context():
+        item_b = BorrowableItem.query.filter_by(name="item_b").one()
+        assert item_b.quantity_total == 1
+        assert [q.id for q in item_b.required_qualifications] == [1]
+        another_item = BorrowableItem.query.filter_by(name="another_item").one()
+        assert another_item.quantity_total == 5
+        assert len(another_item.required_qualifications) == 1
+
+
+def test_import_items_command(runner, app, tmp_path):
+    source = tmp_path / "items.csv"
+    source.write_text("name,description\ncli_item,imported\n,missing name\n")
+    result = runner.invoke(args=["import-items", "--batch-size", "1", str(source)])
+    assert result.exit_code == 0
+    assert "Row 3:" in result.output
+    assert "Created 1, updated 0, failed 1 items" in result.output
+
+    with app.app_context():
+        item = BorrowableItem.query.filter_by(name="cli_item").one()
+        assert item.description == "imported"
@@ -0,0 +1,78 @@
+import datetime
+
+import pytest
+
+from inventorymgr.db import db
+from inventorymgr.db.models import (
+    BorrowableItem,
+    BorrowState,
+    LogEntry,
+    Qualification,
+    TransferRequest,
+    User,
+)
+
+
+def add_rows(prefix, count):
+    qualification = Qualification.query.get(1)
+    for i in range(count):
+        user = User(
+            username=f"{prefix}_user_{i}",
+            password="unused",
+            qualifications=[qualification],
+        )
+        item = BorrowableItem(
+            name=f"{prefix}_item_{i}", required_qualifications=[qualification]
+        )
+        borrow_state = BorrowState(
+            borrowing_user=user,
+            borrowed_item=item,
+            quantity=1,
+            received_at=datetime.datetime(2020, 3, 1),
+        )
+        db.session.add_all(
+            [
+                user,
+                item,
+                borrow_state,
+                LogEntry(
+                    timestamp=datetime.datetime(2020, 3, 1),
+                    action="checkout",
+                    subject=user,
+                    items=[item],
+                ),
+                TransferRequest(
+                    issuing_user=user, target_user_id=1, borrowstate=borrow_state
+                ),
+            ]
+        )
+    db.session.commit()
+
+
+@pytest.mark.parametrize(
+    "endpoint,key",
+    [
+        ("/api/v1/items", "items"),
+        ("/api/v1/users", "users"),
+        ("/api/v1/borrowstates", "borrowstates"),
+        ("/api/v1/transferrequests", "transferrequests"),
+        ("/api/v1/logs", "logs"),
+    ],
+)
+def test_list_endpoint_query_count_is_constant(
+    client, auth, app, count_statements, endpoint, key
+):
+    auth.login("test")
+
+    def count_queries(prefix, added_rows):
+        with app.app_context():
+            add_rows(prefix, added_rows)
+        count_statements.statements.clear()
+        response = client.get(endpoint)
+        assert response.status_code == 200
+        return len(response.json[key]), len(count_statements.statements)
+
+    few_rows, few_queries = count_queries("few", 1)
+    many_rows, many_queries = count_queries("many", 10)
+    assert many_rows > few_rows
+    assert many_queries == few_queries
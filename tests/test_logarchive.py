@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+from inventorymgr.db import logarchive
+from inventorymgr.db.logarchive import (
+    ArchivedItem,
+    ArchivedLog,
+    LogArchive,
+    read_segment,
+    read_segment_footer,
+    write_segment,
+)
+
+
+def entries(count, start=datetime.datetime(2020, 1, 1)):
+    return [
+        ArchivedLog(
+            id=i + 1,
+            timestamp=start + datetime.timedelta(hours=i),
+            action="checkin" if i % 2 else "checkout",
+            subject_id=i % 3 + 1,
+            secondary_id=None if i % 4 else 7,
+            items=[ArchivedItem(item_id) for item_id in range(i % 3)],
+        )
+        for i in range(count)
+    ]
+
+
+def test_segment_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(logarchive, "GROUP_ROWS", 4)
+    path = str(tmp_path / "a.logseg")
+    written = entries(10)
+    segment = write_segment(path, reversed(written))
+    assert len(segment.groups) == 3
+    assert read_segment_footer(path) == segment
+    assert list(read_segment(segment)) == written
+    assert list(read_segment(segment, newest_first=True)) == written[::-1]
+
+
+def test_segment_reads_only_groups_in_time_range(tmp_path, monkeypatch):
+    monkeypatch.setattr(logarchive, "GROUP_ROWS", 4)
+    written = entries(12)
+    segment = write_segment(str(tmp_path / "a.logseg"), written)
+    decompressed = []
+    decompress = logarchive.zlib.decompress
+    monkeypatch.setattr(
+        logarchive.zlib,
+        "decompress",
+        lambda data: decompressed.append(len(data)) or decompress(data),
+    )
+
+    found = list(read_segment(segment, written[5].timestamp, written[7].timestamp))
+    assert found == written[5:7]
+    assert len(decompressed) == 7  # one chunk per column of a single group
+
+
+def test_invalid_segment(tmp_path):
+    path = tmp_path / "a.logseg"
+    path.write_bytes(b"not a segment, just some bytes")
+    with pytest.raises(ValueError):
+        read_segment_footer(str(path))
+
+
+def test_log_archive_merges_segments_and_skips_duplicates(tmp_path):
+    archive = LogArchive(str(tmp_path / "archive"))
+    assert archive.segments() == []
+    assert archive.newest() is None
+
+    written = entries(6)
+    archive.append(written[::2])
+    archive.append(written[1::2])
+    archive.append(written[4:5])
+    assert len(archive.segments()) == 3
+    assert archive.newest() == written[-1].timestamp
+
+    assert list(archive.entries({})) == written
+    assert list(archive.entries({"action": "checkin", "item_id": 1})) == [written[5]]
+    before = (written[3].timestamp, written[3].id)
+    newest_first = archive.entries({}, before=before, newest_first=True)
+    assert list(newest_first) == written[2::-1]
@@ -1,5 +1,11 @@
+import datetime
+import json
+
+import pytest
+
 from inventorymgr.db import db
 from inventorymgr.db.models import BorrowableItem, LogEntry, User
+from inventorymgr.db.retention import compact
 
 
 def test_get_logs_unathenticated(client):
@@ -32,3 +38,180 @@ def test_delete_user_deletes_logs(app):
         db.session.delete(User.query.get(1))
         db.session.commit()
         assert LogEntry.query.count() == 0
+
+
+@pytest.fixture
+def many_logs(app):
+    with app.app_context():
+        item = BorrowableItem.query.get(2)
+        for day in range(1, 6):
+            db.session.add(
+                LogEntry(
+                    timestamp=datetime.datetime(2020, 2, day),
+                    action="checkin" if day % 2 else "checkout",
+                    subject_id=2,
+                    items=[item],
+                )
+            )
+        db.session.commit()
+
+
+def test_get_logs_paginated(client, auth, many_logs):
+    auth.login("min_permissions_user")
+    response = client.get("/api/v1/logs?limit=4")
+    assert response.status_code == 200
+    first_page = response.json["logs"]
+    assert [log["timestamp"][:10] for log in first_page] == [
+        "2020-02-05",
+        "2020-02-04",
+        "2020-02-03",
+        "2020-02-02",
+    ]
+    cursor = response.json["next_cursor"]
+    assert cursor is not None
+
+    response = client.get(f"/api/v1/logs?limit=4&cursor={cursor}")
+    assert response.status_code == 200
+    assert [log["id"] for log in response.json["logs"]] == [2, 1]
+    assert response.json["next_cursor"] is None
+
+
+def test_get_logs_filtered(client, auth, many_logs):
+    auth.login("min_permissions_user")
+    response = client.get("/api/v1/logs?action=checkin&item_id=2")
+    assert [log["timestamp"][:10] for log in response.json["logs"]] == [
+        "2020-02-05",
+        "2020-02-03",
+        "2020-02-01",
+    ]
+
+    response = client.get(
+        "/api/v1/logs?subject_id=2&since=2020-02-02T00:00:00&until=2020-02-04T00:00:00"
+    )
+    assert [log["timestamp"][:10] for log in response.json["logs"]] == [
+        "2020-02-03",
+        "2020-02-02",
+    ]
+
+    response = client.get("/api/v1/logs?item_id=1")
+    assert [log["id"] for log in response.json["logs"]] == [1]
+
+
+def test_get_logs_invalid_cursor(client, auth):
+    auth.login("min_permissions_user")
+    response = client.get("/api/v1/logs?cursor=not-a-cursor")
+    assert response.status_code == 400
+    assert response.is_json
+    assert response.json["reason"] == "invalid_cursor"
+
+
+def test_get_logs_invalid_limit(client, auth):
+    auth.login("min_permissions_user")
+    response = client.get("/api/v1/logs?limit=0")
+    assert response.status_code == 400
+    assert response.is_json
+    assert response.json["reason"] == "validation_failed"
+
+
+def test_export_logs_unauthenticated(client):
+    response = client.get("/api/v1/logs/export")
+    assert response.status_code == 403
+    assert response.is_json
+    assert response.json["reason"] == "authentication_required"
+
+
+def test_export_logs_ndjson(client, auth, app, many_logs):
+    app.config["LOGS_EXPORT_BATCH_SIZE"] = 2
+    auth.login("min_permissions_user")
+    response = client.get("/api/v1/logs/export?since=2020-02-03T00:00:00")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [entry["timestamp"] for entry in lines] == [
+        "2020-02-03T00:00:00",
+        "2020-02-04T00:00:00",
+        "2020-02-05T00:00:00",
+    ]
+    assert lines[0] == {
+        "id": 4,
+        "timestamp": "2020-02-03T00:00:00",
+        "action": "checkin",
+        "subject_id": 2,
+        "secondary_id": None,
+        "items": [2],
+    }
+
+
+def test_export_logs_csv(client, auth):
+    auth.login("min_permissions_user")
+    response = client.get("/api/v1/logs/export?format=csv")
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert response.data.decode().splitlines() == [
+        "id,timestamp,action,subject_id,secondary_id,items",
+        "1,2020-01-02T12:34:56,checkout,1,,1",
+    ]
+
+
+def test_export_logs_command(runner, many_logs):
+    result = runner.invoke(
+        args=["export-logs", "--format", "csv", "--batch-size", "4"]
+    )
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[0] == "id,timestamp,action,subject_id,secondary_id,items"
+    assert [line.split(",")[0] for line in lines[1:]] == ["1", "2", "3", "4", "5", "6"]
+
+
+def all_log_pages(client, query):
+    logs, cursor = [], None
+    while True:
+        url = f"/api/v1/logs?{query}" + (f"&cursor={cursor}" if cursor else "")
+        response = client.get(url)
+        assert response.status_code == 200
+        logs.append([entry["id"] for entry in response.json["logs"]])
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            return logs
+
+
+def archive_logs_before(app, monkeypatch, cutoff):
+    monkeypatch.setattr(
+        "inventorymgr.db.retention._utcnow",
+        lambda: cutoff + datetime.timedelta(days=365),
+    )
+    app.config["RETENTION_LOGS_DAYS"] = 365
+    with app.app_context():
+        return compact()["logs"]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "limit=2",
+        "limit=10",
+        "action=checkin&item_id=2",
+        "limit=1&since=2020-02-02T00:00:00&until=2020-02-04T00:00:00",
+    ],
+)
+def test_get_logs_reads_archived_logs(client, auth, app, many_logs, monkeypatch, query):
+    auth.login("min_permissions_user")
+    expected = all_log_pages(client, query)
+    full = client.get("/api/v1/logs?limit=10").json["logs"]
+
+    assert archive_logs_before(app, monkeypatch, datetime.datetime(2020, 2, 3)) == 3
+    with app.app_context():
+        assert LogEntry.query.count() == 3
+
+    assert all_log_pages(client, query) == expected
+    assert client.get("/api/v1/logs?limit=10").json["logs"] == full
+
+
+def test_export_logs_reads_archived_logs(client, auth, app, many_logs, monkeypatch):
+    auth.login("min_permissions_user")
+    expected = client.get("/api/v1/logs/export").data
+    assert archive_logs_before(app, monkeypatch, datetime.datetime(2020, 2, 3)) == 3
+    assert client.get("/api/v1/logs/export").data == expected
+    response = client.get("/api/v1/logs/export?since=2020-02-02T00:00:00")
+    ids = [json.loads(line)["id"] for line in response.data.decode().splitlines()]
+    assert ids == [3, 4, 5, 6]
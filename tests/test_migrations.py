@@ -0,0 +1,221 @@
+import datetime
+
+from sqlalchemy import event, inspect
+
+from inventorymgr.db import db
+from inventorymgr.db.migrations import MIGRATIONS, rebuild_table
+from inventorymgr.db.models import (
+    BorrowState,
+    ItemOpenBorrows,
+    LogEntry,
+    SchemaMigration,
+    TransferRequest,
+    UserOpenBorrows,
+)
+
+
+def applied_versions(app):
+    with app.app_context():
+        return sorted(version for version, in db.session.query(SchemaMigration.version))
+
+
+def test_init_db_stamps_all_migrations(runner, app):
+    result = runner.invoke(args=["init-db"])
+    assert "Initialized" in result.output
+    assert applied_versions(app) == sorted(MIGRATIONS)
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert result.output == "Database is up to date.\n"
+
+
+def test_db_upgrade_brings_old_database_up_to_date(runner, app):
+    with app.app_context():
+        db.session.execute("DROP TABLE schema_migration")
+        db.session.execute("DROP TABLE collection_version")
+        db.session.execute("DROP INDEX ix_borrow_state_open_item_user")
+        db.session.commit()
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert result.exit_code == 0
+    assert "Applied migration 1:" in result.output
+    assert "Applied migration 2:" in result.output
+    assert applied_versions(app) == sorted(MIGRATIONS)
+
+    with app.app_context():
+        inspector = inspect(db.engine)
+        assert "collection_version" in inspector.get_table_names()
+        indexes = [index["name"] for index in inspector.get_indexes("borrow_state")]
+        assert "ix_borrow_state_open_item_user" in indexes
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert result.output == "Database is up to date.\n"
+
+
+def test_rebuild_table_keeps_rows_and_references(app):
+    with app.app_context():
+        db.session.execute("DROP INDEX ix_borrow_state_open_item_user")
+        db.session.commit()
+        expected = [(b.id, b.borrowed_item_id) for b in BorrowState.query.all()]
+
+        assert rebuild_table(BorrowState.__table__, batch_size=1) == len(expected)
+
+        assert [(b.id, b.borrowed_item_id) for b in BorrowState.query.all()] == expected
+        assert TransferRequest.query.count() == 2
+        indexes = [i["name"] for i in inspect(db.engine).get_indexes("borrow_state")]
+        assert "ix_borrow_state_open_item_user" in indexes
+
+
+def test_rebuild_table_mirrors_concurrent_writes(app):
+    with app.app_context():
+        for i in range(4):
+            db.session.add(
+                LogEntry(
+                    timestamp=datetime.datetime(2020, 2, 1, i),
+                    action="checkin",
+                    subject_id=1,
+                )
+            )
+        db.session.commit()
+
+        writes = iter(
+            [
+                "UPDATE log_entry SET action = 'transfer' WHERE id = 1",
+                "DELETE FROM log_entry WHERE id = 2",
+            ]
+        )
+
+        def write_between_batches(conn, cursor, statement, *args):
+            if statement.startswith("INSERT OR IGNORE INTO _rebuild_log_entry"):
+                cursor.execute(next(writes, "SELECT 1"))
+
+        event.listen(db.engine, "after_cursor_execute", write_between_batches)
+        try:
+            rebuild_table(LogEntry.__table__, batch_size=2)
+        finally:
+            event.remove(db.engine, "after_cursor_execute", write_between_batches)
+
+        entries = {e.id: e.action for e in LogEntry.query.all()}
+        assert entries == {
+            1: "transfer",
+            3: "checkin",
+            4: "checkin",
+            5: "checkin",
+        }
+
+
+def test_db_upgrade_adds_version_columns(runner, app):
+    with app.app_context():
+        db.session.execute("ALTER TABLE borrow_state DROP COLUMN version")
+        db.session.execute(
+            "INSERT INTO schema_migration (version, description, applied_at) "
+            "VALUES (1, '', '2020-01-01'), (2, '', '2020-01-01')"
+        )
+        db.session.commit()
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert "Applied migration 3:" in result.output
+
+    with app.app_context():
+        assert [bs.version for bs in BorrowState.query.all()] == [1, 1]
+
+
+def test_db_upgrade_builds_open_borrow_aggregates(runner, app):
+    with app.app_context():
+        db.session.execute("DROP TABLE item_open_borrows")
+        db.session.execute(
+            "INSERT INTO schema_migration (version, description, applied_at) "
+            "VALUES (1, '', '2020-01-01'), (2, '', '2020-01-01'), "
+            "(3, '', '2020-01-01')"
+        )
+        db.session.commit()
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert "Applied migration 4:" in result.output
+
+    with app.app_context():
+        rows = ItemOpenBorrows.query.order_by(ItemOpenBorrows.item_id)
+        assert [(r.item_id, r.open_quantity, r.borrower_count) for r in rows] == [
+            (1, 1, 1),
+            (3, 1, 1),
+        ]
+
+
+def test_db_upgrade_builds_user_aggregates_and_overdue_index(runner, app):
+    with app.app_context():
+        db.session.execute("DROP TABLE user_open_borrows")
+        db.session.execute("DROP INDEX ix_borrow_state_open_item_received_at")
+        db.session.execute(
+            "INSERT INTO schema_migration (version, description, applied_at) "
+            "VALUES (1, '', '2020-01-01'), (2, '', '2020-01-01'), "
+            "(3, '', '2020-01-01'), (4, '', '2020-01-01')"
+        )
+        db.session.commit()
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert "Applied migration 5:" in result.output
+
+    with app.app_context():
+        rows = UserOpenBorrows.query.all()
+        assert [(r.user_id, r.open_quantity, r.item_count) for r in rows] == [(1, 2, 2)]
+        indexes = [i["name"] for i in inspect(db.engine).get_indexes("borrow_state")]
+        assert "ix_borrow_state_open_item_received_at" in indexes
+
+
+def test_db_upgrade_counts_error_reports(runner, app):
+    with app.app_context():
+        db.session.execute("ALTER TABLE javascript_error DROP COLUMN occurrences")
+        db.session.execute(
+            "INSERT INTO schema_migration (version, description, applied_at) "
+            "VALUES (1, '', '2020-01-01'), (2, '', '2020-01-01'), "
+            "(3, '', '2020-01-01'), (4, '', '2020-01-01'), (5, '', '2020-01-01')"
+        )
+        db.session.commit()
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert "Applied migration 6:" in result.output
+
+    with app.app_context():
+        columns = inspect(db.engine).get_columns("javascript_error")
+        assert "occurrences" in [column["name"] for column in columns]
+
+
+def test_db_upgrade_adds_archive_tables(runner, app):
+    with app.app_context():
+        db.session.execute("DROP TABLE borrow_state_archive")
+        db.session.execute(
+            "INSERT INTO schema_migration (version, description, applied_at) "
+            "VALUES (1, '', '2020-01-01'), (2, '', '2020-01-01'), "
+            "(3, '', '2020-01-01'), (4, '', '2020-01-01'), (5, '', '2020-01-01'), "
+            "(6, '', '2020-01-01')"
+        )
+        db.session.commit()
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert "Applied migration 7:" in result.output
+
+    with app.app_context():
+        assert "borrow_state_archive" in inspect(db.engine).get_table_names()
+
+
+def test_db_upgrade_creates_current_schema_from_scratch(runner, app):
+    with app.app_context():
+        db.drop_all()
+
+    result = runner.invoke(args=["db-upgrade"])
+    assert result.exit_code == 0
+    assert applied_versions(app) == sorted(MIGRATIONS)
+
+    with app.app_context():
+        inspector = inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            assert columns == set(table.columns.keys())
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            assert indexes == {index.name for index in table.indexes}
+        versions = db.session.execute("SELECT name, version FROM collection_version")
+        assert sorted(versions) == [
+            ("items", 0),
+            ("items_stock", 0),
+            ("qualifications", 0),
+            ("users", 0),
+        ]
@@ -0,0 +1,114 @@
+import pytest
+
+from inventorymgr import create_app, passwords
+from inventorymgr.auth import is_password_correct
+from inventorymgr.db import db
+from inventorymgr.db.models import User
+from inventorymgr.passwords import (
+    PasswordHasher,
+    Pbkdf2Hasher,
+    ScryptHasher,
+    calibrate,
+    get_password_hashing,
+    verify_password,
+)
+
+
+@pytest.mark.parametrize(
+    "hasher",
+    [
+        Pbkdf2Hasher("sha256", 1000),
+        Pbkdf2Hasher("sha512", 1000),
+        ScryptHasher(1024, 8, 1),
+    ],
+)
+def test_hashers(hasher):
+    password_hash = hasher.hash("secret")
+    assert password_hash != hasher.hash("secret")
+    assert hasher.verify(password_hash, "secret")
+    assert not hasher.verify(password_hash, "wrong")
+    assert verify_password(password_hash, "secret")
+
+
+def test_partial_hasher_cannot_be_instantiated():
+    class HashOnly(PasswordHasher):
+        def hash(self, password):
+            return password
+
+    with pytest.raises(TypeError):
+        HashOnly()
+
+
+def test_verify_invalid_scrypt_hash():
+    assert not verify_password("scrypt:1024$abc", "secret")
+
+
+def test_with_cost_rounds_to_valid_cost():
+    assert Pbkdf2Hasher("sha256", 1000).with_cost(123456).iterations == 123000
+    assert ScryptHasher(1024, 8, 1).with_cost(20000).n == 16384
+
+
+def test_calibrate(monkeypatch):
+    # Hashing takes one second per million iterations.
+    monkeypatch.setattr(
+        passwords, "time_hasher", lambda hasher, rounds: hasher.cost / 1e6
+    )
+    assert calibrate(Pbkdf2Hasher("sha256", 150000), 0.25, 1).cost == 250000
+    assert calibrate(ScryptHasher(1024, 8, 1), 0.02, 1).cost == 16384
+
+
+@pytest.fixture
+def scrypt_app(app):
+    app.config.update(
+        PASSWORD_HASH_METHOD="scrypt",
+        PASSWORD_HASH_SCRYPT_N=1024,
+        PASSWORD_HASH_WORKERS=1,
+    )
+    passwords.init_app(app)
+    return app
+
+
+def test_new_passwords_use_configured_method(scrypt_app):
+    with scrypt_app.app_context():
+        hashing = get_password_hashing()
+        password_hash = hashing.hash("secret")
+        assert password_hash.startswith("scrypt:1024:8:1$")
+        assert hashing.dummy_hash.startswith("scrypt:1024:8:1$")
+        db.session.add(User(username="new", password=password_hash))
+        db.session.commit()
+
+        assert is_password_correct("new", "secret")
+        # Existing hashes of other methods remain valid.
+        assert is_password_correct("test", "test")
+        assert not is_password_correct("unknown", "secret")
+
+
+def test_login_fails_while_hashing_is_busy(client, app):
+    app.config["PASSWORD_HASH_MAX_PENDING"] = 0
+    passwords.init_app(app)
+    response = client.post(
+        "/api/v1/auth/login", json={"username": "test", "password": "test"}
+    )
+    assert response.status_code == 503
+    assert response.json == {"reason": "password_hashing_busy"}
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        create_app({"PASSWORD_HASH_METHOD": "md5"})
+
+
+def test_benchmark_hash_command(runner, app, monkeypatch):
+    monkeypatch.setattr(
+        passwords, "time_hasher", lambda hasher, rounds: hasher.cost / 1e6
+    )
+    result = runner.invoke(
+        args=["benchmark-hash", "--target-ms", "10", "--method", "scrypt"]
+    )
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "Configured cost 16384: 16ms per hash",
+        "Calibrated cost 8192: 8ms per hash",
+        'PASSWORD_HASH_METHOD = "scrypt"',
+        "PASSWORD_HASH_SCRYPT_N = 8192",
+    ]
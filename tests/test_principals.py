@@ -0,0 +1,125 @@
+import pytest
+
+from inventorymgr import principals
+from inventorymgr.principals import (
+    LRUPrincipalCache,
+    Principal,
+    PrincipalCacheBackend,
+)
+
+
+class DictPrincipalCache(PrincipalCacheBackend):
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, user_id):
+        return self.entries.get(user_id)
+
+    def set(self, user_id, principal):
+        self.entries[user_id] = principal
+
+    def delete(self, user_id):
+        self.entries.pop(user_id, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
+@pytest.fixture
+def principal_cache(app):
+    backend = DictPrincipalCache()
+    app.config["PRINCIPAL_CACHE"] = backend
+    principals.init_app(app)
+    return backend
+
+
+def make_principal(user_id):
+    return Principal(user_id, True, True, True, True, True, True, frozenset())
+
+
+def test_principal_cache_disabled_by_default(client, auth):
+    auth.login("test")
+    response = client.get("/api/v1/auth/principal-cache")
+    assert response.status_code == 200
+    assert response.json == {"enabled": False}
+
+
+def test_warm_principal_cache_skips_database(
+    client, auth, principal_cache, count_statements
+):
+    auth.login("test")
+    client.get("/api/v1/items")
+    assert principal_cache.entries[1].qualification_ids == frozenset({1})
+
+    count_statements.statements.clear()
+    response = client.get("/api/v1/items")
+    assert response.status_code == 200
+    assert not [s for s in count_statements.statements if "FROM user" in s]
+
+    response = client.get("/api/v1/auth/principal-cache")
+    assert response.json == {"enabled": True, "hits": 2, "misses": 1}
+
+
+def test_update_self_invalidates_principal(client, auth, principal_cache):
+    auth.login("test")
+    response = client.get("/api/v1/users/me")
+    user, etag = response.json, response.headers["ETag"]
+    assert 1 in principal_cache.entries
+
+    user["create_items"] = False
+    response = client.put("/api/v1/users/me", json=user, headers={"If-Match": etag})
+    assert response.status_code == 200
+    assert 1 not in principal_cache.entries
+
+    response = client.post("/api/v1/items", json={"name": "denied"})
+    assert response.status_code == 403
+    assert response.json["reason"] == "insufficient_permissions"
+
+
+def test_update_user_invalidates_principal(client, auth, principal_cache):
+    principal_cache.set(2, make_principal(2))
+    auth.login("test")
+    response = client.get("/api/v1/users/2")
+    user, etag = response.json, response.headers["ETag"]
+    response = client.put("/api/v1/users/2", json=user, headers={"If-Match": etag})
+    assert response.status_code == 200
+    assert 2 not in principal_cache.entries
+
+
+def test_delete_user_invalidates_principal(client, auth, principal_cache):
+    principal_cache.set(2, make_principal(2))
+    auth.login("test")
+    client.delete("/api/v1/users/2")
+    assert 2 not in principal_cache.entries
+
+
+def test_delete_qualification_invalidates_principals(client, auth, principal_cache):
+    auth.login("test")
+    client.get("/api/v1/users/me")
+    principal_cache.set(2, make_principal(2))
+    response = client.delete(
+        "/api/v1/qualifications/1", json={"id": 1, "name": "Driver's License"}
+    )
+    assert response.status_code == 200
+    assert not principal_cache.entries
+
+
+def test_lru_principal_cache_expires_entries():
+    now = [0.0]
+    cache = LRUPrincipalCache(max_size=2, ttl=10, clock=lambda: now[0])
+    cache.set(1, make_principal(1))
+    assert cache.get(1) == make_principal(1)
+    now[0] = 10.0
+    assert cache.get(1) is None
+    assert len(cache) == 0
+
+
+def test_lru_principal_cache_evicts_least_recently_used():
+    cache = LRUPrincipalCache(max_size=2, ttl=10)
+    cache.set(1, make_principal(1))
+    cache.set(2, make_principal(2))
+    cache.get(1)
+    cache.set(3, make_principal(3))
+    assert cache.get(1) is not None
+    assert cache.get(2) is None
+    assert cache.get(3) is not None
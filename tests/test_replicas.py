@@ -0,0 +1,106 @@
+import pytest
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from inventorymgr import create_app
+from inventorymgr.db import db
+from inventorymgr.db.models import BorrowableItem, User
+from inventorymgr.db.routing import REPLICA_BIND
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    db_path = tmp_path / "primary.sqlite"
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+            "SQLALCHEMY_REPLICA_URI": (
+                f"sqlite+pysqlite:///file:{db_path}?mode=ro&uri=true"
+            ),
+        }
+    )
+    with app.app_context():
+        db.create_all()
+        db.session.add(
+            User(
+                username="test",
+                password=generate_password_hash("test"),
+                create_items=True,
+                manage_checkouts=True,
+            )
+        )
+        db.session.add(BorrowableItem(name="existing_item"))
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def engine_statements(replica_app):
+    statements = {"primary": [], "replica": []}
+
+    def recorder(name):
+        def record(conn, cursor, statement, *args):
+            statements[name].append(statement)
+
+        return record
+
+    with replica_app.app_context():
+        engines = {
+            "primary": db.engine,
+            "replica": db.get_engine(replica_app, bind=REPLICA_BIND),
+        }
+    for name, engine in engines.items():
+        event.listen(engine, "before_cursor_execute", recorder(name))
+    return statements
+
+
+@pytest.fixture
+def replica_client(replica_app):
+    client = replica_app.test_client()
+    client.post("/api/v1/auth/login", json={"username": "test", "password": "test"})
+    return client
+
+
+def test_list_views_read_from_replica(replica_client, engine_statements):
+    for url in ["/api/v1/items", "/api/v1/borrowstates", "/api/v1/logs"]:
+        assert replica_client.get(url).status_code == 200
+    assert engine_statements["replica"]
+    assert engine_statements["primary"] == []
+
+
+def test_other_views_read_from_primary(replica_client, engine_statements):
+    assert replica_client.get("/api/v1/items/1").status_code == 200
+    assert engine_statements["primary"]
+    assert engine_statements["replica"] == []
+
+
+def test_reads_after_write_stick_to_primary(
+    replica_app, replica_client, engine_statements
+):
+    response = replica_client.post(
+        "/api/v1/items",
+        json={
+            "name": "new_item",
+            "quantity_total": 1,
+            "quantity_in_stock": 1,
+            "unmatched_returns": 0,
+            "description": "",
+            "required_qualifications": [],
+        },
+    )
+    assert response.status_code == 200
+    assert engine_statements["replica"] == []
+
+    response = replica_client.get("/api/v1/items")
+    assert "new_item" in [item["name"] for item in response.json["items"]]
+    assert engine_statements["replica"] == []
+
+    with replica_client.session_transaction() as session:
+        session["primary_reads_until"] = 0
+    assert replica_client.get("/api/v1/items").status_code == 200
+    assert engine_statements["replica"]
+
+
+def test_replica_disabled_by_default(app):
+    assert REPLICA_BIND not in (app.config["SQLALCHEMY_BINDS"] or {})
@@ -0,0 +1,105 @@
+import datetime
+import threading
+
+import pytest
+
+from inventorymgr.db import db
+from inventorymgr.db.models import (
+    ArchivedBorrowState,
+    BorrowState,
+    JavascriptError,
+    LogEntry,
+)
+from inventorymgr.db.logarchive import ArchivedItem, get_log_archive
+from inventorymgr.db.retention import _run_scheduler, compact
+
+
+@pytest.fixture
+def history(app, monkeypatch):
+    monkeypatch.setattr(
+        "inventorymgr.db.retention._utcnow", lambda: datetime.datetime(2021, 1, 10)
+    )
+    app.config["RETENTION_LOGS_DAYS"] = 365
+    with app.app_context():
+        for day in range(1, 6):
+            returned_at = datetime.datetime(2020, 1, day)
+            db.session.add(
+                BorrowState(
+                    borrowing_user_id=2,
+                    borrowed_item_id=2,
+                    quantity=1,
+                    received_at=returned_at - datetime.timedelta(days=1),
+                    returned_at=returned_at,
+                )
+            )
+            db.session.add(
+                JavascriptError(
+                    timestamp=datetime.datetime(2020, 10, day),
+                    user_agent_raw="",
+                    location="/",
+                )
+            )
+        db.session.add(
+            LogEntry(
+                timestamp=datetime.datetime(2020, 6, 1),
+                action="checkin",
+                subject_id=2,
+            )
+        )
+        db.session.commit()
+
+
+def test_compact_command(runner, app, history):
+    result = runner.invoke(args=["compact", "--batch-size", "2"])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "borrowstates: 2 rows",
+        "borrowstates: 4 rows",
+        "borrowstates: 5 rows",
+        "logs: 1 rows",
+        "js_errors: 2 rows",
+        "js_errors: 4 rows",
+        "js_errors: 5 rows",
+        "Compacted borrowstates 5, logs 1, js_errors 5.",
+    ]
+
+    with app.app_context():
+        # Open borrow states are kept regardless of their age.
+        assert [bs.id for bs in BorrowState.query.order_by(BorrowState.id)] == [1, 2]
+        archived = ArchivedBorrowState.query.order_by(ArchivedBorrowState.id).all()
+        assert [bs.id for bs in archived] == [3, 4, 5, 6, 7]
+        assert archived[0].returned_at == datetime.datetime(2020, 1, 1)
+        assert JavascriptError.query.count() == 0
+
+        assert [entry.id for entry in LogEntry.query] == [2]
+        assert db.session.query(LogEntry.items.property.secondary).count() == 0
+        (archived_log,) = get_log_archive().entries({})
+        assert archived_log.id == 1
+        assert archived_log.items == [ArchivedItem(1)]
+
+
+def test_compact_keeps_rows_without_retention_period(app, history):
+    app.config["RETENTION_BORROWSTATES_DAYS"] = None
+    app.config["RETENTION_LOGS_DAYS"] = None
+    app.config["RETENTION_JS_ERRORS_DAYS"] = 97
+    with app.app_context():
+        assert compact() == {"js_errors": 4}
+        assert BorrowState.query.count() == 7
+        assert LogEntry.query.count() == 2
+        assert compact() == {"js_errors": 0}
+
+
+def test_compact_scheduler(app, history):
+    stop = threading.Event()
+    done = []
+
+    def compact_once(*args):
+        done.append(compact(*args))
+        stop.set()
+
+    scheduler = threading.Thread(target=_run_scheduler, args=(app, 0.01, stop))
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr("inventorymgr.db.retention.compact", compact_once)
+        scheduler.start()
+        scheduler.join(5)
+    assert done == [{"borrowstates": 5, "logs": 1, "js_errors": 5}]
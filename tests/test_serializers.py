@@ -0,0 +1,52 @@
+import datetime
+import json
+
+import pytest
+from marshmallow import Schema, fields, post_dump
+
+from inventorymgr.api.models import (
+    BorrowableItemSchema,
+    BorrowStateSchema,
+    LogEntrySchema,
+    UserSchema,
+)
+from inventorymgr.api.serializers import dump_many
+from inventorymgr.db import db
+from inventorymgr.db.models import (
+    BorrowableItem,
+    BorrowState,
+    LogEntry,
+    User,
+)
+
+
+@pytest.mark.parametrize(
+    "model,schema",
+    [
+        (BorrowableItem, BorrowableItemSchema(many=True)),
+        (User, UserSchema(many=True)),
+        (BorrowState, BorrowStateSchema(many=True)),
+        (LogEntry, LogEntrySchema(many=True)),
+        (User, UserSchema(many=True, only=("id", "username"))),
+    ],
+)
+def test_dump_many_matches_schema_dump(app, model, schema):
+    with app.app_context():
+        BorrowState.query.get(2).returned_at = datetime.datetime(2020, 1, 3, 4, 5)
+        BorrowableItem.query.get(1).description = "A description"
+        db.session.commit()
+        objs = model.query.all()
+        expected = json.dumps(schema.dump(objs), sort_keys=True)
+        assert json.dumps(dump_many(schema, objs), sort_keys=True) == expected
+
+
+def test_dump_many_rejects_pass_many_hooks():
+    class PassManySchema(Schema):
+        id = fields.Integer()
+
+        @post_dump(pass_many=True)
+        def wrap(self, data, many, **kwargs):
+            return {"data": data}
+
+    with pytest.raises(ValueError):
+        dump_many(PassManySchema(many=True), [])
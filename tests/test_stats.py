@@ -0,0 +1,82 @@
+import datetime
+
+import pytest
+
+from inventorymgr.db import db
+
+
+@pytest.fixture
+def now(monkeypatch):
+    current = {"now": datetime.datetime(2020, 1, 10)}
+    monkeypatch.setattr("inventorymgr.stats._utcnow", lambda: current["now"])
+    return current
+
+
+def test_inventory_stats_unauthenticated(client):
+    response = client.get("/api/v1/stats/inventory")
+    assert response.status_code == 403
+    assert response.json["reason"] == "authentication_required"
+
+
+def test_inventory_stats_insufficient_permissions(client, auth):
+    auth.login("min_permissions_user")
+    response = client.get("/api/v1/stats/inventory")
+    assert response.status_code == 403
+    assert response.json["reason"] == "insufficient_permissions"
+
+
+def test_inventory_stats(client, auth, now):
+    auth.login("test")
+    response = client.get("/api/v1/stats/inventory")
+    assert response.status_code == 200
+    items = response.json["items"]
+    assert [item["id"] for item in items] == [1, 2, 3, 4]
+    assert items[0] == {
+        "id": 1,
+        "name": "existing_item",
+        "quantity_total": 1,
+        "quantity_in_stock": 1,
+        "quantity_borrowed": 1,
+        "unmatched_returns": 0,
+        "borrower_count": 1,
+    }
+    assert [item["quantity_borrowed"] for item in items] == [1, 0, 1, 0]
+    assert response.json["users"] == [
+        {"id": 1, "username": "test", "quantity_borrowed": 2, "item_count": 2}
+    ]
+    assert response.json["overdue"] == []
+    assert response.json["overdue_before"] == "2019-12-27T00:00:00"
+
+    now["now"] = datetime.datetime(2020, 1, 20)
+    response = client.get("/api/v1/stats/inventory")
+    assert response.json["overdue"] == [
+        {"item_id": 1, "quantity": 1, "since": "2020-01-02T12:34:56"},
+        {"item_id": 3, "quantity": 1, "since": "2020-01-02T12:34:57"},
+    ]
+
+
+def test_inventory_stats_follow_checkin(client, auth, now):
+    auth.login("test")
+    response = client.post(
+        "/api/v1/borrowstates/checkin",
+        json={"user_id": 1, "item_ids": [{"id": 1, "count": 1}]},
+    )
+    assert response.status_code == 200
+
+    response = client.get("/api/v1/stats/inventory")
+    assert response.json["items"][0]["quantity_borrowed"] == 0
+    assert response.json["users"] == [
+        {"id": 1, "username": "test", "quantity_borrowed": 1, "item_count": 1}
+    ]
+
+
+def test_overdue_borrowstates_use_covering_partial_index(app):
+    with app.app_context():
+        plan = db.session.execute(
+            "EXPLAIN QUERY PLAN "
+            "SELECT borrowed_item_id, SUM(quantity), MIN(received_at) "
+            "FROM borrow_state WHERE returned_at IS NULL AND received_at < '2020-01-01' "
+            "GROUP BY borrowed_item_id"
+        ).fetchall()
+    plan = " ".join(row[-1] for row in plan)
+    assert "COVERING INDEX ix_borrow_state_open_item_received_at" in plan
@@ -149,7 +149,9 @@ def test_updating_user(client, app, test_user, auth):
     auth.login("test")
     test_user["username"] = "test_1"
     test_user["password"] = "123456"
-    response = client.put("/api/v1/users/1", json=test_user)
+    response = client.put(
+        "/api/v1/users/1", json=test_user, headers=if_match(app, id=1)
+    )
     assert response.status_code == 200
     assert response.is_json
     assert response.json["username"] == "test_1"
@@ -167,7 +169,9 @@ def test_updating_user_except_password(client, app, test_user, auth):
     auth.login("test")
     test_user["username"] = "test_1"
     del test_user["password"]
-    response = client.put("/api/v1/users/1", json=test_user)
+    response = client.put(
+        "/api/v1/users/1", json=test_user, headers=if_match(app, id=1)
+    )
     assert response.status_code == 200
     assert response.is_json
     assert response.json["username"] == "test_1"
@@ -189,7 +193,9 @@ def test_updating_user_permissions_not_subset(client, app, test_user, auth):
 
     auth.login("test")
     test_user.update({"password": "123456"})
-    response = client.put("/api/v1/users/1", json=test_user)
+    response = client.put(
+        "/api/v1/users/1", json=test_user, headers=if_match(app, id=1)
+    )
     assert response.status_code == 403
     assert response.is_json
     assert response.json["reason"] == "permissions_not_subset"
@@ -210,7 +216,9 @@ def test_updating_user_permissions_subset(client, app, test_user, auth):
     test_user.update(
         {"password": "123456", "edit_qualifications": False, "update_users": False,}
     )
-    response = client.put("/api/v1/users/1", json=test_user)
+    response = client.put(
+        "/api/v1/users/1", json=test_user, headers=if_match(app, id=1)
+    )
     assert response.status_code == 200
     assert response.is_json
     assert response.json["username"] == "test"
@@ -237,7 +245,9 @@ def test_updating_user_with_more_permissions(client, app, test_user, auth):
     test_user.update(
         {"username": "changed",}
     )
-    response = client.put("/api/v1/users/1", json=test_user)
+    response = client.put(
+        "/api/v1/users/1", json=test_user, headers=if_match(app, id=1)
+    )
     assert response.status_code == 200
     assert response.is_json
     assert response.json["username"] == "changed"
@@ -300,19 +310,23 @@ def test_updating_nonexistant_user(client, app, test_user, auth):
         assert count_users_with_name(test_user["username"]) == 0
 
 
-def test_updating_user_to_existing_name(client, auth, test_user):
+def test_updating_user_to_existing_name(client, app, auth, test_user):
     auth.login("test")
     test_user["id"] = 2
-    response = client.put("/api/v1/users/2", json=test_user)
+    response = client.put(
+        "/api/v1/users/2", json=test_user, headers=if_match(app, id=2)
+    )
     assert response.status_code == 400
     assert response.is_json
     assert response.json["reason"] == "user_exists"
 
 
-def test_updating_user_unknown_qualification(client, auth, test_user):
+def test_updating_user_unknown_qualification(client, app, auth, test_user):
     auth.login("test")
     test_user["qualifications"] = [{"id": 2, "name": "some_unknown_qualification"}]
-    response = client.put("/api/v1/users/1", json=test_user)
+    response = client.put(
+        "/api/v1/users/1", json=test_user, headers=if_match(app, id=1)
+    )
     assert response.status_code == 400
     assert response.is_json
     assert response.json["reason"] == "unknown_qualification"
@@ -338,7 +352,9 @@ def test_updating_unqualified_users_without_edit_qualifications(
             "qualifications": [],
         }
     )
-    response = client.put("/api/v1/users/2", json=test_user)
+    response = client.put(
+        "/api/v1/users/2", json=test_user, headers=if_match(app, id=2)
+    )
     assert response.status_code == 200
     assert response.is_json
     assert response.json["username"] == "changed"
@@ -371,7 +387,9 @@ def test_updating_qualified_users_without_edit_qualifications(
             "edit_qualifications": False,
         }
     )
-    response = client.put("/api/v1/users/2", json=test_user)
+    response = client.put(
+        "/api/v1/users/2", json=test_user, headers=if_match(app, id=2)
+    )
     assert response.status_code == 403
     assert response.is_json
     assert response.json["reason"] == "insufficient_permissions"
@@ -396,7 +414,9 @@ def test_updating_qualified_users_with_edit_qualifications(
             "qualifications": [{"id": 1, "name": "Driver's License"}],
         }
     )
-    response = client.put("/api/v1/users/2", json=test_user)
+    response = client.put(
+        "/api/v1/users/2", json=test_user, headers=if_match(app, id=2)
+    )
     assert response.status_code == 200
     assert response.is_json
     assert response.json["username"] == "changed"
@@ -585,6 +605,7 @@ def test_update_self_username(client, app, auth):
             "manage_checkouts": False,
             "qualifications": [],
         },
+        headers=if_match(app, username="min_permissions_user"),
     )
     assert response.status_code == 200
     assert response.is_json
@@ -611,6 +632,7 @@ def test_update_self_password(client, app, auth):
             "manage_checkouts": False,
             "qualifications": [],
         },
+        headers=if_match(app, username="min_permissions_user"),
     )
     assert response.status_code == 200
     assert response.is_json
@@ -636,6 +658,7 @@ def test_update_self_set_permissions_fail(client, app, auth):
             "manage_checkouts": False,
             "qualifications": [],
         },
+        headers=if_match(app, username="min_permissions_user"),
     )
     assert response.status_code == 403
     assert response.is_json
@@ -660,6 +683,7 @@ def test_update_self_set_permissions_and_qualifications(client, app, auth):
             "manage_checkouts": False,
             "qualifications": [{"id": 1, "name": "Driver's License"}],
         },
+        headers=if_match(app, username="test"),
     )
     assert response.status_code == 200
     assert response.is_json
@@ -685,6 +709,7 @@ def test_update_self_give_more_qualifications_fail(client, app, auth):
             "manage_checkouts": False,
             "qualifications": [{"id": 1, "name": "Driver's License"}],
         },
+        headers=if_match(app, username="min_permissions_user"),
     )
     assert response.status_code == 403
     assert response.is_json
@@ -758,7 +783,9 @@ def test_accesscontrol_honors_changed_permissions(client, auth, app, test_user):
             "qualifications": [],
         }
     )
-    response = client.put("/api/v1/users/1", json=test_user)
+    response = client.put(
+        "/api/v1/users/1", json=test_user, headers=if_match(app, id=1)
+    )
     assert response.status_code == 200
     assert response.is_json
 
@@ -797,3 +824,56 @@ def test_get_user_success(client, auth):
 
 def count_users_with_name(username):
     return User.query.filter_by(username=username).count()
+
+
+def if_match(app, **filter_by):
+    with app.app_context():
+        user = User.query.filter_by(**filter_by).one()
+        return {"If-Match": f'"{user.version}"'}
+
+
+def test_import_users_command(runner, app, tmp_path):
+    source = tmp_path / "users.csv"
+    source.write_text(
+        "username,password,manage_checkouts,qualifications\n"
+        "worker1,secret1,true,Driver's License\n"
+        "worker2,secret2,,\n"
+        "test,secret3,,\n"
+        "worker3,,,\n"
+        "worker4,secret4,,unknown\n"
+        "worker5,secret5,false,1\n"
+    )
+    result = runner.invoke(
+        args=["import-users", "--batch-size", "2", "--workers", "2", str(source)]
+    )
+    assert result.exit_code == 0
+    assert "Row 4:" in result.output
+    assert "Row 5:" in result.output
+    assert "Row 6:" in result.output
+    assert "Created 3, failed 3 users" in result.output
+
+    with app.app_context():
+        assert is_password_correct("worker1", "secret1")
+        assert is_password_correct("worker2", "secret2")
+        worker1 = User.query.filter_by(username="worker1").one()
+        assert worker1.manage_checkouts
+        assert not worker1.create_users
+        assert [q.name for q in worker1.qualifications] == ["Driver's License"]
+        worker5 = User.query.filter_by(username="worker5").one()
+        assert [q.id for q in worker5.qualifications] == [1]
+        assert User.query.filter_by(username="worker4").count() == 0
+
+
+def test_import_users_ndjson(runner, app, tmp_path):
+    source = tmp_path / "users.ndjson"
+    source.write_text(
+        '{"username": "worker", "password": "secret", "create_items": true}\n'
+        '{"username": "worker", "password": "other"}\n'
+    )
+    result = runner.invoke(args=["import-users", str(source)])
+    assert "Row 2:" in result.output
+    assert "Created 1, failed 1 users" in result.output
+
+    with app.app_context():
+        assert is_password_correct("worker", "secret")
+        assert User.query.filter_by(username="worker").one().create_items
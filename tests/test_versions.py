@@ -0,0 +1,266 @@
+import datetime
+
+import pytest
+from sqlalchemy import event
+
+from inventorymgr.db import db
+from inventorymgr.db.models import (
+    BorrowableItem,
+    BorrowState,
+    CollectionVersion,
+    LogEntry,
+)
+
+
+def get_etag(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-cache"
+    return response.headers["ETag"]
+
+
+@pytest.mark.parametrize(
+    "url", ["/api/v1/items", "/api/v1/qualifications", "/api/v1/users"]
+)
+def test_matching_etag_returns_not_modified(client, auth, count_statements, url):
+    auth.login("test")
+    etag = get_etag(client, url)
+
+    count_statements.statements.clear()
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+    assert len(count_statements.statements) == 2
+    assert "collection_version" in count_statements.statements[1]
+
+
+def test_query_string_changes_etag(client, auth):
+    auth.login("test")
+    assert get_etag(client, "/api/v1/items") != get_etag(
+        client, "/api/v1/items?fields=id,name"
+    )
+
+
+def test_creating_item_changes_etag(client, auth):
+    auth.login("test")
+    etag = get_etag(client, "/api/v1/items")
+    response = client.post(
+        "/api/v1/items",
+        json={
+            "name": "new_item",
+            "quantity_total": 1,
+            "quantity_in_stock": 1,
+            "unmatched_returns": 0,
+            "description": "",
+            "required_qualifications": [],
+        },
+    )
+    assert response.status_code == 200
+    response = client.get("/api/v1/items", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_checkout_changes_items_etag(client, auth):
+    auth.login("test")
+    items_etag = get_etag(client, "/api/v1/items")
+    users_etag = get_etag(client, "/api/v1/users")
+    response = client.post(
+        "/api/v1/borrowstates/checkout",
+        json={"borrowing_user_id": 1, "borrowed_item_ids": [{"id": 4, "count": 1}]},
+    )
+    assert response.status_code == 200
+    assert get_etag(client, "/api/v1/items") != items_etag
+    assert get_etag(client, "/api/v1/users") == users_etag
+
+
+def test_checkout_does_not_bump_items_counter(client, auth, app):
+    auth.login("test")
+    response = client.post(
+        "/api/v1/borrowstates/checkout",
+        json={"borrowing_user_id": 1, "borrowed_item_ids": [{"id": 4, "count": 1}]},
+    )
+    assert response.status_code == 200
+    with app.app_context():
+        assert CollectionVersion.query.get("items").version == 0
+        assert CollectionVersion.query.get("items_stock").version == 1
+
+
+def test_renaming_qualification_changes_all_etags(client, auth):
+    auth.login("test")
+    urls = ["/api/v1/items", "/api/v1/qualifications", "/api/v1/users"]
+    etags = [get_etag(client, url) for url in urls]
+    response = client.put(
+        "/api/v1/qualifications/1", json={"id": 1, "name": "Forklift License"}
+    )
+    assert response.status_code == 200
+    for url, etag in zip(urls, etags):
+        assert get_etag(client, url) != etag
+
+
+def test_updating_self_changes_users_etag(client, auth):
+    auth.login("test")
+    etag = get_etag(client, "/api/v1/users")
+    user, if_match = get_for_update(client, "/api/v1/users/me")
+    user["username"] = "renamed"
+    response = client.put(
+        "/api/v1/users/me", json=user, headers={"If-Match": if_match}
+    )
+    assert response.status_code == 200
+    assert get_etag(client, "/api/v1/users") != etag
+
+
+def test_failed_create_does_not_change_version(client, auth, app):
+    auth.login("test")
+    response = client.post(
+        "/api/v1/items",
+        json={
+            "name": "existing_item",
+            "quantity_total": 1,
+            "quantity_in_stock": 1,
+            "unmatched_returns": 0,
+            "description": "",
+            "required_qualifications": [],
+        },
+    )
+    assert response.status_code == 400
+    with app.app_context():
+        assert CollectionVersion.query.get("items").version == 0
+
+
+def get_for_update(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    data = response.json
+    data.pop("barcode")
+    return data, response.headers["ETag"]
+
+
+def test_update_item_checks_if_match(client, auth, app):
+    auth.login("test")
+    item, etag = get_for_update(client, "/api/v1/items/4")
+    assert etag == '"1"'
+
+    item["description"] = "first"
+    response = client.put("/api/v1/items/4", json=item, headers={"If-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"2"'
+
+    item["description"] = "second"
+    response = client.put("/api/v1/items/4", json=item, headers={"If-Match": etag})
+    assert response.status_code == 409
+    assert response.json["reason"] == "version_conflict"
+    with app.app_context():
+        assert BorrowableItem.query.get(4).description == "first"
+
+
+def test_checkout_changes_item_version(client, auth):
+    auth.login("test")
+    item, etag = get_for_update(client, "/api/v1/items/4")
+    response = client.post(
+        "/api/v1/borrowstates/checkout",
+        json={"borrowing_user_id": 1, "borrowed_item_ids": [{"id": 4, "count": 1}]},
+    )
+    assert response.status_code == 200
+    item["description"] = "stale"
+    response = client.put("/api/v1/items/4", json=item, headers={"If-Match": etag})
+    assert response.status_code == 409
+
+
+def test_update_item_requires_if_match(client, auth, app):
+    auth.login("test")
+    item, _ = get_for_update(client, "/api/v1/items/4")
+    response = client.post(
+        "/api/v1/borrowstates/checkout",
+        json={"borrowing_user_id": 1, "borrowed_item_ids": [{"id": 4, "count": 1}]},
+    )
+    assert response.status_code == 200
+    item["description"] = "lost"
+    response = client.put("/api/v1/items/4", json=item)
+    assert response.status_code == 428
+    assert response.json["reason"] == "precondition_required"
+    with app.app_context():
+        stock = BorrowableItem.query.get(4).quantity_in_stock
+    assert stock == item["quantity_in_stock"] - 1
+
+
+def test_update_self_requires_if_match(client, auth):
+    auth.login("test")
+    user, _ = get_for_update(client, "/api/v1/users/me")
+    response = client.put("/api/v1/users/me", json=user)
+    assert response.status_code == 428
+
+
+def test_update_self_checks_if_match(client, auth):
+    auth.login("test")
+    user, etag = get_for_update(client, "/api/v1/users/me")
+    user["username"] = "renamed"
+    response = client.put("/api/v1/users/me", json=user, headers={"If-Match": etag})
+    assert response.status_code == 200
+    user["username"] = "renamed_again"
+    response = client.put("/api/v1/users/me", json=user, headers={"If-Match": etag})
+    assert response.status_code == 409
+
+
+def test_qualification_change_increments_user_version(client, auth):
+    auth.login("test")
+    user, etag = get_for_update(client, "/api/v1/users/2")
+    user["qualifications"] = [{"id": 1, "name": "Driver's License"}]
+    response = client.put("/api/v1/users/2", json=user, headers={"If-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def concurrently(app, trigger, statement):
+    """Run statement on another connection right before trigger is executed."""
+    done = []
+
+    def run_other_statement(conn, cursor, executed, *args):
+        if executed.startswith(trigger) and not done:
+            done.append(executed)
+            with db.engine.connect() as other:
+                other.execute(statement)
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", run_other_statement)
+    return lambda: event.remove(db.engine, "before_cursor_execute", run_other_statement)
+
+
+def test_concurrent_item_update_conflicts(client, auth, app):
+    auth.login("test")
+    item, etag = get_for_update(client, "/api/v1/items/4")
+    remove = concurrently(
+        app,
+        "UPDATE borrowable_item SET description",
+        "UPDATE borrowable_item SET version = version + 1 WHERE id = 4",
+    )
+    try:
+        item["description"] = "lost"
+        response = client.put("/api/v1/items/4", json=item, headers={"If-Match": etag})
+    finally:
+        with app.app_context():
+            remove()
+    assert response.status_code == 409
+    assert response.json["reason"] == "version_conflict"
+
+
+def test_concurrent_checkin_conflicts(client, auth, app):
+    auth.login("test")
+    remove = concurrently(
+        app,
+        "UPDATE borrow_state SET returned_at",
+        "UPDATE borrow_state SET returned_at = '2020-01-05 00:00:00' WHERE id = 2",
+    )
+    try:
+        response = client.post(
+            "/api/v1/borrowstates/checkin",
+            json={"user_id": 1, "item_ids": [{"id": 3, "count": 1}]},
+        )
+    finally:
+        with app.app_context():
+            remove()
+    assert response.status_code == 409
+    with app.app_context():
+        assert BorrowState.query.get(2).returned_at == datetime.datetime(2020, 1, 5)
+        assert LogEntry.query.filter_by(action="checkin").count() == 0